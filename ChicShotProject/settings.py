@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import copy
 from pathlib import Path
 
+from decouple import Csv, config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ChicShot_Payment_App.tracing.RequestIdMiddleware',
+    'ChicShot_Payment_App.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,13 +86,86 @@ WSGI_APPLICATION = 'ChicShotProject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# DATABASE_ENGINE=postgresql for production; SQLite stays the default for
+# local development.
+
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='sqlite3')
+
+# With SQLITE_OPTIMIZED, ChicShot_Payment_App.db.configure_sqlite applies
+# these PRAGMAs to every new SQLite connection. WAL lets readers run
+# alongside the single writer; synchronous=NORMAL is durable in WAL mode
+# except for the last transactions before a power loss.
+SQLITE_OPTIMIZED = config('SQLITE_OPTIMIZED', default=True, cast=bool)
+SQLITE_BUSY_TIMEOUT_MS = config('SQLITE_BUSY_TIMEOUT_MS', default=5000, cast=int)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    'synchronous': 'NORMAL',
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+    'temp_store': 'MEMORY',
 }
 
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='chicshot'),
+            'USER': config('DB_USER', default='chicshot'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': config('DB_CONNECT_TIMEOUT', default=5, cast=int),
+            },
+        }
+    }
+    if config('DB_POOL', default=True, cast=bool):
+        # psycopg's pool keeps connections open itself, so Django must not
+        # (it rejects CONN_MAX_AGE > 0 together with a pool).
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=20, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+    if SQLITE_OPTIMIZED:
+        DATABASES['default']['OPTIONS'] = {
+            # Take the write lock when a transaction starts instead of on its
+            # first write, so two transactions that read first never deadlock
+            # on the upgrade and fail with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+        }
+
+# Read replicas of the PostgreSQL primary, e.g.
+# DB_REPLICA_HOSTS=replica-1.internal,replica-2.internal. Only reads inside
+# ChicShot_Payment_App.routers.use_replica() go to them, and reads about an
+# fb_id or intent written in the last REPLICA_STICKY_SECONDS stay on the
+# primary. Set REPLICA_STICKY_CACHE to a shared cache when running several
+# processes.
+DATABASE_REPLICAS = []
+if DATABASE_ENGINE == 'postgresql':
+    for index, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv())):
+        alias = f'replica_{index}'
+        DATABASES[alias] = copy.deepcopy(DATABASES['default'])
+        DATABASES[alias]['HOST'] = host
+        DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+        DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['ChicShot_Payment_App.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+REPLICA_STICKY_CACHE = config('REPLICA_STICKY_CACHE', default='default')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -110,6 +188,11 @@ AUTH_PASSWORD_VALIDATORS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [],
     'DEFAULT_PERMISSION_CLASSES': [],
+    # Trusted reverse proxies in front of the app. With 0 the client IP used
+    # by rate limits is REMOTE_ADDR; with N it is the address the outermost
+    # proxy added to X-Forwarded-For. Unset (None), DRF would trust whatever
+    # X-Forwarded-For the client sends.
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
 # Internationalization
@@ -133,3 +216,195 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Stripe webhooks
+# With STRIPE_WEBHOOK_QUEUE enabled the webhook view only verifies and stores
+# events; `manage.py process_webhooks` applies them to the payments table.
+
+# Endpoint signing secrets, read once here. While rotating, list both:
+# STRIPE_WEBHOOK_SECRETS=whsec_new,whsec_old. STRIPE_WEBHOOK_SECRET still
+# works for a single secret.
+STRIPE_WEBHOOK_SECRETS = config(
+    'STRIPE_WEBHOOK_SECRETS', default=config('STRIPE_WEBHOOK_SECRET', default=''), cast=Csv(),
+)
+# Oldest signature timestamp accepted, against replays; Stripe's default.
+STRIPE_WEBHOOK_TOLERANCE_SECONDS = config('STRIPE_WEBHOOK_TOLERANCE_SECONDS', default=300, cast=int)
+
+STRIPE_WEBHOOK_QUEUE = config('STRIPE_WEBHOOK_QUEUE', default=False, cast=bool)
+STRIPE_WEBHOOK_BATCH_SIZE = config('STRIPE_WEBHOOK_BATCH_SIZE', default=100, cast=int)
+STRIPE_WEBHOOK_CONCURRENCY = config('STRIPE_WEBHOOK_CONCURRENCY', default=4, cast=int)
+STRIPE_WEBHOOK_LEASE_SECONDS = config('STRIPE_WEBHOOK_LEASE_SECONDS', default=60, cast=int)
+STRIPE_WEBHOOK_MAX_ATTEMPTS = config('STRIPE_WEBHOOK_MAX_ATTEMPTS', default=10, cast=int)
+
+# ManyChat push notifications. With MANYCHAT_NOTIFY_URL set, completing a
+# payment queues a notification in the same transaction, and
+# `manage.py dispatch_manychat_notifications` POSTs batches of them there
+# (Bearer MANYCHAT_NOTIFY_TOKEN), at most MANYCHAT_NOTIFY_RATE requests.
+MANYCHAT_NOTIFY_URL = config('MANYCHAT_NOTIFY_URL', default='')
+MANYCHAT_NOTIFY_TOKEN = config('MANYCHAT_NOTIFY_TOKEN', default='')
+MANYCHAT_NOTIFY_RATE = config('MANYCHAT_NOTIFY_RATE', default='5/s')
+MANYCHAT_NOTIFY_BATCH_SIZE = config('MANYCHAT_NOTIFY_BATCH_SIZE', default=50, cast=int)
+MANYCHAT_NOTIFY_TIMEOUT_SECONDS = config('MANYCHAT_NOTIFY_TIMEOUT_SECONDS', default=10, cast=float)
+MANYCHAT_NOTIFY_LEASE_SECONDS = config('MANYCHAT_NOTIFY_LEASE_SECONDS', default=60, cast=int)
+MANYCHAT_NOTIFY_MAX_ATTEMPTS = config('MANYCHAT_NOTIFY_MAX_ATTEMPTS', default=10, cast=int)
+
+# Processed event ids are kept this long to reject Stripe redeliveries, which
+# Stripe attempts for up to three days.
+STRIPE_PROCESSED_EVENT_TTL_DAYS = config('STRIPE_PROCESSED_EVENT_TTL_DAYS', default=7, cast=int)
+
+# Serve CreatePaymentIntentView and PaymentSuccessView as async views that use
+# the Stripe SDK's async HTTP client. Only useful under ASGI.
+PAYMENT_API_ASYNC = config('PAYMENT_API_ASYNC', default=False, cast=bool)
+
+# Stripe API client
+# All Stripe calls share one client (ChicShot_Payment_App.stripe_client) with
+# a keep-alive connection pool. STRIPE_API_BASE can point at a local mock.
+
+STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
+STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY', default='')
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
+STRIPE_HTTP_POOL_SIZE = config('STRIPE_HTTP_POOL_SIZE', default=20, cast=int)
+STRIPE_HTTP_POOL_BLOCK = config('STRIPE_HTTP_POOL_BLOCK', default=True, cast=bool)
+STRIPE_HTTP_KEEPALIVE_SECONDS = config('STRIPE_HTTP_KEEPALIVE_SECONDS', default=30, cast=float)
+STRIPE_HTTP_CONNECT_TIMEOUT = config('STRIPE_HTTP_CONNECT_TIMEOUT', default=5, cast=float)
+STRIPE_HTTP_READ_TIMEOUT = config('STRIPE_HTTP_READ_TIMEOUT', default=30, cast=float)
+STRIPE_MAX_NETWORK_RETRIES = config('STRIPE_MAX_NETWORK_RETRIES', default=2, cast=int)
+
+# Per-operation circuit breakers around Stripe calls. BUDGETS is the read
+# timeout in seconds per operation (method and path, object ids as :id;
+# others get STRIPE_HTTP_READ_TIMEOUT). FAILURE_THRESHOLD consecutive
+# failures or over-budget calls open an operation's circuit: its calls fail
+# fast for RESET_SECONDS, then HALF_OPEN_PROBES calls test whether Stripe
+# has recovered.
+STRIPE_CIRCUIT_BREAKER = {
+    'ENABLED': config('STRIPE_CIRCUIT_BREAKER_ENABLED', default=True, cast=bool),
+    'FAILURE_THRESHOLD': config('STRIPE_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int),
+    'RESET_SECONDS': config('STRIPE_CIRCUIT_RESET_SECONDS', default=30, cast=float),
+    'HALF_OPEN_PROBES': config('STRIPE_CIRCUIT_HALF_OPEN_PROBES', default=1, cast=int),
+    'BUDGETS': {
+        'POST /v1/payment_intents': config('STRIPE_BUDGET_CREATE_INTENT', default=10, cast=float),
+        'GET /v1/payment_intents/:id': config('STRIPE_BUDGET_RETRIEVE_INTENT', default=3, cast=float),
+    },
+}
+
+# Batch payment intent creation: items per request, and Stripe calls in
+# flight at once across all batch requests of a process.
+PAYMENT_BATCH_MAX_ITEMS = config('PAYMENT_BATCH_MAX_ITEMS', default=100, cast=int)
+PAYMENT_BATCH_STRIPE_CONCURRENCY = config('PAYMENT_BATCH_STRIPE_CONCURRENCY', default=8, cast=int)
+
+# archive_payments: completed, failed and refunded payments older than this
+# move to payments_archive, PAYMENT_ARCHIVE_BATCH_SIZE rows per transaction.
+PAYMENT_ARCHIVE_AFTER_DAYS = config('PAYMENT_ARCHIVE_AFTER_DAYS', default=180, cast=int)
+PAYMENT_ARCHIVE_BATCH_SIZE = config('PAYMENT_ARCHIVE_BATCH_SIZE', default=1000, cast=int)
+
+# Payments admin changelist: tables with more rows than
+# PAYMENT_ADMIN_EXACT_COUNT_LIMIT show an estimated total, and filtered lists
+# are counted up to that many rows. Package filter choices are cached for
+# PAYMENT_ADMIN_FILTER_CACHE_SECONDS.
+PAYMENT_ADMIN_EXACT_COUNT_LIMIT = config('PAYMENT_ADMIN_EXACT_COUNT_LIMIT', default=10000, cast=int)
+PAYMENT_ADMIN_FILTER_CACHE_SECONDS = config('PAYMENT_ADMIN_FILTER_CACHE_SECONDS', default=600, cast=int)
+
+# A create-payment-intent request for the same fb_id, package, amount and
+# currency as a pending payment made within PAYMENT_INTENT_REUSE_SECONDS gets
+# that payment's intent back (0 disables). Client secrets are cached in
+# process for PAYMENT_INTENT_SECRET_CACHE_SECONDS, then fetched from Stripe.
+PAYMENT_INTENT_REUSE_SECONDS = config('PAYMENT_INTENT_REUSE_SECONDS', default=1800, cast=int)
+PAYMENT_INTENT_SECRET_CACHE_SECONDS = config('PAYMENT_INTENT_SECRET_CACHE_SECONDS', default=300, cast=int)
+
+# Token-bucket rate limits for the public endpoints, per view: 'fb_id' per
+# Facebook user, 'ip' per client address, 'global' for all clients
+# together. Rates are 'requests/period' (s, min, hour, day); the bucket holds
+# that many requests. ShardedMemoryBackend limits each process separately;
+# ChicShot_Payment_App.ratelimit.DjangoCacheBackend (OPTIONS: alias) shares
+# the buckets between processes.
+PAYMENT_RATE_LIMITS = {
+    'BACKEND': config('PAYMENT_RATE_LIMIT_BACKEND', default='ChicShot_Payment_App.ratelimit.ShardedMemoryBackend'),
+    'OPTIONS': {},
+    'RATES': {
+        'create_payment_intent': {
+            'fb_id': config('RATE_LIMIT_CREATE_FB_ID', default='10/min'),
+            'ip': config('RATE_LIMIT_CREATE_IP', default='30/min'),
+            'global': config('RATE_LIMIT_CREATE_GLOBAL', default='20/s'),
+        },
+        # Batch creates take one token per payment, so these capacities
+        # must be at least PAYMENT_BATCH_MAX_ITEMS.
+        'batch_create_payment_intents': {
+            'ip': config('RATE_LIMIT_BATCH_CREATE_IP', default='300/min'),
+            'global': config('RATE_LIMIT_BATCH_CREATE_GLOBAL', default='1200/min'),
+        },
+        # No per-IP limit: every poll comes from ManyChat's servers.
+        'manychat_payment_check': {
+            'fb_id': config('RATE_LIMIT_MANYCHAT_FB_ID', default='60/min'),
+            'global': config('RATE_LIMIT_MANYCHAT_GLOBAL', default='200/s'),
+        },
+    },
+}
+
+# PaymentSuccessView status cache, keyed by payment intent id. Use
+# ChicShot_Payment_App.status_cache.DjangoCacheBackend (OPTIONS: alias) to share
+# entries and webhook invalidations between processes.
+PAYMENT_STATUS_CACHE = {
+    'BACKEND': config('PAYMENT_STATUS_CACHE_BACKEND', default='ChicShot_Payment_App.status_cache.LocMemLRUBackend'),
+    'OPTIONS': {},
+    'TTLS': {
+        'pending': 5,
+        'failed': 30,
+        'completed': 3600,
+        'refunded': 3600,
+    },
+}
+
+# Payment status events for api/payment-status/stream/. The in-process
+# broker only reaches streams served by the process that changed the
+# payment; other changes are picked up by the stream's database check every
+# PAYMENT_EVENTS_HEARTBEAT_SECONDS.
+PAYMENT_EVENTS = {
+    'BACKEND': config('PAYMENT_EVENTS_BACKEND', default='ChicShot_Payment_App.events.InProcessBroker'),
+    'OPTIONS': {},
+}
+PAYMENT_EVENTS_HEARTBEAT_SECONDS = config('PAYMENT_EVENTS_HEARTBEAT_SECONDS', default=15, cast=float)
+PAYMENT_EVENTS_MAX_STREAM_SECONDS = config('PAYMENT_EVENTS_MAX_STREAM_SECONDS', default=300, cast=float)
+
+# The metrics endpoint answers staff users (admin session) and scrapers
+# sending "Authorization: Bearer <METRICS_TOKEN>"; everyone else gets 403.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Logging
+# App loggers write JSON lines through a queue so request threads never block
+# on stdout. Records logged with extra={'sampled': True} are high-volume
+# per-request events; LOG_SAMPLE_RATE keeps that fraction of them below
+# WARNING level.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {
+            '()': 'ChicShot_Payment_App.tracing.RequestIdFilter',
+        },
+        'sampling': {
+            '()': 'ChicShot_Payment_App.tracing.SamplingFilter',
+            'rate': config('LOG_SAMPLE_RATE', default=1.0, cast=float),
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'ChicShot_Payment_App.tracing.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'queued_json': {
+            '()': 'ChicShot_Payment_App.tracing.QueuedStreamHandler',
+            'filters': ['request_id', 'sampling'],
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'ChicShot_Payment_App': {
+            'handlers': ['queued_json'],
+            'level': config('LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -1,10 +1,172 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
 
 # Register your models here.
-from .models import PaymentModel
+from .models import ArchivedPaymentModel, ManyChatNotificationModel, PaymentModel, WebhookEventModel
+from .money import Currency
+from .routers import use_replica
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never counts more than PAYMENT_ADMIN_EXACT_COUNT_LIMIT rows
+
+    An unfiltered list of a large table gets the planner's row estimate
+    (PostgreSQL) or the id range (SQLite). A filtered list is counted up to
+    the limit, so only its first limit rows are reachable by page number.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.PAYMENT_ADMIN_EXACT_COUNT_LIMIT
+        query = self.object_list.query
+        if not query.where and not query.distinct:
+            estimate = self.estimated_table_count(self.object_list)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return self.object_list.order_by()[:limit].count()
+
+    @staticmethod
+    def estimated_table_count(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # -1 until the table is first analyzed.
+            return row[0] if row and row[0] >= 0 else None
+        bounds = queryset.model._default_manager.using(queryset.db).aggregate(first=Min('pk'), last=Max('pk'))
+        return bounds['last'] - bounds['first'] + 1 if bounds['last'] is not None else 0
+
+
+class CachedValuesListFilter(admin.SimpleListFilter):
+    """Filter on the distinct values of `parameter_name`, read at most every PAYMENT_ADMIN_FILTER_CACHE_SECONDS"""
+
+    def lookups(self, request, model_admin):
+        key = f'admin-filter:{model_admin.model._meta.db_table}:{self.parameter_name}'
+        values = cache.get(key)
+        if values is None:
+            values = list(
+                model_admin.model._default_manager.order_by(self.parameter_name)
+                .values_list(self.parameter_name, flat=True).distinct()
+            )
+            cache.set(key, values, settings.PAYMENT_ADMIN_FILTER_CACHE_SECONDS)
+        return [(value, self.label(value)) for value in values]
+
+    def label(self, value):
+        return value
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+
+class PackageListFilter(CachedValuesListFilter):
+    title = 'package'
+    parameter_name = 'package'
+
+
+class CurrencyListFilter(admin.SimpleListFilter):
+    """Filter on the currencies we accept; no query needed to list them"""
+
+    title = 'currency'
+    parameter_name = 'currency'
+
+    def lookups(self, request, model_admin):
+        return [(value, value.upper()) for value in Currency.values]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(currency=self.value())
+        return queryset
+
+
 @admin.register(PaymentModel)
 class PaymentModelAdmin(admin.ModelAdmin):
-    list_display = ('fb_id', 'package', 'amount', 'payment_date', 'payment_method', 'payment_status','manychat_payment')
-    search_fields = ('fb_id', 'package', 'stripe_payment_intent_id', 'stripe_customer_id')
-    list_filter = ('payment_status', 'payment_method', 'currency', 'manychat_payment')
-    ordering = ('-payment_date',)
\ No newline at end of file
+    list_display = ('fb_id', 'package', 'amount_display', 'payment_date', 'payment_method', 'payment_status','manychat_payment')
+    # Searches are routed by shape in get_search_results; these only turn
+    # the search box on.
+    search_fields = ('stripe_payment_intent_id', 'stripe_customer_id', 'fb_id')
+    search_help_text = "pi_... intent id, cus_... customer id, or fb_id. End with * for a prefix match."
+    list_filter = ('payment_status', 'payment_method', CurrencyListFilter, PackageListFilter, 'manychat_payment')
+    date_hierarchy = 'payment_date'
+    ordering = ('-payment_date',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # Search term prefix -> indexed column it is looked up in; anything
+    # else is an fb_id.
+    SEARCH_ROUTES = (
+        ('pi_', 'stripe_payment_intent_id'),
+        ('cus_', 'stripe_customer_id'),
+    )
+
+    @admin.display(description='Amount', ordering='amount_minor')
+    def amount_display(self, obj):
+        return f"{obj.amount} {obj.currency.upper()}"
+
+    def get_search_results(self, request, queryset, search_term):
+        """Exact or prefix match on the one indexed column the term's shape points to
+
+        Never a LIKE '%term%' scan: 'pi_...' matches the intent id,
+        'cus_...' the customer id and anything else fb_id. A trailing *
+        makes it a prefix match, done as an index range.
+        """
+        term = search_term.strip()
+        if not term.rstrip('*'):
+            return queryset, False
+        field = next((field for prefix, field in self.SEARCH_ROUTES if term.startswith(prefix)), 'fb_id')
+        if term.endswith('*'):
+            prefix = term.rstrip('*')
+            return queryset.filter(**{
+                f'{field}__gte': prefix,
+                f'{field}__lt': prefix + '\U0010ffff',
+                f'{field}__startswith': prefix,
+            }), False
+        return queryset.filter(**{field: term}), False
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        # Browsing the list reads from a replica; actions (POST) use the
+        # primary. Rendered here, since the result rows are fetched lazily
+        # by the template. Invalid lookups come back as a redirect, which
+        # has nothing to render.
+        with use_replica():
+            response = super().changelist_view(request, extra_context)
+            return response.render() if hasattr(response, 'render') else response
+
+
+@admin.register(WebhookEventModel)
+class WebhookEventModelAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'received_at', 'locked_until')
+    search_fields = ('event_id',)
+    list_filter = ('status', 'event_type')
+
+
+@admin.register(ArchivedPaymentModel)
+class ArchivedPaymentModelAdmin(admin.ModelAdmin):
+    list_display = ('fb_id', 'package', 'amount_minor', 'currency', 'payment_date', 'payment_status', 'archive_month')
+    search_fields = ('stripe_payment_intent_id', 'fb_id')
+    list_filter = ('payment_status', 'archive_month')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ManyChatNotificationModel)
+class ManyChatNotificationModelAdmin(admin.ModelAdmin):
+    list_display = ('payment_id', 'fb_id', 'status', 'attempts', 'created_at', 'locked_until')
+    search_fields = ('fb_id',)
+    list_filter = ('status',)
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ChicshotPaymentAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ChicShot_Payment_App'
+
+    def ready(self):
+        from . import circuit, db, metrics
+
+        connection_created.connect(db.configure_sqlite)
+        connection_created.connect(metrics.install_query_timer)
+        metrics.REGISTRY.register_gauges(metrics.stripe_pool_gauges)
+        metrics.REGISTRY.register_gauges(circuit.breaker_gauges)
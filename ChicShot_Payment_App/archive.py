@@ -0,0 +1,84 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedPaymentModel, PaymentModel
+from .routers import use_replica
+
+logger = logging.getLogger(__name__)
+
+# Statuses a payment is archived in. A failed payment can still complete and
+# a completed one be refunded, so PAYMENT_ARCHIVE_AFTER_DAYS must be longer
+# than that could plausibly take.
+ARCHIVE_STATUSES = ('completed', 'failed', 'refunded')
+
+ARCHIVE_FIELDS = [field.attname for field in PaymentModel._meta.concrete_fields]
+
+
+def archive_month(payment_date):
+    return timezone.localdate(payment_date).replace(day=1)
+
+
+def archive_batch(cutoff, after_id, batch_size):
+    """Move up to batch_size archivable payments with id > after_id in one transaction
+
+    Returns the ids moved, in order.
+    """
+    with transaction.atomic():
+        payments = list(
+            PaymentModel.objects.select_for_update().filter(
+                id__gt=after_id, payment_status__in=ARCHIVE_STATUSES, payment_date__lt=cutoff,
+            ).order_by('id')[:batch_size]
+        )
+        if not payments:
+            return []
+        ArchivedPaymentModel.objects.bulk_create([
+            ArchivedPaymentModel(
+                **{field: getattr(payment, field) for field in ARCHIVE_FIELDS},
+                archive_month=archive_month(payment.payment_date),
+            )
+            for payment in payments
+        ])
+        ids = [payment.id for payment in payments]
+        PaymentModel.objects.filter(id__in=ids).delete()
+    return ids
+
+
+def archive_payments(older_than_days, batch_size=1000, max_batches=None):
+    """Move payments in ARCHIVE_STATUSES older than older_than_days to payments_archive
+
+    Each batch is its own short transaction, so webhooks and ManyChat polls
+    are never blocked for long. Returns the number of payments moved.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    moved = 0
+    last_id = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = archive_batch(cutoff, last_id, batch_size)
+        if not ids:
+            break
+        moved += len(ids)
+        last_id = ids[-1]
+        batches += 1
+        logger.info("Archived payments", extra={'count': len(ids), 'last_id': last_id})
+    return moved
+
+
+def find_payment(payment_intent_id):
+    """The payment for an intent id, live or archived, or None
+
+    Reads go to a replica when one is configured; a miss there is retried
+    on the primary, which the archiver writes to.
+    """
+    for model in (PaymentModel, ArchivedPaymentModel):
+        lookup = model.objects.filter(stripe_payment_intent_id=payment_intent_id)
+        with use_replica(payment_intent_id) as on_replica:
+            payment = lookup.first()
+        if payment is None and on_replica:
+            payment = lookup.first()
+        if payment is not None:
+            return payment
+    return None
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import logging
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from . import circuit, events, intent_reuse, ratelimit, status_cache
+from .models import ArchivedPaymentModel, PaymentModel
+from .money import normalize_currency, to_minor_units
+from .routers import mark_written
+from .stripe_client import get_stripe_client, payment_intent_params
+from .webhooks import payment_method_from_intent
+
+logger = logging.getLogger(__name__)
+
+
+def _request_data(request):
+    """Parse a JSON or form body the way DRF's request.data would
+
+    Raises ValueError for a body that is not a JSON object.
+    """
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        return data
+    return request.POST
+
+
+def _parse_error(error):
+    """400 for an unparsable body, as DRF's parsers give the sync views"""
+    return JsonResponse({'error': f'Invalid request body: {error}'}, status=400)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCreatePaymentIntentView(View):
+    """ASGI version of CreatePaymentIntentView"""
+
+    rate_limit_view = 'create_payment_intent'
+
+    async def post(self, request):
+        try:
+            try:
+                data = _request_data(request)
+            except ValueError as e:
+                return _parse_error(e)
+            fb_id = data.get('fb_id', '')
+
+            wait = await sync_to_async(ratelimit.check)(self.rate_limit_view, fb_id, request)
+            if wait:
+                return ratelimit.too_many_requests(wait)
+            amount = data.get('amount')
+            package = data.get('package', 'Payment')
+            currency = data.get('currency', 'eur')
+            description = data.get('description', '')
+
+            if not amount:
+                return JsonResponse({'error': 'Amount is required'}, status=400)
+
+            try:
+                currency = normalize_currency(currency)
+                amount_minor = to_minor_units(amount, currency)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+            latest = None
+            if intent_reuse.enabled(fb_id):
+                latest = await sync_to_async(intent_reuse.latest_payment)(fb_id, package, amount_minor, currency)
+                client_secret = await sync_to_async(intent_reuse.reusable_secret)(latest)
+                if client_secret:
+                    return JsonResponse({
+                        'success': True,
+                        'client_secret': client_secret,
+                        'payment_intent_id': latest['stripe_payment_intent_id'],
+                        'payment_id': latest['id'],
+                        'publishable_key': settings.STRIPE_PUBLIC_KEY,
+                        'reused': True,
+                    }, status=200)
+
+            payment_intent = await get_stripe_client().v1.payment_intents.create_async(
+                params=payment_intent_params(amount_minor, currency, fb_id, package, description),
+                options={'idempotency_key': intent_reuse.create_idempotency_key(
+                    request, latest, fb_id, package, amount_minor, currency, description,
+                )}
+            )
+
+            payment, _ = await sync_to_async(intent_reuse.save_payment)(
+                payment_intent,
+                fb_id=fb_id,
+                package=package,
+                amount_minor=amount_minor,
+                currency=currency,
+                description=description,
+                payment_status='pending'
+            )
+            intent_reuse.remember(payment_intent.id, payment_intent.client_secret)
+            await sync_to_async(mark_written)(fb_id, payment_intent.id)
+            logger.info("Payment intent created", extra={
+                'fb_id': fb_id,
+                'payment_id': payment.id,
+                'payment_intent_id': payment_intent.id,
+            })
+
+            return JsonResponse({
+                'success': True,
+                'client_secret': payment_intent.client_secret,
+                'payment_intent_id': payment_intent.id,
+                'payment_id': payment.id,
+                'publishable_key': settings.STRIPE_PUBLIC_KEY
+            }, status=201)
+
+        except stripe.error.APIConnectionError as e:
+            logger.warning("Stripe unavailable while creating payment intent", extra={'error': str(e)})
+            return circuit.service_unavailable(e)
+        except Exception as e:
+            logger.exception("Failed to create payment intent")
+            return JsonResponse({'error': str(e)}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPaymentSuccessView(View):
+    """ASGI version of PaymentSuccessView"""
+
+    @staticmethod
+    def status_response(payment_status, payment_method, degraded=False):
+        data = {
+            'success': True,
+            'payment_status': payment_status,
+            'payment_method': payment_method,
+            'message': 'Payment confirmed successfully'
+        }
+        if degraded:
+            data.update(degraded=True, message='Payment status from our records; it may not be final yet')
+        return JsonResponse(data, status=200)
+
+    async def post(self, request):
+        try:
+            try:
+                payment_intent_id = _request_data(request).get('payment_intent_id')
+            except ValueError as e:
+                return _parse_error(e)
+
+            if not payment_intent_id:
+                return JsonResponse({'error': 'payment_intent_id is required'}, status=400)
+
+            cached = await sync_to_async(status_cache.get_status)(payment_intent_id)
+            if cached:
+                return self.status_response(cached['payment_status'], cached['payment_method'])
+
+            payment = await PaymentModel.objects.filter(
+                stripe_payment_intent_id=payment_intent_id
+            ).afirst()
+
+            if not payment:
+                # Old payments are archived in their final status.
+                archived = await ArchivedPaymentModel.objects.filter(
+                    stripe_payment_intent_id=payment_intent_id
+                ).afirst()
+                if archived:
+                    return self.status_response(archived.payment_status, archived.payment_method)
+                return JsonResponse({'error': 'Payment not found'}, status=404)
+
+            if payment.is_final:
+                await sync_to_async(status_cache.set_status)(
+                    payment_intent_id, payment.payment_status, payment.payment_method
+                )
+                return self.status_response(payment.payment_status, payment.payment_method)
+
+            try:
+                payment_intent = await get_stripe_client().v1.payment_intents.retrieve_async(
+                    payment_intent_id,
+                    params={'expand': ['latest_charge']}
+                )
+            except stripe.error.APIConnectionError as e:
+                logger.warning("Stripe unavailable, answering payment status from the database", extra={
+                    'payment_intent_id': payment_intent_id, 'error': str(e),
+                })
+                return self.status_response(payment.payment_status, payment.payment_method, degraded=True)
+
+            payment_method = payment_method_from_intent(payment_intent) or 'card'
+
+            if payment_intent.status == 'succeeded':
+                new_status = 'completed'
+            elif payment_intent.status == 'processing':
+                new_status = 'pending'
+            else:
+                new_status = 'failed'
+
+            if payment.can_transition_to(new_status) and await PaymentModel.objects.filter(
+                pk=payment.pk
+            ).atransition(new_status, payment_method=payment_method):
+                payment.payment_status = new_status
+                payment.payment_method = payment_method
+                await sync_to_async(mark_written)(payment_intent_id, payment.fb_id)
+                await sync_to_async(events.publish_status)(
+                    payment_intent_id, payment.fb_id, new_status, payment_method
+                )
+            elif payment.payment_status in PaymentModel.SETTLED_STATUSES and payment.payment_method is None:
+                # Completed by a webhook, which cannot see the charge.
+                await PaymentModel.objects.filter(pk=payment.pk, payment_method__isnull=True).aupdate(
+                    payment_method=payment_method
+                )
+                payment.payment_method = payment_method
+
+            await sync_to_async(status_cache.set_status)(
+                payment_intent_id, payment.payment_status, payment.payment_method
+            )
+            return self.status_response(payment.payment_status, payment.payment_method)
+
+        except stripe.error.StripeError as e:
+            logger.warning("Stripe error while confirming payment", extra={'error': str(e)})
+            return JsonResponse({'error': f'Stripe error: {str(e)}'}, status=500)
+        except Exception as e:
+            logger.exception("Failed to confirm payment")
+            return JsonResponse({'error': str(e)}, status=500)
+
+
+class PaymentStatusStreamView(View):
+    """Server-sent events with the status of one payment intent or of an fb_id's payments
+
+    GET ?payment_intent_id=... or ?fb_id=... sends the current status, then
+    an event for every change published by the webhook or status views.
+    An intent's stream ends once its payment is settled. Every
+    PAYMENT_EVENTS_HEARTBEAT_SECONDS without an event the database is
+    checked once, for changes the broker could not deliver, and a comment
+    keeps the connection open. Needs ASGI.
+    """
+
+    STATUS_FIELDS = ('fb_id', 'stripe_payment_intent_id', 'payment_status', 'payment_method', 'updated_at')
+
+    async def get(self, request):
+        payment_intent_id = request.GET.get('payment_intent_id')
+        fb_id = request.GET.get('fb_id')
+        if bool(payment_intent_id) == bool(fb_id):
+            return JsonResponse({'error': 'Pass either payment_intent_id or fb_id'}, status=400)
+
+        if payment_intent_id:
+            channel = events.intent_channel(payment_intent_id)
+            lookup = PaymentModel.objects.filter(stripe_payment_intent_id=payment_intent_id)
+        else:
+            channel = events.fb_channel(fb_id)
+            lookup = PaymentModel.objects.filter(fb_id=fb_id).order_by('-updated_at')
+        lookup = lookup.only(*self.STATUS_FIELDS)
+
+        # Subscribe before reading the current state so no change can slip
+        # in between.
+        subscription = events.get_broker().subscribe(channel)
+        try:
+            current = await lookup.afirst()
+        except Exception:
+            subscription.close()
+            raise
+        if current is None and payment_intent_id:
+            subscription.close()
+            return JsonResponse({'error': 'Payment not found'}, status=404)
+
+        response = StreamingHttpResponse(
+            self.stream(subscription, lookup, current, until_settled=bool(payment_intent_id)),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, subscription, lookup, current, until_settled):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.PAYMENT_EVENTS_MAX_STREAM_SECONDS
+        last_sent = None
+        try:
+            message = self.message(current) if current else None
+            while True:
+                if message and message != last_sent:
+                    last_sent = message
+                    yield f"event: payment_status\ndata: {json.dumps(message)}\n\n"
+                    if until_settled and message['payment_status'] in PaymentModel.SETTLED_STATUSES:
+                        return
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    message = await asyncio.wait_for(
+                        subscription.get(), min(settings.PAYMENT_EVENTS_HEARTBEAT_SECONDS, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    current = await lookup.afirst()
+                    message = self.message(current) if current else None
+                    if message == last_sent:
+                        yield ": keepalive\n\n"
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def message(payment):
+        return {
+            'payment_intent_id': payment.stripe_payment_intent_id,
+            'fb_id': payment.fb_id,
+            'payment_status': payment.payment_status,
+            'payment_method': payment.payment_method,
+        }
@@ -0,0 +1,138 @@
+import math
+import threading
+import time
+from contextvars import ContextVar
+
+import stripe
+from django.conf import settings
+from django.http import JsonResponse
+
+from .metrics import stripe_circuit_rejections, stripe_circuit_trips
+
+# Read timeout for the Stripe call in progress; stripe_client's HTTP clients
+# use it in place of STRIPE_HTTP_READ_TIMEOUT.
+budget_var = ContextVar('stripe_latency_budget', default=None)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """A Stripe call refused without being sent because its circuit is open
+
+    An APIConnectionError, so code that handles Stripe being unreachable
+    handles this too.
+    """
+
+    def __init__(self, operation, retry_after):
+        super().__init__(f"Stripe circuit for {operation} is open")
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Failure tracking for one Stripe operation (e.g. 'POST /v1/payment_intents')
+
+    FAILURE_THRESHOLD consecutive failures open the circuit: calls fail
+    fast for RESET_SECONDS. Then up to HALF_OPEN_PROBES calls go through as
+    probes; a successful probe closes the circuit and a failed one opens it
+    again. Connection errors, timeouts, 429 and 5xx responses and calls
+    slower than the budget count as failures. State is per process. clock
+    is the time source, time.monotonic unless a test passes another.
+    """
+
+    def __init__(self, operation, failure_threshold, reset_seconds, half_open_probes, clock=time.monotonic):
+        self.operation = operation
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Reserve a call; raises CircuitOpenError when it must not be sent"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_seconds - self.clock()
+                if remaining > 0:
+                    stripe_circuit_rejections.inc(self.operation)
+                    raise CircuitOpenError(self.operation, remaining)
+                self.state = HALF_OPEN
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_probes:
+                    stripe_circuit_rejections.inc(self.operation)
+                    raise CircuitOpenError(self.operation, self.reset_seconds)
+                self.probes += 1
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self.trips += 1
+                stripe_circuit_trips.inc(self.operation)
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, 'trips': self.trips}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(operation):
+    breaker = _breakers.get(operation)
+    if breaker is None:
+        config = settings.STRIPE_CIRCUIT_BREAKER
+        with _breakers_lock:
+            breaker = _breakers.setdefault(operation, CircuitBreaker(
+                operation,
+                config['FAILURE_THRESHOLD'],
+                config['RESET_SECONDS'],
+                config['HALF_OPEN_PROBES'],
+            ))
+    return breaker
+
+
+def budget(operation):
+    """Latency budget in seconds for operation"""
+    return settings.STRIPE_CIRCUIT_BREAKER['BUDGETS'].get(operation, settings.STRIPE_HTTP_READ_TIMEOUT)
+
+
+def is_failure(status_code, duration, operation):
+    return status_code == 429 or status_code >= 500 or duration > budget(operation)
+
+
+def breaker_stats():
+    """{operation: {'state', 'consecutive_failures', 'trips'}} for every operation seen"""
+    return {operation: breaker.stats() for operation, breaker in list(_breakers.items())}
+
+
+def breaker_gauges():
+    """Circuit state per operation (0 closed, 1 half-open, 2 open), for REGISTRY.register_gauges"""
+    return [(
+        'stripe_circuit_state', 'Stripe circuit breaker state: 0 closed, 1 half-open, 2 open',
+        {(('operation', operation),): STATE_VALUES[stats['state']] for operation, stats in breaker_stats().items()},
+    )]
+
+
+def service_unavailable(error):
+    """503 for a request that needed Stripe while it is unreachable or its circuit open"""
+    retry_after = math.ceil(getattr(error, 'retry_after', 1))
+    response = JsonResponse(
+        {'error': 'Payment provider temporarily unavailable, please retry shortly'}, status=503,
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """Messages published to one channel, for one asyncio consumer"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, message):
+        # publish() may run on any thread; the queue belongs to our loop.
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        except RuntimeError:
+            # The loop is closed; the stream is gone.
+            self.close()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fan-out to subscribers in this process only
+
+    Subscribers never see status changes made by other processes (another
+    web worker, process_webhooks); use a broker backed by an external
+    pub/sub for those, or rely on the stream's periodic database check.
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Call from the event loop that will consume the subscription"""
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = settings.PAYMENT_EVENTS
+                _broker = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _broker
+
+
+def intent_channel(payment_intent_id):
+    return f"intent:{payment_intent_id}"
+
+
+def fb_channel(fb_id):
+    return f"fb:{fb_id}"
+
+
+def publish_status(payment_intent_id, fb_id, payment_status, payment_method=None):
+    """Tell subscribers of the intent and of fb_id about a status change, once committed"""
+    message = {
+        'payment_intent_id': payment_intent_id,
+        'fb_id': fb_id,
+        'payment_status': payment_status,
+        'payment_method': payment_method,
+    }
+
+    def publish():
+        broker = get_broker()
+        broker.publish(intent_channel(payment_intent_id), message)
+        if fb_id:
+            broker.publish(fb_channel(fb_id), message)
+
+    transaction.on_commit(publish)
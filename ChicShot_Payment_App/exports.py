@@ -0,0 +1,136 @@
+import csv
+import heapq
+import json
+import zlib
+from datetime import datetime, time, timedelta
+from itertools import islice
+from operator import itemgetter
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import ArchivedPaymentModel, PaymentModel
+from .money import from_minor_units, normalize_currency
+from .routers import use_replica
+
+EXPORT_FIELDS = (
+    'id', 'fb_id', 'package', 'amount_minor', 'currency', 'payment_status', 'payment_method',
+    'stripe_payment_intent_id', 'stripe_customer_id', 'manychat_payment', 'payment_date', 'updated_at',
+)
+# amount is derived from amount_minor and currency and goes after them.
+COLUMNS = EXPORT_FIELDS[:5] + ('amount',) + EXPORT_FIELDS[5:]
+
+FORMATS = ('csv', 'jsonl')
+
+
+def export_querysets(include_archived=False, **filters):
+    """Querysets to export: live payments, plus payments_archive with include_archived"""
+    models = (PaymentModel, ArchivedPaymentModel) if include_archived else (PaymentModel,)
+    return [export_queryset(model=model, **filters) for model in models]
+
+
+def export_queryset(date_from=None, date_to=None, status=None, package=None, currency=None, model=PaymentModel):
+    """Payments of model matching the export filters; dates are 'YYYY-MM-DD', both inclusive
+
+    Raises ValueError for malformed filters.
+    """
+    queryset = model.objects.all()
+    if date_from:
+        queryset = queryset.filter(payment_date__gte=_start_of_day(date_from))
+    if date_to:
+        queryset = queryset.filter(payment_date__lt=_start_of_day(date_to) + timedelta(days=1))
+    if status:
+        if status not in PaymentModel.STATUS_TRANSITIONS:
+            raise ValueError(f"Unknown status: {status}")
+        queryset = queryset.filter(payment_status=status)
+    if package:
+        queryset = queryset.filter(package=package)
+    if currency:
+        queryset = queryset.filter(currency=normalize_currency(currency))
+    return queryset
+
+
+def _start_of_day(value):
+    day = parse_date(value) if isinstance(value, str) else value
+    if day is None:
+        raise ValueError(f"Invalid date: {value}")
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _keyset_pages(queryset, chunk_size):
+    """Rows of queryset as tuples of EXPORT_FIELDS, one id-ordered page at a time
+
+    Keyset pagination (id > last id) keeps every page an index range scan,
+    however deep into the table, and only one page is held in memory.
+    """
+    queryset = queryset.order_by('id').values_list(*EXPORT_FIELDS)
+    last_id = 0
+    while True:
+        with use_replica():
+            page = list(queryset.filter(id__gt=last_id)[:chunk_size].iterator(chunk_size=chunk_size))
+        if not page:
+            return
+        yield page
+        last_id = page[-1][0]
+
+
+def iter_pages(querysets, chunk_size=2000):
+    """Rows of one queryset or several, in id order, as pages of at most chunk_size
+
+    Archived payments keep their ids, so live and archived rows merge into
+    a single id-ordered stream.
+    """
+    if not isinstance(querysets, (list, tuple)):
+        querysets = [querysets]
+    if len(querysets) == 1:
+        yield from _keyset_pages(querysets[0], chunk_size)
+        return
+    streams = [(row for page in _keyset_pages(queryset, chunk_size) for row in page) for queryset in querysets]
+    rows = heapq.merge(*streams, key=itemgetter(0))
+    while page := list(islice(rows, chunk_size)):
+        yield page
+
+
+def _with_amount(row):
+    amount = from_minor_units(row[3], row[4])
+    return row[:5] + (amount,) + row[5:]
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(pages):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for page in pages:
+        yield ''.join(writer.writerow(_with_amount(row)) for row in page)
+
+
+def jsonl_chunks(pages):
+    for page in pages:
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, _with_amount(row))), default=str) + '\n' for row in page
+        )
+
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(querysets, export_format='csv', compress=False, chunk_size=2000):
+    """The export of one queryset or several as a stream of str chunks, or bytes when compress is set"""
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown format: {export_format}")
+    pages = iter_pages(querysets, chunk_size)
+    chunks = csv_chunks(pages) if export_format == 'csv' else jsonl_chunks(pages)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import PaymentModel
+from .status_cache import LocMemLRUBackend
+from .stripe_client import get_stripe_client, idempotency_key
+
+logger = logging.getLogger(__name__)
+
+# Intents in these Stripe statuses can still be paid with their client_secret.
+REUSABLE_STATUSES = ('requires_payment_method', 'requires_confirmation', 'requires_action')
+
+# client_secret by payment intent id. Secrets are never stored in the
+# database, so a miss costs one Stripe retrieve.
+_secrets = LocMemLRUBackend(max_entries=10000)
+
+
+def enabled(fb_id):
+    return bool(fb_id) and settings.PAYMENT_INTENT_REUSE_SECONDS > 0
+
+
+def latest_payment(fb_id, package, amount_minor, currency):
+    """The newest payment for this checkout, as a dict, or None (one index probe)"""
+    return PaymentModel.objects.filter(
+        fb_id=fb_id, package=package, amount_minor=amount_minor, currency=currency,
+    ).order_by('-id').values('id', 'payment_status', 'payment_date', 'stripe_payment_intent_id').first()
+
+
+def remember(payment_intent_id, client_secret):
+    _secrets.set(payment_intent_id, client_secret, settings.PAYMENT_INTENT_SECRET_CACHE_SECONDS)
+
+
+def reusable_secret(latest):
+    """client_secret of latest's intent if the user can still pay with it, else None"""
+    if latest is None or latest['payment_status'] != 'pending' or not latest['stripe_payment_intent_id']:
+        return None
+    if latest['payment_date'] < timezone.now() - timedelta(seconds=settings.PAYMENT_INTENT_REUSE_SECONDS):
+        return None
+    payment_intent_id = latest['stripe_payment_intent_id']
+    secret = _secrets.get(payment_intent_id)
+    if secret:
+        return secret
+    try:
+        payment_intent = get_stripe_client().v1.payment_intents.retrieve(payment_intent_id)
+    except stripe.error.StripeError as e:
+        logger.warning("Could not check payment intent for reuse", extra={
+            'payment_intent_id': payment_intent_id, 'error': str(e),
+        })
+        return None
+    if payment_intent.status not in REUSABLE_STATUSES:
+        return None
+    remember(payment_intent_id, payment_intent.client_secret)
+    return payment_intent.client_secret
+
+
+def create_idempotency_key(request, latest, fb_id, package, amount_minor, currency, description):
+    """Idempotency key for creating this checkout's intent
+
+    Without a client Idempotency-Key, concurrent identical requests get the
+    same key and so one Stripe intent. The newest payment's id is part of the
+    key, so once that payment is paid or abandoned the next checkout gets a
+    new intent.
+    """
+    if request.headers.get('Idempotency-Key') or not enabled(fb_id):
+        return idempotency_key(request, 'create-payment-intent')
+    parts = [fb_id, package, amount_minor, currency, description, latest['id'] if latest else 0]
+    return 'create-payment-intent:' + hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def save_payment(payment_intent, **fields):
+    """(payment, created) for a created intent; a concurrent duplicate request may have saved it already"""
+    try:
+        with transaction.atomic():
+            return PaymentModel.objects.create(stripe_payment_intent_id=payment_intent.id, **fields), True
+    except IntegrityError:
+        return PaymentModel.objects.get(stripe_payment_intent_id=payment_intent.id), False
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ChicShot_Payment_App.archive import archive_payments
+
+
+class Command(BaseCommand):
+    help = "Move old completed, failed and refunded payments to payments_archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.PAYMENT_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENT_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches")
+
+    def handle(self, *args, **options):
+        moved = archive_payments(options['older_than_days'], options['batch_size'], options['max_batches'])
+        self.stdout.write(f"Archived {moved} payments")
@@ -0,0 +1,36 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ChicShot_Payment_App.manychat import Dispatcher, claim_notifications
+
+
+class Command(BaseCommand):
+    help = "Push queued completed-payment notifications to MANYCHAT_NOTIFY_URL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.MANYCHAT_NOTIFY_BATCH_SIZE)
+        parser.add_argument('--lease-seconds', type=int, default=settings.MANYCHAT_NOTIFY_LEASE_SECONDS)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when nothing is due")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit as soon as nothing is due")
+
+    def handle(self, *args, **options):
+        if not settings.MANYCHAT_NOTIFY_URL:
+            raise CommandError("MANYCHAT_NOTIFY_URL is not set")
+        worker_id = uuid.uuid4().hex
+        dispatcher = Dispatcher()
+        self.stdout.write(f"ManyChat dispatcher {worker_id} started")
+
+        while True:
+            notifications = claim_notifications(worker_id, options['batch_size'], options['lease_seconds'])
+            if not notifications:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            delivered = dispatcher.deliver(notifications)
+            self.stdout.write(f"Delivered {delivered}/{len(notifications)} notifications")
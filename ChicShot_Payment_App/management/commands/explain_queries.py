@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+
+from ChicShot_Payment_App.models import (
+    ArchivedPaymentModel, PaymentModel, ProcessedEventModel, WebhookEventModel,
+)
+
+
+def hot_queries():
+    """The queries on the request path, as (label, queryset) pairs"""
+    return [
+        ("ManyChat poll", PaymentModel.objects.filter(
+            fb_id='0', manychat_payment=False
+        ).order_by('-updated_at')[:1]),
+        ("Payment by intent id", PaymentModel.objects.filter(
+            stripe_payment_intent_id='pi_0'
+        )),
+        ("Admin changelist", PaymentModel.objects.order_by('-payment_date')[:100]),
+        ("Admin changelist by status", PaymentModel.objects.filter(
+            payment_status='completed'
+        ).order_by('-payment_date')[:100]),
+        ("Archived payment by intent id", ArchivedPaymentModel.objects.filter(
+            stripe_payment_intent_id='pi_0'
+        )),
+        ("Revenue by currency", PaymentModel.objects.filter(
+            payment_status='completed'
+        ).order_by().values('currency').annotate(total=Sum('amount_minor'))),
+        ("Processed event lookup", ProcessedEventModel.objects.filter(event_id='evt_0')),
+        ("Webhook queue claim", WebhookEventModel.objects.filter(
+            status__in=['pending', 'processing']
+        ).order_by('id').values_list('id', flat=True)[:100]),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Print the database query plan for each hot query"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Database vendor: {connection.vendor}")
+        for label, queryset in hot_queries():
+            self.stdout.write(f"\n{label}")
+            self.stdout.write(f"  SQL: {queryset.query}")
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"  {line}")
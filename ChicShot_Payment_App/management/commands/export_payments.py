@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ChicShot_Payment_App.exports import FORMATS, export_chunks, export_querysets
+
+
+class Command(BaseCommand):
+    help = "Stream payments to a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', help="File to write; stdout when omitted")
+        parser.add_argument('--from', dest='date_from', help="First payment date, YYYY-MM-DD")
+        parser.add_argument('--to', dest='date_to', help="Last payment date, YYYY-MM-DD")
+        parser.add_argument('--status')
+        parser.add_argument('--package')
+        parser.add_argument('--currency')
+        parser.add_argument('--include-archived', action='store_true',
+                            help="Also export payments moved to payments_archive")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            querysets = export_querysets(
+                include_archived=options['include_archived'],
+                date_from=options['date_from'],
+                date_to=options['date_to'],
+                status=options['status'],
+                package=options['package'],
+                currency=options['currency'],
+            )
+            chunks = export_chunks(querysets, options['format'], options['gzip'], options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk if options['gzip'] else chunk.encode())
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,56 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ChicShot_Payment_App.webhooks import claim_events, group_by_intent, run_queued_event
+
+
+class Command(BaseCommand):
+    help = "Drain the queued Stripe webhook events into the payments table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.STRIPE_WEBHOOK_BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=settings.STRIPE_WEBHOOK_CONCURRENCY)
+        parser.add_argument('--lease-seconds', type=int, default=settings.STRIPE_WEBHOOK_LEASE_SECONDS)
+        parser.add_argument('--max-attempts', type=int, default=settings.STRIPE_WEBHOOK_MAX_ATTEMPTS)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit as soon as the queue is empty")
+
+    def handle(self, *args, **options):
+        worker_id = uuid.uuid4().hex
+        concurrency = max(1, options['concurrency'])
+        self.stdout.write(f"Webhook worker {worker_id} started (concurrency={concurrency})")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                events = claim_events(worker_id, options['batch_size'], options['lease_seconds'])
+                if not events:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                slices = self.split(group_by_intent(events), concurrency)
+                results = executor.map(self._run_slice, slices, [options['max_attempts']] * len(slices))
+                processed = sum(results)
+                self.stdout.write(f"Processed {processed}/{len(events)} events")
+
+    @staticmethod
+    def split(groups, concurrency):
+        """Spread event groups over at most concurrency slices, never splitting a group"""
+        slices = [[] for _ in range(min(concurrency, len(groups)))]
+        for group in sorted(groups, key=len, reverse=True):
+            min(slices, key=len).extend(group)
+        return slices
+
+    def _run_slice(self, events, max_attempts):
+        try:
+            return sum(run_queued_event(event, max_attempts) for event in events)
+        finally:
+            connection.close()
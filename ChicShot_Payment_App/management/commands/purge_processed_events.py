@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ChicShot_Payment_App.webhooks import purge_processed_events
+
+
+class Command(BaseCommand):
+    help = "Delete processed Stripe event ids older than the deduplication TTL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, default=settings.STRIPE_PROCESSED_EVENT_TTL_DAYS)
+
+    def handle(self, *args, **options):
+        deleted = purge_processed_events(options['ttl_days'])
+        self.stdout.write(f"Deleted {deleted} processed event ids")
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from ChicShot_Payment_App.rollups import payment_day_range, rebuild_days
+
+
+class Command(BaseCommand):
+    help = "Rebuild the revenue rollup from payments, a few days per transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help="First day, YYYY-MM-DD (default: first payment)")
+        parser.add_argument('--to', dest='date_to', help="Last day, YYYY-MM-DD (default: last payment)")
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help="Days rebuilt per transaction")
+
+    def handle(self, *args, **options):
+        days = payment_day_range()
+        if days is None:
+            self.stdout.write("No payments")
+            return
+        first_day = self.parse_day(options['date_from']) or days[0]
+        last_day = self.parse_day(options['date_to']) or days[1]
+
+        written = 0
+        while first_day <= last_day:
+            chunk_end = min(first_day + timedelta(days=options['chunk_days'] - 1), last_day)
+            written += rebuild_days(first_day, chunk_end)
+            self.stdout.write(f"{first_day}..{chunk_end}: {written} rollup rows so far")
+            first_day = chunk_end + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt revenue rollup: {written} rows"))
+
+    def parse_day(self, value):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value}")
+        return day
@@ -0,0 +1,81 @@
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ChicShot_Payment_App.reconcile import reconcile_payments, stale_payments
+from ChicShot_Payment_App.stripe_client import get_stripe_client
+
+
+class Command(BaseCommand):
+    help = "Sync pending payments that missed their webhook with Stripe"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', nargs='+', default=['pending'],
+                            help="Payment statuses to sweep")
+        parser.add_argument('--stale-minutes', type=int, default=30,
+                            help="Only rows not updated for this long")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--max-window-hours', type=float, default=24,
+                            help="Largest created-time range fetched with one Stripe list call")
+        parser.add_argument('--checkpoint', type=Path,
+                            help="JSON file to resume from and record progress in")
+
+    def handle(self, *args, **options):
+        client = get_stripe_client()
+        stale_after = timedelta(minutes=options['stale_minutes'])
+        max_window = timedelta(hours=options['max_window_hours'])
+        checkpoint = options['checkpoint']
+
+        last_id = 0
+        if checkpoint and checkpoint.exists():
+            last_id = json.loads(checkpoint.read_text())['last_id']
+            self.stdout.write(f"Resuming after payment id {last_id}")
+
+        totals = {'checked': 0, 'missing': 0, 'updated': 0}
+        # Chunks can finish out of order; the checkpoint only advances past
+        # a chunk once every chunk before it is done.
+        in_flight = deque()
+
+        def run_chunk(payments):
+            try:
+                return reconcile_payments(client, payments, max_window)
+            finally:
+                connection.close()
+
+        def drain(block):
+            # With block=True, wait for the oldest chunk, then collect any
+            # finished chunks behind it.
+            while in_flight and (block or in_flight[0][1].done()):
+                chunk_last_id, future = in_flight.popleft()
+                for key, value in future.result().items():
+                    totals[key] += value
+                if checkpoint:
+                    checkpoint.write_text(json.dumps({'last_id': chunk_last_id}))
+                block = False
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            after_id = last_id
+            while True:
+                payments = stale_payments(options['status'], stale_after, after_id, options['chunk_size'])
+                if not payments:
+                    break
+                after_id = payments[-1].id
+                in_flight.append((after_id, executor.submit(run_chunk, payments)))
+                # Bound the rows held in memory to a few chunks per worker.
+                while len(in_flight) >= options['workers'] * 2:
+                    drain(block=True)
+                drain(block=False)
+
+            while in_flight:
+                drain(block=True)
+
+        self.stdout.write(
+            f"Checked {totals['checked']} payments: {totals['updated']} updated, "
+            f"{totals['missing']} not found on Stripe"
+        )
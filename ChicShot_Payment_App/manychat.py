@@ -0,0 +1,123 @@
+import logging
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .metrics import manychat_notifications
+from .models import ManyChatNotificationModel, PaymentModel
+from .ratelimit import ShardedMemoryBackend, parse_rate
+
+logger = logging.getLogger(__name__)
+
+
+def claim_notifications(worker_id, batch_size, lease_seconds):
+    """Lease a batch of due notifications to one worker"""
+    now = timezone.now()
+    claimable = Q(status__in=['pending', 'processing']) & (
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    )
+    ids = list(
+        ManyChatNotificationModel.objects.filter(claimable)
+        .order_by('id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+
+    # As in webhooks.claim_events, the UPDATE repeats the condition so racing
+    # workers cannot both take a row.
+    ManyChatNotificationModel.objects.filter(claimable, id__in=ids).update(
+        status='processing',
+        locked_by=worker_id,
+        locked_until=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1,
+    )
+    return list(ManyChatNotificationModel.objects.filter(id__in=ids, locked_by=worker_id).order_by('id'))
+
+
+class Dispatcher:
+    """Pushes leased notifications to MANYCHAT_NOTIFY_URL, one POST per batch
+
+    The body is {"payments": [payload, ...]}; any 2xx response acknowledges
+    the whole batch. POSTs are spaced to MANYCHAT_NOTIFY_RATE.
+    """
+
+    def __init__(self, url=None, token=None, rate=None, timeout=None, max_attempts=None):
+        self.url = url or settings.MANYCHAT_NOTIFY_URL
+        self.token = token if token is not None else settings.MANYCHAT_NOTIFY_TOKEN
+        self.timeout = timeout or settings.MANYCHAT_NOTIFY_TIMEOUT_SECONDS
+        self.max_attempts = max_attempts or settings.MANYCHAT_NOTIFY_MAX_ATTEMPTS
+        self.capacity, self.refill_rate = parse_rate(rate or settings.MANYCHAT_NOTIFY_RATE)
+        self._bucket = ShardedMemoryBackend(shards=1)
+        self.session = requests.Session()
+        if self.token:
+            self.session.headers['Authorization'] = f"Bearer {self.token}"
+
+    def wait_for_slot(self):
+        while wait := self._bucket.take('dispatch', self.capacity, self.refill_rate):
+            time.sleep(wait)
+
+    def skip_claimed(self, notifications):
+        """Drop notifications whose payment ManyChat already polled; returns the rest
+
+        The payments are locked while checking, so a poll that is claiming
+        one of them finishes first. Polls do not claim payments whose
+        notification is leased, so the rest stay ours until delivered.
+        """
+        with transaction.atomic():
+            claimed = set(
+                PaymentModel.objects.select_for_update()
+                .filter(id__in=[n.payment_id for n in notifications], manychat_payment=True)
+                .values_list('id', flat=True)
+            )
+            skipped = [n for n in notifications if n.payment_id in claimed]
+            if skipped:
+                ManyChatNotificationModel.objects.filter(id__in=[n.id for n in skipped]).delete()
+        if skipped:
+            manychat_notifications.inc('skipped', amount=len(skipped))
+        return [n for n in notifications if n.payment_id not in claimed]
+
+    def deliver(self, notifications):
+        """Push one leased batch; returns the number delivered"""
+        notifications = self.skip_claimed(notifications)
+        if not notifications:
+            return 0
+        self.wait_for_slot()
+        try:
+            response = self.session.post(
+                self.url, json={'payments': [n.payload for n in notifications]}, timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.reschedule(notifications, str(e))
+            return 0
+
+        with transaction.atomic():
+            PaymentModel.objects.filter(
+                id__in=[n.payment_id for n in notifications]
+            ).update(manychat_payment=True, updated_at=timezone.now())
+            ManyChatNotificationModel.objects.filter(id__in=[n.id for n in notifications]).delete()
+        manychat_notifications.inc('delivered', amount=len(notifications))
+        logger.info("ManyChat notifications delivered", extra={'count': len(notifications), 'sampled': True})
+        return len(notifications)
+
+    def reschedule(self, notifications, error):
+        """Put a failed batch back with an exponential delay, or give up on it"""
+        logger.warning("ManyChat notification push failed", extra={'count': len(notifications), 'error': error})
+        now = timezone.now()
+        for notification in notifications:
+            gave_up = notification.attempts >= self.max_attempts
+            ManyChatNotificationModel.objects.filter(
+                pk=notification.pk, locked_by=notification.locked_by
+            ).update(
+                status='failed' if gave_up else 'pending',
+                last_error=error,
+                locked_by=None,
+                locked_until=now + timedelta(seconds=min(2 ** notification.attempts, 300)),
+            )
+            manychat_notifications.inc('failed' if gave_up else 'retried')
@@ -0,0 +1,274 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Time spent per phase of the current request, filled in by the Stripe client
+# and the ORM execute wrapper. Holds a dict so that code running under
+# sync_to_async, which gets a copy of the context, adds to the same totals.
+request_phases_var = ContextVar('request_phases', default=None)
+
+
+class _Metric:
+    """Base for metrics aggregated in per-thread shards
+
+    Each thread only ever writes its own shard, so recording takes no lock.
+    Shards are summed when the metrics are collected.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _snapshot(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        # A shard may grow while it is copied from another thread.
+        return [dict(shard) for shard in shards]
+
+    def _labels(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labelvalues, value in shard.items():
+                totals[labelvalues] = totals.get(labelvalues, 0) + value
+        for labelvalues, value in sorted(totals.items()):
+            yield f'{self.name}_total{self._labels(labelvalues)} {value}'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, *labelvalues):
+        shard = self._shard()
+        series = shard.get(labelvalues)
+        if series is None:
+            # Bucket counts (the last one is +Inf), then sum.
+            series = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labelvalues, series in shard.items():
+                total = totals.setdefault(labelvalues, [0] * len(series))
+                for i, value in enumerate(list(series)):
+                    total[i] += value
+        for labelvalues, series in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket{self._labels(labelvalues, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{self._labels(labelvalues)} {series[-1]}'
+            yield f'{self.name}_count{self._labels(labelvalues)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def register_gauges(self, collector):
+        """Add a callable returning [(name, documentation, {labels: value})] read at scrape time"""
+        self._collectors.append(collector)
+
+    def exposition(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            for name, documentation, values in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} gauge')
+                for labels, value in values.items():
+                    label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+                    lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
+
+http_requests = Counter(
+    'http_requests', 'HTTP requests by view, method and status code',
+    ['view', 'method', 'status'],
+)
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request, by view',
+    ['view'],
+)
+http_request_phase_duration = Histogram(
+    'http_request_phase_duration_seconds',
+    'Time spent per request in Stripe API calls, database queries and response rendering',
+    ['view', 'phase'],
+)
+stripe_api_duration = Histogram(
+    'stripe_api_request_duration_seconds', 'Stripe API calls including retries, by operation',
+    ['operation', 'outcome'],
+)
+stripe_circuit_trips = Counter(
+    'stripe_circuit_trips', 'Stripe circuit breakers opened, by operation',
+    ['operation'],
+)
+stripe_circuit_rejections = Counter(
+    'stripe_circuit_rejections', 'Stripe calls failed fast because their circuit was open, by operation',
+    ['operation'],
+)
+webhook_events = Counter(
+    'webhook_events', 'Stripe webhook events by type and outcome',
+    ['event_type', 'outcome'],
+)
+webhook_signature_failures = Counter(
+    'webhook_signature_failures', 'Rejected Stripe webhook deliveries',
+    ['reason'],
+)
+payment_transitions = Counter(
+    'payment_status_transitions', 'Payments moved to a new status',
+    ['to_status'],
+)
+manychat_notifications = Counter(
+    'manychat_notifications', 'ManyChat payment notifications by delivery outcome',
+    ['outcome'],
+)
+rate_limited_requests = Counter(
+    'rate_limited_requests', 'Requests rejected with 429 by a rate limit, by view and limit',
+    ['view', 'scope'],
+)
+
+PHASES = ('stripe', 'db', 'render')
+
+
+def add_phase_time(phase, seconds):
+    """Charge seconds to a phase of the current request, if any"""
+    phases = request_phases_var.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def record_query(execute, sql, params, many, context):
+    """connection.execute_wrappers hook that times every query"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        add_phase_time('db', time.perf_counter() - started)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver adding record_query to new connections"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def stripe_pool_gauges():
+    """Connection pool counters of the shared Stripe client, for REGISTRY.register_gauges"""
+    from .stripe_client import pool_stats
+
+    return [
+        (f'stripe_http_{key}', f'Stripe client connection pool: {key.replace("_", " ")}', {(): value})
+        for key, value in pool_stats().items()
+    ]
+
+
+class MetricsMiddleware:
+    """Records latency, status and per-phase time for every request"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        phases = {}
+        token = request_phases_var.set(phases)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_phases_var.reset(token)
+        self.record(request, response, time.perf_counter() - started, phases)
+        return response
+
+    async def __acall__(self, request):
+        phases = {}
+        token = request_phases_var.set(phases)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_phases_var.reset(token)
+        self.record(request, response, time.perf_counter() - started, phases)
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs right before DRF/template responses are rendered.
+        started = time.perf_counter()
+        response.add_post_render_callback(
+            lambda rendered: add_phase_time('render', time.perf_counter() - started)
+        )
+        return response
+
+    @staticmethod
+    def record(request, response, duration, phases):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        http_requests.inc(view, request.method, response.status_code)
+        http_request_duration.observe(duration, view)
+        for phase in PHASES:
+            if phase in phases:
+                http_request_phase_duration.observe(phases[phase], view, phase)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0004_processedeventmodel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentmodel',
+            index=models.Index(condition=models.Q(('manychat_payment', False)), fields=['fb_id', '-updated_at'], name='payments_unclaimed_fb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentmodel',
+            index=models.Index(fields=['payment_status', '-payment_date'], name='payments_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentmodel',
+            index=models.Index(fields=['-payment_date'], name='payments_date_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0005_payment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentmodel',
+            name='amount_minor',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='paymentmodel',
+            name='amount',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='paymentmodel',
+            name='currency',
+            field=models.CharField(choices=[('eur', 'Euro'), ('usd', 'US Dollar'), ('gbp', 'Pound Sterling'), ('chf', 'Swiss Franc'), ('pln', 'Polish Złoty'), ('czk', 'Czech Koruna'), ('sek', 'Swedish Krona'), ('nok', 'Norwegian Krone'), ('dkk', 'Danish Krone'), ('cad', 'Canadian Dollar'), ('aud', 'Australian Dollar'), ('jpy', 'Japanese Yen')], default='usd', max_length=3),
+        ),
+    ]
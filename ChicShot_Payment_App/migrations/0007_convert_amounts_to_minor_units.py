@@ -0,0 +1,60 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 1000
+
+# Copied from money.MINOR_UNIT_DIGITS as it was when this migration was written.
+MINOR_UNIT_DIGITS = {'jpy': 0}
+
+
+def chunks(queryset):
+    """Rows in id order, CHUNK_SIZE at a time"""
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id')[:CHUNK_SIZE])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def amounts_to_minor_units(apps, schema_editor):
+    PaymentModel = apps.get_model('ChicShot_Payment_App', 'PaymentModel')
+    db = schema_editor.connection.alias
+    queryset = PaymentModel.objects.using(db).only('id', 'amount', 'currency')
+    # One transaction per chunk keeps locks short on a large table.
+    for rows in chunks(queryset):
+        for payment in rows:
+            payment.currency = (payment.currency or 'usd').strip().lower()
+            digits = MINOR_UNIT_DIGITS.get(payment.currency, 2)
+            # repr() is the shortest decimal that round-trips the float, so
+            # 9.99 becomes Decimal('9.99') and not 9.9900000000000002131.
+            minor = Decimal(repr(payment.amount or 0)).scaleb(digits)
+            payment.amount_minor = int(minor.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        with transaction.atomic(using=db):
+            PaymentModel.objects.using(db).bulk_update(rows, ['amount_minor', 'currency'])
+
+
+def minor_units_to_amounts(apps, schema_editor):
+    PaymentModel = apps.get_model('ChicShot_Payment_App', 'PaymentModel')
+    db = schema_editor.connection.alias
+    queryset = PaymentModel.objects.using(db).only('id', 'amount_minor', 'currency')
+    for rows in chunks(queryset):
+        for payment in rows:
+            digits = MINOR_UNIT_DIGITS.get(payment.currency, 2)
+            payment.amount = float(Decimal(payment.amount_minor).scaleb(-digits))
+        with transaction.atomic(using=db):
+            PaymentModel.objects.using(db).bulk_update(rows, ['amount'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0006_paymentmodel_amount_minor'),
+    ]
+
+    operations = [
+        migrations.RunPython(amounts_to_minor_units, minor_units_to_amounts),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0007_convert_amounts_to_minor_units'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='paymentmodel',
+            name='amount',
+        ),
+        migrations.AlterField(
+            model_name='paymentmodel',
+            name='amount_minor',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='paymentmodel',
+            index=models.Index(fields=['payment_status', 'currency', 'amount_minor'], name='payments_revenue_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0008_remove_paymentmodel_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollupModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('package', models.CharField(max_length=100)),
+                ('currency', models.CharField(choices=[('eur', 'Euro'), ('usd', 'US Dollar'), ('gbp', 'Pound Sterling'), ('chf', 'Swiss Franc'), ('pln', 'Polish Złoty'), ('czk', 'Czech Koruna'), ('sek', 'Swedish Krona'), ('nok', 'Norwegian Krone'), ('dkk', 'Danish Krone'), ('cad', 'Canadian Dollar'), ('aud', 'Australian Dollar'), ('jpy', 'Japanese Yen')], max_length=3)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('completed_amount_minor', models.BigIntegerField(default=0)),
+                ('refunded_count', models.IntegerField(default=0)),
+                ('refunded_amount_minor', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'revenue_rollups',
+                'constraints': [models.UniqueConstraint(fields=('day', 'package', 'currency'), name='revenue_rollups_bucket_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0009_revenuerollupmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPaymentModel',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fb_id', models.CharField(max_length=100)),
+                ('package', models.CharField(max_length=100)),
+                ('amount_minor', models.BigIntegerField()),
+                ('payment_date', models.DateTimeField()),
+                ('payment_method', models.CharField(blank=True, choices=[('card', 'Card'), ('google_pay', 'Google Pay'), ('apple_pay', 'Apple Pay')], max_length=50, null=True)),
+                ('stripe_payment_intent_id', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('stripe_customer_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('payment_status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunded', 'Refunded')], max_length=20)),
+                ('currency', models.CharField(choices=[('eur', 'Euro'), ('usd', 'US Dollar'), ('gbp', 'Pound Sterling'), ('chf', 'Swiss Franc'), ('pln', 'Polish Złoty'), ('czk', 'Czech Koruna'), ('sek', 'Swedish Krona'), ('nok', 'Norwegian Krone'), ('dkk', 'Danish Krone'), ('cad', 'Canadian Dollar'), ('aud', 'Australian Dollar'), ('jpy', 'Japanese Yen')], max_length=3)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField()),
+                ('manychat_payment', models.BooleanField(default=False)),
+                ('archive_month', models.DateField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'payments_archive',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='paymentmodel',
+            options={},
+        ),
+    ]
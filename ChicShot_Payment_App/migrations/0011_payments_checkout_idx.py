@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0010_payments_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentmodel',
+            index=models.Index(fields=['fb_id', 'package', 'amount_minor', 'currency', '-id'], name='payments_checkout_idx'),
+        ),
+    ]
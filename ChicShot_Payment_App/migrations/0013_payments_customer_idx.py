@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChicShot_Payment_App', '0012_manychat_notifications'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentmodel',
+            index=models.Index(fields=['stripe_customer_id'], name='payments_customer_idx'),
+        ),
+    ]
@@ -1,4 +1,160 @@
-from django.db import models
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .metrics import payment_transitions
+from .money import Currency, from_minor_units
+
+
+class PaymentQuerySet(models.QuerySet):
+    CLAIM_FIELDS = ('id', 'package', 'payment_status', 'amount_minor', 'currency')
+
+    def transition(self, new_status, **fields):
+        """Move matching payments to new_status where STATUS_TRANSITIONS allows it
+
+        Transitions with side effects (see record_transitions) lock the
+        payments first, so the side effects cover exactly the rows that
+        moved, in the same transaction.
+        """
+        movable = self.filter(payment_status__in=PaymentModel.previous_statuses(new_status))
+        values = dict(payment_status=new_status, updated_at=timezone.now(), **fields)
+        if not self.has_side_effects(new_status):
+            updated = movable.update(**values)
+        else:
+            db = self._db or router.db_for_write(self.model)
+            with transaction.atomic(using=db):
+                rows = list(movable.using(db).select_for_update().order_by().values(*PaymentModel.TRANSITION_FIELDS))
+                updated = self.model.objects.using(db).filter(
+                    pk__in=[row['id'] for row in rows]
+                ).update(**values) if rows else 0
+                self.record_transitions(db, rows, new_status)
+        if updated:
+            payment_transitions.inc(new_status, amount=updated)
+        return updated
+
+    @staticmethod
+    def has_side_effects(new_status):
+        return RevenueRollupModel.affected_by(new_status) or ManyChatNotificationModel.sent_for(new_status)
+
+    @staticmethod
+    def record_transitions(db, rows, new_status):
+        """Side effects of payments (TRANSITION_FIELDS dicts, old status) moving to new_status
+
+        Call inside the transaction that moves them: the revenue rollup and
+        the ManyChat outbox commit or roll back with the payments.
+        """
+        RevenueRollupModel.objects.using(db).apply_transitions(rows, new_status)
+        ManyChatNotificationModel.objects.using(db).enqueue(rows, new_status)
+
+    async def atransition(self, new_status, **fields):
+        # The rollup needs a transaction, which the async ORM does not offer.
+        return await sync_to_async(self.transition)(new_status, **fields)
+
+    def totals_by_currency(self):
+        """{currency: {'count', 'amount_minor', 'amount'}} summed in the database
+
+        Sums are exact integer minor units; amount is the Decimal total.
+        """
+        rows = self.order_by().values('currency').annotate(
+            count=Count('id'), amount_minor=Sum('amount_minor'),
+        )
+        return {
+            row['currency']: {
+                'count': row['count'],
+                'amount_minor': row['amount_minor'],
+                'amount': from_minor_units(row['amount_minor'], row['currency']),
+            }
+            for row in rows
+        }
+
+    def revenue(self):
+        """Completed payments summed per currency"""
+        return self.filter(payment_status='completed').totals_by_currency()
+
+    def claim_for_manychat(self, fb_id):
+        """Mark the latest unclaimed payment for fb_id as seen by ManyChat
+
+        Returns the claimed payment, with only the fields ManyChat needs
+        loaded, or None. Concurrent claims for the same fb_id never return
+        the same payment. Payments the push dispatcher is sending are
+        skipped, and the claimed payment's queued push is dropped, so
+        ManyChat hears about each payment once.
+        """
+        db = self._db or router.db_for_write(self.model)
+        connection = connections[db]
+        if self._supports_update_returning(connection):
+            return self._claim_with_returning(db, fb_id)
+
+        with transaction.atomic(using=db):
+            payment = self.using(db).select_for_update(
+                skip_locked=connection.features.has_select_for_update_skip_locked
+            ).filter(
+                fb_id=fb_id, manychat_payment=False
+            ).exclude(
+                id__in=ManyChatNotificationModel.objects.using(db).in_flight().values('payment_id')
+            ).only(*self.CLAIM_FIELDS).order_by('-updated_at').first()
+            if payment:
+                payment.manychat_payment = True
+                payment.save(update_fields=['manychat_payment', 'updated_at'])
+                ManyChatNotificationModel.objects.using(db).discard(payment.id)
+        return payment
+
+    @staticmethod
+    def _supports_update_returning(connection):
+        """Whether the backend runs UPDATE ... RETURNING (PostgreSQL, SQLite 3.35+)"""
+        if connection.vendor == 'postgresql':
+            return True
+        return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+    def _claim_with_returning(self, db, fb_id):
+        # One statement finds and flips the row. On PostgreSQL the inner
+        # SELECT skips rows another claim has locked instead of waiting.
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        # from_db() expects the values in model field order.
+        fields = [
+            field for field in self.model._meta.concrete_fields
+            if field.attname in self.CLAIM_FIELDS
+        ]
+        table = qn(self.model._meta.db_table)
+        notifications = qn(ManyChatNotificationModel._meta.db_table)
+        lock = ' FOR UPDATE SKIP LOCKED' if connection.vendor == 'postgresql' else ''
+        sql = (
+            f"UPDATE {table} SET {qn('manychat_payment')} = %s, {qn('updated_at')} = %s "
+            f"WHERE {qn('id')} = ("
+            f"SELECT {qn('id')} FROM {table} "
+            f"WHERE {qn('fb_id')} = %s AND NOT {qn('manychat_payment')} "
+            f"AND {qn('id')} NOT IN ("
+            f"SELECT {qn('payment_id')} FROM {notifications} "
+            f"WHERE {qn('status')} = %s AND {qn('locked_until')} > %s"
+            f") "
+            f"ORDER BY {qn('updated_at')} DESC LIMIT 1{lock}"
+            f") AND NOT {qn('manychat_payment')} "
+            f"RETURNING {', '.join(qn(field.column) for field in fields)}"
+        )
+        now = timezone.now()
+        db_now = connection.ops.adapt_datetimefield_value(now)
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            cursor.execute(sql, [True, db_now, fb_id, 'processing', db_now])
+            row = cursor.fetchone()
+            if row is not None:
+                ManyChatNotificationModel.objects.using(db).discard(row[fields.index(self.model._meta.pk)])
+        if row is None:
+            return None
+
+        payment = self.model.from_db(
+            db,
+            [field.attname for field in fields],
+            [field.to_python(value) for field, value in zip(fields, row)],
+        )
+        payment.fb_id = fb_id
+        payment.manychat_payment = True
+        payment.updated_at = now
+        return payment
 
 
 class PaymentModel(models.Model):
@@ -8,6 +164,24 @@ class PaymentModel(models.Model):
         ('failed', 'Failed'),
         ('refunded', 'Refunded'),
     ]
+
+    # Statuses only move forward, so a late or redelivered event can never
+    # turn a completed payment back into a failed or pending one.
+    STATUS_TRANSITIONS = {
+        'pending': ('completed', 'failed'),
+        'failed': ('completed',),
+        'completed': ('refunded',),
+        'refunded': (),
+    }
+
+    # Statuses that Stripe will not change without a new event (a refund).
+    SETTLED_STATUSES = ('completed', 'refunded')
+
+    # What PaymentQuerySet.record_transitions needs to know about each row.
+    TRANSITION_FIELDS = (
+        'id', 'fb_id', 'payment_status', 'payment_date', 'package', 'currency', 'amount_minor',
+        'stripe_payment_intent_id', 'manychat_payment',
+    )
     
     PAYMENT_METHOD_CHOICES = [
         ('card', 'Card'),
@@ -17,7 +191,8 @@ class PaymentModel(models.Model):
     
     fb_id = models.CharField(max_length=100)
     package = models.CharField(max_length=100)
-    amount = models.FloatField()
+    # Integer minor units of currency (cents for EUR, yen for JPY).
+    amount_minor = models.BigIntegerField()
     payment_date = models.DateTimeField(auto_now_add=True)
     payment_method = models.CharField(max_length=50, choices=PAYMENT_METHOD_CHOICES, blank=True, null=True)
   
@@ -26,13 +201,279 @@ class PaymentModel(models.Model):
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
     
 
-    currency = models.CharField(max_length=3, default='usd')
+    currency = models.CharField(max_length=3, choices=Currency.choices, default=Currency.USD)
     description = models.TextField(blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
     manychat_payment=models.BooleanField(default=False)
+
+    objects = PaymentQuerySet.as_manager()
+
+    # Unordered by default: queries that need an order ask for it, and the
+    # rest skip the sort.
     class Meta:
         db_table = 'payments'
-        ordering = ['-payment_date']
+        indexes = [
+            # ManyChatPaymentCheck: latest unclaimed payment for an fb_id.
+            models.Index(
+                fields=['fb_id', '-updated_at'],
+                condition=models.Q(manychat_payment=False),
+                name='payments_unclaimed_fb_idx',
+            ),
+            # Admin changelist: status filter with the default ordering.
+            models.Index(fields=['payment_status', '-payment_date'], name='payments_status_date_idx'),
+            models.Index(fields=['-payment_date'], name='payments_date_idx'),
+            # CreatePaymentIntentView: latest payment for the same checkout.
+            models.Index(fields=['fb_id', 'package', 'amount_minor', 'currency', '-id'], name='payments_checkout_idx'),
+            # Revenue totals: per-currency sums without reading the table.
+            models.Index(fields=['payment_status', 'currency', 'amount_minor'], name='payments_revenue_idx'),
+            # Admin search by Stripe customer id.
+            models.Index(fields=['stripe_customer_id'], name='payments_customer_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.fb_id} - {self.package} - ${self.amount} - {self.payment_status}"
+        return f"{self.fb_id} - {self.package} - {self.amount} {self.currency.upper()} - {self.payment_status}"
+
+    @property
+    def amount(self):
+        """Decimal amount in major units"""
+        return from_minor_units(self.amount_minor, self.currency)
+
+    @classmethod
+    def previous_statuses(cls, new_status):
+        return [old for old, allowed in cls.STATUS_TRANSITIONS.items() if new_status in allowed]
+
+    def can_transition_to(self, new_status):
+        return new_status in self.STATUS_TRANSITIONS[self.payment_status]
+
+    @property
+    def is_final(self):
+        """Settled with a known payment method, so Stripe has nothing to add
+
+        Webhooks complete payments without a method (their payload only has
+        the charge id); the next status check fetches it once.
+        """
+        return self.payment_status in self.SETTLED_STATUSES and self.payment_method is not None
+
+
+class WebhookEventModel(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    locked_by = models.CharField(max_length=64, blank=True, null=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'webhook_events'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='webhook_events_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} - {self.event_type} - {self.status}"
+
+
+class ProcessedEventModel(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'processed_webhook_events'
+
+    def __str__(self):
+        return f"{self.event_id} - {self.event_type}"
+
+
+class ArchivedPaymentModel(models.Model):
+    """A payment in a final status moved out of `payments` by archive.archive_payments()
+
+    Keeps the original id and all PaymentModel columns; archive_month (the
+    first day of the payment_date month) is the partition key, so a month
+    can be dropped with one indexed delete.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    fb_id = models.CharField(max_length=100)
+    package = models.CharField(max_length=100)
+    amount_minor = models.BigIntegerField()
+    payment_date = models.DateTimeField()
+    payment_method = models.CharField(max_length=50, choices=PaymentModel.PAYMENT_METHOD_CHOICES, blank=True, null=True)
+    stripe_payment_intent_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    stripe_customer_id = models.CharField(max_length=255, blank=True, null=True)
+    payment_status = models.CharField(max_length=20, choices=PaymentModel.PAYMENT_STATUS_CHOICES)
+    currency = models.CharField(max_length=3, choices=Currency.choices)
+    description = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField()
+    manychat_payment = models.BooleanField(default=False)
+    archive_month = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'payments_archive'
+
+    def __str__(self):
+        return f"{self.fb_id} - {self.package} - {self.amount} {self.currency.upper()} - {self.payment_status} (archived)"
+
+    @property
+    def amount(self):
+        return from_minor_units(self.amount_minor, self.currency)
+
+
+class RevenueRollupQuerySet(models.QuerySet):
+    def apply_transitions(self, rows, new_status):
+        """Adjust the rollup for payments (TRANSITION_FIELDS dicts) that moved to new_status
+
+        Call inside the transaction that moved them.
+        """
+        deltas = Counter()
+        for row in rows:
+            bucket = (timezone.localdate(row['payment_date']), row['package'], row['currency'])
+            for status, sign in ((row['payment_status'], -1), (new_status, 1)):
+                if status in RevenueRollupModel.STATUSES:
+                    deltas[bucket + (f'{status}_count',)] += sign
+                    deltas[bucket + (f'{status}_amount_minor',)] += sign * row['amount_minor']
+
+        buckets = {}
+        for (day, package, currency, column), delta in deltas.items():
+            if delta:
+                buckets.setdefault((day, package, currency), {})[column] = delta
+        for (day, package, currency), columns in buckets.items():
+            self.add(day, package, currency, columns)
+
+    def add(self, day, package, currency, columns):
+        """Add deltas {column: n} to one bucket, creating it if needed"""
+        key = dict(day=day, package=package, currency=currency)
+        increments = {column: F(column) + delta for column, delta in columns.items()}
+        if self.filter(**key).update(**increments):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(**key, **columns)
+        except IntegrityError:
+            # Another transaction created the bucket first.
+            self.filter(**key).update(**increments)
+
+
+class RevenueRollupModel(models.Model):
+    """Completed and refunded payment totals per day, package and currency
+
+    Kept up to date by PaymentQuerySet.transition(); rebuilt from payments by
+    the rebuild_revenue_rollup command. day is the local date of
+    payment_date.
+    """
+
+    STATUSES = ('completed', 'refunded')
+
+    day = models.DateField()
+    package = models.CharField(max_length=100)
+    currency = models.CharField(max_length=3, choices=Currency.choices)
+    completed_count = models.IntegerField(default=0)
+    completed_amount_minor = models.BigIntegerField(default=0)
+    refunded_count = models.IntegerField(default=0)
+    refunded_amount_minor = models.BigIntegerField(default=0)
+
+    objects = RevenueRollupQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'revenue_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'package', 'currency'], name='revenue_rollups_bucket_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.package} - {self.currency.upper()}"
+
+    @classmethod
+    def affected_by(cls, new_status):
+        return new_status in cls.STATUSES or any(
+            old in cls.STATUSES for old in PaymentModel.previous_statuses(new_status)
+        )
+
+
+class ManyChatNotificationQuerySet(models.QuerySet):
+    def in_flight(self):
+        """Notifications a dispatcher has leased and may be sending right now"""
+        return self.filter(status='processing', locked_until__gt=timezone.now())
+
+    def discard(self, payment_id):
+        """Drop the undelivered push for a payment ManyChat has polled instead"""
+        return self.filter(payment_id=payment_id, status__in=['pending', 'processing']).delete()
+
+    def enqueue(self, rows, new_status):
+        """Queue a notification for each payment (TRANSITION_FIELDS dict) that completed
+
+        Call inside the transaction that completes them.
+        """
+        if not ManyChatNotificationModel.sent_for(new_status):
+            return
+        self.bulk_create([
+            ManyChatNotificationModel(
+                payment_id=row['id'],
+                fb_id=row['fb_id'],
+                payload={
+                    'payment_id': row['id'],
+                    'fb_id': row['fb_id'],
+                    'package': row['package'],
+                    'payment_status': new_status,
+                    'amount': str(from_minor_units(row['amount_minor'], row['currency'])),
+                    'amount_minor': row['amount_minor'],
+                    'currency': row['currency'],
+                    'payment_intent_id': row['stripe_payment_intent_id'],
+                },
+            )
+            for row in rows
+            # Nothing to tell ManyChat about payments it has already seen.
+            if row['fb_id'] and not row['manychat_payment']
+        ], ignore_conflicts=True)
+
+
+class ManyChatNotificationModel(models.Model):
+    """Outbox of completed payments to push to MANYCHAT_NOTIFY_URL
+
+    Written in the transaction that completes the payment and delivered by
+    `manage.py dispatch_manychat_notifications`. Delivered rows are deleted;
+    rows that used up their attempts stay as failed.
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('failed', 'Failed'),
+    ]
+
+    # Not a ForeignKey: archived payments leave `payments`.
+    payment_id = models.BigIntegerField(unique=True)
+    fb_id = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    locked_by = models.CharField(max_length=64, blank=True, null=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ManyChatNotificationQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'manychat_notifications'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='manychat_notif_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.fb_id} - payment {self.payment_id} - {self.status}"
+
+    @staticmethod
+    def sent_for(new_status):
+        return new_status == 'completed' and bool(settings.MANYCHAT_NOTIFY_URL)
@@ -0,0 +1,62 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import models
+
+
+class Currency(models.TextChoices):
+    """Currencies we accept, as Stripe's lowercase ISO codes"""
+
+    EUR = 'eur', 'Euro'
+    USD = 'usd', 'US Dollar'
+    GBP = 'gbp', 'Pound Sterling'
+    CHF = 'chf', 'Swiss Franc'
+    PLN = 'pln', 'Polish Złoty'
+    CZK = 'czk', 'Czech Koruna'
+    SEK = 'sek', 'Swedish Krona'
+    NOK = 'nok', 'Norwegian Krone'
+    DKK = 'dkk', 'Danish Krone'
+    CAD = 'cad', 'Canadian Dollar'
+    AUD = 'aud', 'Australian Dollar'
+    JPY = 'jpy', 'Japanese Yen'
+
+
+# Digits after the decimal point; Stripe amounts are in these minor units.
+MINOR_UNIT_DIGITS = {'jpy': 0}
+DEFAULT_MINOR_UNIT_DIGITS = 2
+
+
+def normalize_currency(code):
+    """Currency for a client-supplied code such as 'EUR'; raises ValueError if unsupported"""
+    try:
+        return Currency(str(code).strip().lower())
+    except ValueError:
+        raise ValueError(f"Unsupported currency: {code}") from None
+
+
+def minor_unit_digits(currency):
+    return MINOR_UNIT_DIGITS.get(currency, DEFAULT_MINOR_UNIT_DIGITS)
+
+
+def to_minor_units(amount, currency):
+    """Exact integer minor units for a decimal amount ('9.99' EUR -> 999)
+
+    Raises ValueError for amounts that are not positive or have more
+    decimals than the currency has, and for unsupported currencies.
+    """
+    currency = normalize_currency(currency)
+    try:
+        value = Decimal(str(amount).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {amount}") from None
+    if not value.is_finite() or value <= 0:
+        raise ValueError(f"Invalid amount: {amount}")
+    minor = value.scaleb(minor_unit_digits(currency))
+    if minor != minor.to_integral_value():
+        raise ValueError(f"Amount {amount} has more decimals than {currency.upper()} allows")
+    return int(minor)
+
+
+def from_minor_units(amount_minor, currency):
+    """Decimal amount for integer minor units (999 EUR -> Decimal('9.99'))"""
+    digits = minor_unit_digits(currency)
+    return Decimal(amount_minor).scaleb(-digits).quantize(Decimal(1).scaleb(-digits))
@@ -0,0 +1,181 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import rate_limited_requests
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(rate):
+    """'30/min' -> (capacity 30, refill 0.5 tokens per second)"""
+    num, period = rate.split('/')
+    return int(num), int(num) / PERIODS[period]
+
+
+class ShardedMemoryBackend:
+    """Token buckets in this process, spread over independently locked shards
+
+    Limits are per process: with N workers a key gets up to N times its rate.
+    Each shard keeps at most max_entries / shards buckets and forgets the
+    least recently used; a forgotten bucket comes back full, as it would
+    after being idle.
+    """
+
+    def __init__(self, shards=16, max_entries=100000):
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self._max_per_shard = max(1, max_entries // shards)
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        """Take cost tokens; returns 0 if they were available, else seconds until they are"""
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            now = time.monotonic()
+            tokens, updated = buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            wait = 0 if tokens >= cost else (cost - tokens) / refill_rate
+            buckets[key] = (tokens - cost if not wait else tokens, now)
+            buckets.move_to_end(key)
+            if len(buckets) > self._max_per_shard:
+                buckets.popitem(last=False)
+        return wait
+
+    def refund(self, key, capacity, refill_rate, cost=1):
+        """Give back tokens taken by take(), when the request was limited elsewhere"""
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            if key in buckets:
+                tokens, updated = buckets[key]
+                buckets[key] = (min(capacity, tokens + cost), updated)
+
+
+class DjangoCacheBackend:
+    """Token buckets in one of settings.CACHES, shared between processes
+
+    Stores one timestamp per key (the generic cell rate algorithm form of a
+    token bucket). Django's cache API has no compare-and-set, so concurrent
+    requests for the same key in different processes can occasionally both
+    take the last token.
+    """
+
+    def __init__(self, alias='default', key_prefix='ratelimit:'):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        key = self.key_prefix + key
+        interval = 1 / refill_rate
+        burst = (capacity - cost) * interval
+        now = time.time()
+        # Theoretical arrival time: when the bucket would be full again.
+        tat = max(self.cache.get(key) or now, now)
+        if tat - now > burst:
+            return tat - now - burst
+        tat += cost * interval
+        self.cache.set(key, tat, math.ceil(tat - now) + 1)
+        return 0
+
+    def refund(self, key, capacity, refill_rate, cost=1):
+        key = self.key_prefix + key
+        tat = self.cache.get(key)
+        if tat is not None:
+            now = time.time()
+            tat = max(tat - cost / refill_rate, now)
+            self.cache.set(key, tat, math.ceil(tat - now) + 1)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = settings.PAYMENT_RATE_LIMITS
+                _backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def _bucket(view, scope, key):
+    """(backend key, capacity, refill rate) of the scope's limit, or None if unlimited"""
+    rate = settings.PAYMENT_RATE_LIMITS['RATES'].get(view, {}).get(scope)
+    if not rate or not key:
+        return None
+    return (f"{view}:{scope}:{key}", *parse_rate(rate))
+
+
+def client_ip(request):
+    """The client address: REMOTE_ADDR, or X-Forwarded-For behind REST_FRAMEWORK['NUM_PROXIES'] proxies"""
+    return BaseThrottle().get_ident(request)
+
+
+def check(view, fb_id, request, cost=1):
+    """Seconds the request must wait under the fb_id, ip and global limits of view, or 0
+
+    The request takes cost tokens from each limit. They are only spent when
+    every limit lets the request through: tokens taken before a limit
+    rejects it are given back, so a rejected request does not eat into the
+    other limits.
+    """
+    backend = get_backend()
+    taken = []
+    for scope, key in (('fb_id', fb_id), ('ip', client_ip(request)), ('global', 'all')):
+        bucket = _bucket(view, scope, key)
+        if bucket is None:
+            continue
+        wait = backend.take(*bucket, cost=cost)
+        if wait:
+            rate_limited_requests.inc(view, scope)
+            for taken_bucket in taken:
+                backend.refund(*taken_bucket, cost=cost)
+            return wait
+        taken.append(bucket)
+    return 0
+
+
+def too_many_requests(wait):
+    response = JsonResponse(
+        {'detail': f'Request was throttled. Expected available in {math.ceil(wait)} seconds.'}, status=429,
+    )
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+class PaymentRateThrottle(BaseThrottle):
+    """DRF throttle over the PAYMENT_RATE_LIMITS buckets of a view, via check()
+
+    Views set rate_limit_view, their key in PAYMENT_RATE_LIMITS['RATES'];
+    scopes without a rate there are not limited. All scopes are one throttle
+    so that a request limited by one scope takes no token from the others.
+    A view may define rate_limit_cost(request), the tokens a request takes
+    (1 by default).
+    """
+
+    def get_fb_id(self, request, view):
+        fb_id = view.kwargs.get('fb_id')
+        # A JSON body may be a list; the view answers that with 400.
+        if not fb_id and isinstance(request.data, dict):
+            fb_id = request.data.get('fb_id')
+        return fb_id
+
+    def get_cost(self, request, view):
+        rate_limit_cost = getattr(view, 'rate_limit_cost', None)
+        return rate_limit_cost(request) if rate_limit_cost else 1
+
+    def allow_request(self, request, view):
+        self._wait = check(
+            view.rate_limit_view, self.get_fb_id(request, view), request, self.get_cost(request, view),
+        )
+        return not self._wait
+
+    def wait(self):
+        return self._wait
@@ -0,0 +1,149 @@
+from collections import defaultdict
+from datetime import timedelta
+
+import stripe
+from django.db import router, transaction
+from django.utils import timezone
+
+from . import events, status_cache
+from .metrics import payment_transitions
+from .models import PaymentModel
+from .routers import mark_written
+from .webhooks import payment_method_from_intent
+
+RECONCILE_FIELDS = (
+    'id', 'fb_id', 'stripe_payment_intent_id', 'payment_status', 'payment_method',
+    'stripe_customer_id', 'payment_date',
+)
+
+# Slack between Stripe's `created` and our payment_date, which is set right
+# after the intent is created.
+CREATED_SLACK = timedelta(minutes=5)
+
+# PaymentIntents per list page; Stripe's maximum.
+LIST_PAGE_SIZE = 100
+
+
+def status_from_intent(payment_intent):
+    """Our payment_status for a PaymentIntent, or None while it is still open"""
+    if payment_intent['status'] == 'succeeded':
+        return 'completed'
+    if payment_intent['status'] == 'canceled':
+        return 'failed'
+    if payment_intent['status'] == 'requires_payment_method' and payment_intent.get('last_payment_error'):
+        return 'failed'
+    return None
+
+
+def stale_payments(statuses, stale_after, after_id, chunk_size):
+    """One keyset-paginated chunk of payments Stripe may have moved on from"""
+    return list(
+        PaymentModel.objects.filter(
+            id__gt=after_id,
+            payment_status__in=statuses,
+            updated_at__lt=timezone.now() - stale_after,
+            stripe_payment_intent_id__isnull=False,
+        ).order_by('id').only(*RECONCILE_FIELDS)[:chunk_size]
+    )
+
+
+def time_windows(payments, max_window):
+    """Split payments into groups whose payment_date spans at most max_window"""
+    groups = []
+    for payment in sorted(payments, key=lambda p: p.payment_date):
+        if groups and payment.payment_date - groups[-1][0].payment_date <= max_window:
+            groups[-1].append(payment)
+        else:
+            groups.append([payment])
+    return groups
+
+
+def fetch_intents(client, payments):
+    """PaymentIntents created around these payments, keyed by id
+
+    Lists the intents created in the payments' time window. A busy account
+    can have far more of them than we want, so listing stops once it has
+    fetched as many pages as there are ids still missing, and the rest are
+    retrieved one by one: at most two Stripe calls per payment. Intents
+    Stripe does not know are left out.
+    """
+    wanted = {payment.stripe_payment_intent_id for payment in payments}
+    start = min(payment.payment_date for payment in payments) - CREATED_SLACK
+    end = max(payment.payment_date for payment in payments) + CREATED_SLACK
+    intents = {}
+    page = client.v1.payment_intents.list(params={
+        'created': {'gte': int(start.timestamp()), 'lte': int(end.timestamp())},
+        'limit': LIST_PAGE_SIZE,
+        'expand': ['data.latest_charge'],
+    })
+    for seen, payment_intent in enumerate(page.auto_paging_iter(), 1):
+        if payment_intent['id'] in wanted:
+            intents[payment_intent['id']] = payment_intent
+            if len(intents) == len(wanted):
+                return intents
+        if seen % LIST_PAGE_SIZE == 0 and seen // LIST_PAGE_SIZE >= len(wanted) - len(intents):
+            break
+
+    for payment_intent_id in sorted(wanted - intents.keys()):
+        try:
+            intents[payment_intent_id] = client.v1.payment_intents.retrieve(
+                payment_intent_id, params={'expand': ['latest_charge']},
+            )
+        except stripe.error.InvalidRequestError:
+            # No such intent (e.g. deleted test data); reported as missing.
+            continue
+    return intents
+
+
+def reconcile_payments(client, payments, max_window):
+    """Bring a chunk of payments in line with Stripe; returns counters"""
+    intents = {}
+    for group in time_windows(payments, max_window):
+        intents.update(fetch_intents(client, group))
+
+    now = timezone.now()
+    changed = defaultdict(list)
+    for payment in payments:
+        payment_intent = intents.get(payment.stripe_payment_intent_id)
+        if payment_intent is None:
+            continue
+        new_status = status_from_intent(payment_intent)
+        if new_status is None or not payment.can_transition_to(new_status):
+            continue
+
+        changed[payment.payment_status, new_status].append(payment)
+        payment.payment_status = new_status
+        payment.payment_method = payment_method_from_intent(payment_intent) or payment.payment_method
+        payment.stripe_customer_id = payment_intent.get('customer') or payment.stripe_customer_id
+        payment.updated_at = now
+
+    updated = 0
+    for (seen_status, new_status), rows in changed.items():
+        with transaction.atomic():
+            # Locking the rows still in the status we read skips those a
+            # webhook updated since, and tells us exactly which ones move.
+            locked = list(PaymentModel.objects.select_for_update().filter(
+                pk__in=[payment.pk for payment in rows], payment_status=seen_status,
+            ).order_by().values(*PaymentModel.TRANSITION_FIELDS))
+            locked_ids = {row['id'] for row in locked}
+            rows = [payment for payment in rows if payment.pk in locked_ids]
+            if rows:
+                PaymentModel.objects.bulk_update(
+                    rows, ['payment_status', 'payment_method', 'stripe_customer_id', 'updated_at'],
+                )
+                PaymentModel.objects.record_transitions(router.db_for_write(PaymentModel), locked, new_status)
+        if rows:
+            payment_transitions.inc(new_status, amount=len(rows))
+        updated += len(rows)
+        for payment in rows:
+            status_cache.invalidate(payment.stripe_payment_intent_id)
+            events.publish_status(
+                payment.stripe_payment_intent_id, payment.fb_id, new_status, payment.payment_method,
+            )
+        mark_written(*(key for payment in rows for key in (payment.stripe_payment_intent_id, payment.fb_id)))
+
+    return {
+        'checked': len(payments),
+        'missing': len(payments) - sum(p.stripe_payment_intent_id in intents for p in payments),
+        'updated': updated,
+    }
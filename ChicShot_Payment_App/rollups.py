@@ -0,0 +1,99 @@
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ArchivedPaymentModel, PaymentModel, RevenueRollupModel
+from .money import from_minor_units
+
+GROUP_BY = ('day', 'package', 'currency')
+
+TOTAL_FIELDS = ('completed_count', 'completed_amount_minor', 'refunded_count', 'refunded_amount_minor')
+
+
+def _aggregate_payments(first_day, last_day):
+    """Rollup rows computed from payments, live and archived, dated first_day..last_day"""
+    start = timezone.make_aware(datetime.combine(first_day, time.min))
+    end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+    totals = {}
+    for model in (PaymentModel, ArchivedPaymentModel):
+        aggregates = model.objects.filter(
+            payment_date__gte=start, payment_date__lt=end, payment_status__in=RevenueRollupModel.STATUSES,
+        ).order_by().annotate(day=TruncDate('payment_date')).values(*GROUP_BY, 'payment_status').annotate(
+            count=Count('id'), total_minor=Sum('amount_minor'),
+        )
+        for row in aggregates:
+            bucket = totals.setdefault(
+                (row['day'], row['package'], row['currency']), dict.fromkeys(TOTAL_FIELDS, 0),
+            )
+            bucket[f"{row['payment_status']}_count"] += row['count']
+            bucket[f"{row['payment_status']}_amount_minor"] += row['total_minor']
+    return [
+        RevenueRollupModel(day=day, package=package, currency=currency, **fields)
+        for (day, package, currency), fields in totals.items()
+    ]
+
+
+def rebuild_days(first_day, last_day):
+    """Replace the rollup for first_day..last_day with totals from payments
+
+    Runs in one transaction. Existing rollup rows are deleted first, so
+    transitions committing meanwhile wait on them and then add their deltas
+    on top of the rebuilt totals. Returns the number of rollup rows written.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                RevenueRollupModel.objects.filter(day__gte=first_day, day__lte=last_day).delete()
+                rollups = _aggregate_payments(first_day, last_day)
+                RevenueRollupModel.objects.bulk_create(rollups)
+            return len(rollups)
+        except IntegrityError:
+            # A transition created a bucket we were about to insert; the
+            # second attempt sees its payment.
+            if attempt:
+                raise
+
+
+def payment_day_range():
+    """(first, last) local dates with payments, live or archived, or None"""
+    dates = []
+    for model in (PaymentModel, ArchivedPaymentModel):
+        dates += model.objects.order_by('payment_date').values_list('payment_date', flat=True)[:1]
+        dates += model.objects.order_by('-payment_date').values_list('payment_date', flat=True)[:1]
+    if not dates:
+        return None
+    return timezone.localdate(min(dates)), timezone.localdate(max(dates))
+
+
+def report(date_from=None, date_to=None, package=None, currency=None, group_by=GROUP_BY):
+    """Rollup totals summed over the dimensions not in group_by
+
+    Each row has the group_by fields, the TOTAL_FIELDS and the Decimal
+    completed_amount and refunded_amount. Refunded payments are no longer
+    counted as completed. Amounts in different currencies are never added
+    up, so currency is always part of the grouping.
+    """
+    group_by = [field for field in GROUP_BY if field in group_by or field == 'currency']
+    filters = Q()
+    if date_from:
+        filters &= Q(day__gte=date_from)
+    if date_to:
+        filters &= Q(day__lte=date_to)
+    if package:
+        filters &= Q(package=package)
+    if currency:
+        filters &= Q(currency=currency)
+    rows = RevenueRollupModel.objects.filter(filters).values(*group_by).annotate(
+        **{f'total_{field}': Sum(field) for field in TOTAL_FIELDS}
+    ).order_by(*group_by)
+    result = []
+    for row in rows:
+        item = {field: row[field] for field in group_by}
+        item.update({field: row[f'total_{field}'] for field in TOTAL_FIELDS})
+        item['completed_amount'] = from_minor_units(item['completed_amount_minor'], item['currency'])
+        item['refunded_amount'] = from_minor_units(item['refunded_amount_minor'], item['currency'])
+        result.append(item)
+    return result
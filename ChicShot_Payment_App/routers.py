@@ -0,0 +1,74 @@
+import contextlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Set by use_replica(); reads of REPLICA_MODELS only leave the primary inside
+# such a block, so nothing is read from a lagging replica by accident.
+replica_reads_var = ContextVar('replica_reads', default=False)
+
+REPLICA_MODELS = {
+    'ChicShot_Payment_App.paymentmodel',
+    'ChicShot_Payment_App.archivedpaymentmodel',
+    'ChicShot_Payment_App.revenuerollupmodel',
+}
+
+
+def _sticky_key(key):
+    return f"db-sticky:{key}"
+
+
+def mark_written(*keys):
+    """Keep reads about these fb_ids / intent ids on the primary for a while
+
+    Call after writing a payment so a replica that has not caught up yet
+    cannot hide the write from the next read.
+    """
+    keys = [key for key in keys if key]
+    if keys and settings.DATABASE_REPLICAS:
+        caches[settings.REPLICA_STICKY_CACHE].set_many(
+            {_sticky_key(key): 1 for key in keys}, settings.REPLICA_STICKY_SECONDS,
+        )
+
+
+def is_sticky(*keys):
+    keys = [_sticky_key(key) for key in keys if key]
+    return bool(keys) and bool(caches[settings.REPLICA_STICKY_CACHE].get_many(keys))
+
+
+@contextlib.contextmanager
+def use_replica(*keys):
+    """Send payment reads inside the block to a replica
+
+    Stays on the primary when any of keys was written within
+    REPLICA_STICKY_SECONDS. Writes always go to the primary.
+    """
+    enabled = bool(settings.DATABASE_REPLICAS) and not is_sticky(*keys)
+    token = replica_reads_var.set(enabled)
+    try:
+        yield enabled
+    finally:
+        replica_reads_var.reset(token)
+
+
+class ReplicaRouter:
+    """Routes PaymentModel reads to settings.DATABASE_REPLICAS inside use_replica()"""
+
+    def db_for_read(self, model, **hints):
+        if replica_reads_var.get() and model._meta.label_lower in REPLICA_MODELS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so saving an instance read from a replica still writes
+        # to the primary.
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
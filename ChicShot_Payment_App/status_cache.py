@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class LocMemLRUBackend:
+    """Per-process LRU cache; invalidations are not seen by other processes"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DjangoCacheBackend:
+    """Stores entries in one of settings.CACHES, shared between processes"""
+
+    def __init__(self, alias='default', key_prefix='payment-status:'):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self.cache.get(self.key_prefix + key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(self.key_prefix + key, value, ttl)
+
+    def delete(self, key):
+        self.cache.delete(self.key_prefix + key)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = settings.PAYMENT_STATUS_CACHE
+                _backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def get_status(payment_intent_id):
+    """Cached {'payment_status', 'payment_method'} for an intent, or None"""
+    return get_backend().get(payment_intent_id)
+
+
+def set_status(payment_intent_id, payment_status, payment_method):
+    ttl = settings.PAYMENT_STATUS_CACHE['TTLS'].get(payment_status, 0)
+    if ttl > 0:
+        get_backend().set(payment_intent_id, {
+            'payment_status': payment_status,
+            'payment_method': payment_method,
+        }, ttl)
+
+
+def invalidate(payment_intent_id):
+    get_backend().delete(payment_intent_id)
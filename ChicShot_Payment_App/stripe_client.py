@@ -0,0 +1,271 @@
+import re
+import ssl
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import circuit
+from .metrics import add_phase_time, stripe_api_duration
+
+try:
+    import httpx
+except ImportError:  # async views are unavailable without httpx
+    httpx = None
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """requests adapter that keeps count of in-flight requests for pool stats"""
+
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self):
+        pools = [self.poolmanager.pools[key] for key in self.poolmanager.pools.keys()]
+        opened = sum(pool.num_connections for pool in pools)
+        requests_sent = sum(pool.num_requests for pool in pools)
+        idle = sum(
+            1 for pool in pools if pool.pool is not None
+            for conn in list(pool.pool.queue) if conn is not None
+        )
+        in_flight = self._in_flight
+        capacity = self._pool_maxsize * max(len(pools), 1)
+        return {
+            'pool_size': self._pool_maxsize,
+            'in_use': min(in_flight, capacity),
+            'waiting': max(in_flight - capacity, 0) if self._pool_block else 0,
+            'idle': idle,
+            'connections_opened': opened,
+            'requests': requests_sent,
+            'reused_connections': max(requests_sent - opened, 0),
+        }
+
+
+class PooledHTTPXClient(stripe.HTTPXClient):
+    """Stripe's httpx client with our pool limits instead of httpx's defaults"""
+
+    def __init__(self, limits, **kwargs):
+        super().__init__(**kwargs)
+        verify = (
+            ssl.create_default_context(cafile=stripe.ca_bundle_path)
+            if self._verify_ssl_certs else False
+        )
+        self._client_async = self.httpx.AsyncClient(verify=verify, limits=limits)
+
+    @property
+    def _timeout(self):
+        budget = circuit.budget_var.get()
+        if budget is None:
+            return self._default_timeout
+        return self.httpx.Timeout(budget, connect=self._default_timeout.connect)
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self._default_timeout = value
+
+
+class TimedRequestsClient(stripe.RequestsClient):
+    """RequestsClient that records the time spent in each Stripe call
+
+    With STRIPE_CIRCUIT_BREAKER enabled, each call also goes through its
+    operation's circuit breaker and gets the operation's latency budget as
+    read timeout, for every attempt.
+    """
+
+    # Object ids (pi_..., cus_...) are replaced so operations group together.
+    OBJECT_ID_RE = re.compile(r'/[a-z]{2,5}_[A-Za-z0-9_]{8,}')
+
+    @property
+    def _timeout(self):
+        budget = circuit.budget_var.get()
+        if budget is None:
+            return self._default_timeout
+        return (self._default_timeout[0], budget)
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self._default_timeout = value
+
+    def request_with_retries(self, method, url, *args, **kwargs):
+        operation = self.operation(method, url)
+        breaker, token = self._enter_circuit(operation)
+        started = time.perf_counter()
+        status = None
+        try:
+            response = super().request_with_retries(method, url, *args, **kwargs)
+            status = response[1]
+            return response
+        finally:
+            self._exit_circuit(breaker, token, operation, status, time.perf_counter() - started)
+
+    async def request_with_retries_async(self, method, url, *args, **kwargs):
+        operation = self.operation(method, url)
+        breaker, token = self._enter_circuit(operation)
+        started = time.perf_counter()
+        status = None
+        try:
+            response = await super().request_with_retries_async(method, url, *args, **kwargs)
+            status = response[1]
+            return response
+        finally:
+            self._exit_circuit(breaker, token, operation, status, time.perf_counter() - started)
+
+    @staticmethod
+    def _enter_circuit(operation):
+        """(breaker, budget token), or (None, None) with the breaker disabled
+
+        Raises CircuitOpenError when the operation's circuit is open.
+        """
+        if not settings.STRIPE_CIRCUIT_BREAKER['ENABLED']:
+            return None, None
+        breaker = circuit.get_breaker(operation)
+        breaker.before_call()
+        return breaker, circuit.budget_var.set(circuit.budget(operation))
+
+    @staticmethod
+    def _exit_circuit(breaker, token, operation, status, duration):
+        if breaker is not None:
+            circuit.budget_var.reset(token)
+            breaker.record(status is not None and not circuit.is_failure(status, duration, operation))
+        stripe_api_duration.observe(duration, operation, 'error' if status is None else str(status))
+        add_phase_time('stripe', duration)
+
+    @classmethod
+    def operation(cls, method, url):
+        """Metrics label and breaker key for a call, e.g. 'GET /v1/payment_intents/:id'"""
+        path = cls.OBJECT_ID_RE.sub('/:id', url.split('://', 1)[-1].partition('/')[2].partition('?')[0])
+        return f"{method.upper()} /{path}"
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_stripe_client():
+    """The process-wide StripeClient; every Stripe API call goes through it
+
+    Sync calls share one requests session with a bounded keep-alive pool and
+    async calls one httpx client. The SDK retries failed calls with jittered
+    exponential backoff; POSTs always carry an idempotency key, so a retried
+    create never creates a second object.
+    """
+    global _client
+    if _client is None:
+        # Building a client loads the CA bundle; without the lock every
+        # thread of a freshly started worker would build its own.
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def reset_stripe_client():
+    """Drop the shared client so the next call builds a new one"""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def _build_client():
+    adapter = PooledHTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.STRIPE_HTTP_POOL_SIZE,
+        pool_block=settings.STRIPE_HTTP_POOL_BLOCK,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    async_client = None
+    if httpx is not None:
+        async_client = PooledHTTPXClient(
+            limits=httpx.Limits(
+                max_connections=settings.STRIPE_HTTP_POOL_SIZE,
+                max_keepalive_connections=settings.STRIPE_HTTP_POOL_SIZE,
+                keepalive_expiry=settings.STRIPE_HTTP_KEEPALIVE_SECONDS,
+            ),
+            timeout=httpx.Timeout(
+                settings.STRIPE_HTTP_READ_TIMEOUT,
+                connect=settings.STRIPE_HTTP_CONNECT_TIMEOUT,
+            ),
+        )
+
+    client = stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        base_addresses={'api': settings.STRIPE_API_BASE},
+        http_client=TimedRequestsClient(
+            timeout=(settings.STRIPE_HTTP_CONNECT_TIMEOUT, settings.STRIPE_HTTP_READ_TIMEOUT),
+            session=session,
+            async_fallback_client=async_client,
+        ),
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+    )
+    client.pool_adapter = adapter
+    return client
+
+
+_executor = None
+
+
+def get_stripe_executor():
+    """Process-wide thread pool for fanning out Stripe calls
+
+    Its size, PAYMENT_BATCH_STRIPE_CONCURRENCY, bounds the batch calls in
+    flight however many batch requests run at once; keep it below
+    STRIPE_HTTP_POOL_SIZE so single requests still get connections.
+    """
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PAYMENT_BATCH_STRIPE_CONCURRENCY,
+                    thread_name_prefix='stripe-batch',
+                )
+    return _executor
+
+
+def payment_intent_params(amount_minor, currency, fb_id, package, description):
+    """PaymentIntent create params for one of our payments"""
+    return {
+        'amount': amount_minor,
+        'currency': currency,
+        'payment_method_types': ['card'],
+        'description': f"{package} - {description}",
+        'metadata': {
+            'fb_id': fb_id,
+            'package': package,
+            'description': description
+        }
+    }
+
+
+def pool_stats():
+    """Connection pool counters of the shared Stripe client"""
+    return get_stripe_client().pool_adapter.stats()
+
+
+def idempotency_key(request, scope):
+    """Idempotency key for one API request
+
+    Clients that retry can send an Idempotency-Key header so their retries
+    reuse the first attempt's Stripe object.
+    """
+    client_key = request.headers.get('Idempotency-Key')
+    return f"{scope}:{client_key or uuid.uuid4()}"
@@ -0,0 +1,162 @@
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ChicShot_Payment_App.admin import EstimatedCountPaginator
+from ChicShot_Payment_App.models import PaymentModel
+from ChicShot_Payment_App.routers import ReplicaRouter
+
+from .test_payments import make_payment
+
+
+class AdminTestCase(TestCase):
+    url = '/admin/ChicShot_Payment_App/paymentmodel/'
+
+    def setUp(self):
+        User.objects.create_superuser('admin', password='pw')
+        self.client.login(username='admin', password='pw')
+
+
+# The test database stands in for a replica: the router only picks it when
+# the read is routed to a replica.
+@override_settings(DATABASE_REPLICAS=['default'])
+class PaymentChangelistRoutingTests(AdminTestCase):
+    def routed_request(self, method, *args, **kwargs):
+        """Make a request; returns it with (model name, db_for_read result) of each read"""
+        routed = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            db = db_for_read(router, model, **hints)
+            routed.append((model._meta.model_name, db))
+            return db
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', spy):
+            response = getattr(self.client, method)(*args, **kwargs)
+        return response, routed
+
+    def test_list_reads_payments_from_a_replica(self):
+        make_payment('pi_a')
+        response, routed = self.routed_request('get', self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '1001')
+        self.assertIn(('paymentmodel', 'default'), routed)
+        self.assertNotIn(('paymentmodel', None), routed)
+
+    def test_invalid_lookup_redirects(self):
+        for query in ('bogus_field=1', 'payment_date__gte=notadate'):
+            with self.subTest(query=query):
+                response, _ = self.routed_request('get', f'{self.url}?{query}')
+                self.assertEqual(response.status_code, 302)
+                self.assertTrue(response['Location'].endswith('?e=1'))
+
+    def test_actions_read_from_the_primary(self):
+        payment = make_payment('pi_a')
+        response, routed = self.routed_request(
+            'post', self.url, {'action': 'delete_selected', '_selected_action': [payment.pk]},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(('paymentmodel', None), routed)
+        self.assertNotIn(('paymentmodel', 'default'), routed)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        payments = [make_payment(f'pi_{i}', fb_id=str(i)) for i in range(5)]
+        # Leave a gap in the ids: 5 by the id range, 3 rows.
+        PaymentModel.objects.filter(pk__in=[payments[1].pk, payments[2].pk]).delete()
+
+    def count(self, queryset):
+        return EstimatedCountPaginator(queryset.order_by('pk'), 10).count
+
+    @override_settings(PAYMENT_ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_large_unfiltered_table_is_estimated(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.count(PaymentModel.objects.all()), 5)
+
+    @override_settings(PAYMENT_ADMIN_EXACT_COUNT_LIMIT=10)
+    def test_small_table_is_counted(self):
+        self.assertEqual(self.count(PaymentModel.objects.all()), 3)
+
+    @override_settings(PAYMENT_ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_filtered_list_is_counted_up_to_the_limit(self):
+        self.assertEqual(self.count(PaymentModel.objects.filter(package='Gold')), 2)
+        self.assertEqual(self.count(PaymentModel.objects.filter(fb_id='0')), 1)
+
+    def test_empty_table(self):
+        PaymentModel.objects.all().delete()
+        self.assertEqual(EstimatedCountPaginator.estimated_table_count(PaymentModel.objects.all()), 0)
+
+
+class PaymentSearchTests(TestCase):
+    def setUp(self):
+        make_payment('pi_abc', fb_id='1001', stripe_customer_id='cus_1')
+        make_payment('pi_abd', fb_id='10012', stripe_customer_id='cus_2')
+        make_payment('pi_xyz', fb_id='2002', stripe_customer_id='cus_1')
+
+    def search(self, term):
+        model_admin = admin.site._registry[PaymentModel]
+        queryset, may_have_duplicates = model_admin.get_search_results(
+            RequestFactory().get('/'), PaymentModel.objects.all(), term,
+        )
+        self.assertFalse(may_have_duplicates)
+        self.assertNotIn("LIKE '%", str(queryset.query))
+        return sorted(queryset.values_list('stripe_payment_intent_id', flat=True))
+
+    def test_term_shape_picks_the_column(self):
+        self.assertEqual(self.search('pi_abc'), ['pi_abc'])
+        self.assertEqual(self.search('cus_1'), ['pi_abc', 'pi_xyz'])
+        self.assertEqual(self.search('1001'), ['pi_abc'])
+        # Exact only: no substring matches.
+        self.assertEqual(self.search('pi_ab'), [])
+        self.assertEqual(self.search('001'), [])
+
+    def test_trailing_star_is_a_prefix_match(self):
+        self.assertEqual(self.search('pi_ab*'), ['pi_abc', 'pi_abd'])
+        self.assertEqual(self.search('1001*'), ['pi_abc', 'pi_abd'])
+        self.assertEqual(self.search(' cus_* '), ['pi_abc', 'pi_abd', 'pi_xyz'])
+
+    def test_blank_term_matches_everything(self):
+        for term in ('', '  ', '*'):
+            with self.subTest(term=term):
+                self.assertEqual(len(self.search(term)), 3)
+
+
+class PaymentListFilterTests(AdminTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_package_choices_are_cached(self):
+        make_payment('pi_a', package='Gold')
+        self.assertContains(self.client.get(self.url), '?package=Gold')
+
+        make_payment('pi_b', package='Silver')
+        self.assertNotContains(self.client.get(self.url), '?package=Silver')
+        cache.clear()
+        self.assertContains(self.client.get(self.url), '?package=Silver')
+
+    def test_currency_choices_need_no_query(self):
+        make_payment('pi_a', currency='eur')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        # Every accepted currency, paid in or not.
+        self.assertContains(response, '?currency=eur')
+        self.assertContains(response, '?currency=jpy')
+        self.assertFalse([query for query in queries if 'DISTINCT' in query['sql'] and 'currency' in query['sql']])
+
+    def test_filters_narrow_the_list(self):
+        make_payment('pi_a', fb_id='1001', package='Gold', currency='eur')
+        make_payment('pi_b', fb_id='2002', package='Silver', currency='usd')
+        response = self.client.get(self.url, {'currency': 'usd'})
+        self.assertContains(response, '2002')
+        self.assertNotContains(response, '1001')
+        response = self.client.get(self.url, {'package': 'Gold'})
+        self.assertContains(response, '1001')
+        self.assertNotContains(response, '2002')
@@ -0,0 +1,27 @@
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, SimpleTestCase
+
+from ChicShot_Payment_App.async_views import AsyncCreatePaymentIntentView, AsyncPaymentSuccessView
+
+
+class AsyncRequestBodyTests(SimpleTestCase):
+    views = {
+        '/api/create-payment-intent/': AsyncCreatePaymentIntentView,
+        '/api/payment-success/': AsyncPaymentSuccessView,
+    }
+
+    def post(self, view_class, path, body):
+        request = RequestFactory().post(path, body, content_type='application/json')
+        return async_to_sync(view_class.as_view())(request)
+
+    def test_invalid_json_is_a_400(self):
+        for path, view_class in self.views.items():
+            with self.subTest(path=path):
+                response = self.post(view_class, path, '{"amount": ')
+                self.assertEqual(response.status_code, 400)
+
+    def test_json_that_is_not_an_object_is_a_400(self):
+        for path, view_class in self.views.items():
+            for body in ('[1, 2]', '"text"', '42'):
+                with self.subTest(path=path, body=body):
+                    self.assertEqual(self.post(view_class, path, body).status_code, 400)
@@ -0,0 +1,100 @@
+from unittest import mock
+
+import stripe
+from django.test import TestCase, override_settings
+
+from ChicShot_Payment_App import ratelimit
+from ChicShot_Payment_App.models import PaymentModel
+
+
+def create_intent(params, options):
+    """Stripe stand-in: declines amounts of 666 minor units, creates the rest"""
+    if params['amount'] == 666:
+        raise stripe.error.CardError("Your card was declined.", None, 'card_declined')
+    intent_id = f"pi_{params['metadata']['fb_id']}"
+    return stripe.PaymentIntent.construct_from(
+        {'id': intent_id, 'client_secret': f'{intent_id}_secret'}, 'sk_test',
+    )
+
+
+class BatchCreatePaymentIntentTests(TestCase):
+    url = '/api/create-payment-intents/batch/'
+
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit, '_backend', ratelimit.ShardedMemoryBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('ChicShot_Payment_App.views.get_stripe_client')
+        self.create = patcher.start().return_value.v1.payment_intents.create
+        self.create.side_effect = create_intent
+        self.addCleanup(patcher.stop)
+
+    def post(self, body):
+        return self.client.post(self.url, body, content_type='application/json')
+
+    def test_all_created(self):
+        response = self.post({'payments': [
+            {'fb_id': 'fb-1', 'amount': '9.99', 'package': 'Gold'},
+            {'fb_id': 'fb-2', 'amount': '500', 'currency': 'JPY'},
+        ]})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['success'], data['created'], data['failed']), (True, 2, 0))
+        self.assertEqual([result['payment_intent_id'] for result in data['results']], ['pi_fb-1', 'pi_fb-2'])
+        self.assertEqual(
+            set(PaymentModel.objects.values_list('stripe_payment_intent_id', 'amount_minor', 'currency')),
+            {('pi_fb-1', 999, 'eur'), ('pi_fb-2', 500, 'jpy')},
+        )
+
+    def test_mixed_results_are_207_in_request_order(self):
+        response = self.post({'payments': [
+            {'fb_id': 'fb-1', 'amount': '9.99'},
+            {'fb_id': 'fb-2', 'amount': '6.66'},
+            {'fb_id': 'fb-3', 'amount': '1.00'},
+        ]})
+        self.assertEqual(response.status_code, 207)
+        data = response.json()
+        self.assertEqual((data['success'], data['created'], data['failed']), (False, 2, 1))
+        self.assertEqual([result['index'] for result in data['results']], [0, 1, 2])
+        self.assertEqual([result['success'] for result in data['results']], [True, False, True])
+        self.assertIn('declined', data['results'][1]['error'])
+        self.assertEqual(data['results'][2]['client_secret'], 'pi_fb-3_secret')
+        self.assertEqual(
+            set(PaymentModel.objects.values_list('stripe_payment_intent_id', flat=True)), {'pi_fb-1', 'pi_fb-3'},
+        )
+
+    def test_invalid_items_fail_alone_without_calling_stripe(self):
+        response = self.post({'payments': [
+            'not an object',
+            {'fb_id': 'fb-1'},
+            {'fb_id': 'fb-2', 'amount': '-1'},
+            {'fb_id': 'fb-3', 'amount': '9.999'},
+            {'fb_id': 'fb-4', 'amount': '9.99', 'currency': 'xyz'},
+            {'fb_id': 'fb-5', 'amount': '9.99'},
+        ]})
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertEqual([result['success'] for result in results], [False] * 5 + [True])
+        self.assertEqual(results[0]['error'], 'Each payment must be an object')
+        self.assertEqual(results[1]['error'], 'Amount is required')
+        self.assertIn('Unsupported currency', results[4]['error'])
+        self.create.assert_called_once()
+        self.assertEqual(PaymentModel.objects.get().fb_id, 'fb-5')
+
+    @override_settings(PAYMENT_BATCH_MAX_ITEMS=3)
+    def test_batch_size_is_capped(self):
+        payments = [{'fb_id': f'fb-{i}', 'amount': '1.00'} for i in range(4)]
+        response = self.post({'payments': payments})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 3', response.json()['error'])
+        self.assertEqual(self.post({'payments': payments[:3]}).status_code, 201)
+        self.assertEqual(self.create.call_count, 3)
+
+    def test_payments_must_be_a_non_empty_list(self):
+        for body in ({}, {'payments': []}, {'payments': {'fb_id': 'fb-1', 'amount': '9.99'}}, {'payments': 'x'}):
+            with self.subTest(body=body):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], 'payments must be a non-empty list')
+        self.create.assert_not_called()
+        self.assertFalse(PaymentModel.objects.exists())
@@ -0,0 +1,141 @@
+from unittest import mock
+
+import stripe
+from django.test import SimpleTestCase
+
+from ChicShot_Payment_App import circuit
+from ChicShot_Payment_App.stripe_client import TimedRequestsClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = circuit.CircuitBreaker(
+            'POST /v1/payment_intents', failure_threshold=3, reset_seconds=30, half_open_probes=2, clock=self.clock,
+        )
+
+    def fail(self, times=1):
+        for _ in range(times):
+            self.breaker.before_call()
+            self.breaker.record(False)
+
+    def open_circuit(self):
+        self.fail(3)
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+
+    def test_opens_after_threshold_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.stats(), {'state': circuit.OPEN, 'consecutive_failures': 3, 'trips': 1})
+
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.breaker.before_call()
+        self.breaker.record(True)
+        self.fail(2)
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+
+    def test_open_circuit_fails_fast_with_retry_after(self):
+        self.open_circuit()
+        self.clock.now += 10
+        with self.assertRaises(circuit.CircuitOpenError) as raised:
+            self.breaker.before_call()
+        self.assertIsInstance(raised.exception, stripe.error.APIConnectionError)
+        self.assertEqual(raised.exception.retry_after, 20)
+
+        response = circuit.service_unavailable(raised.exception)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '20')
+
+    def test_half_open_after_reset_seconds(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, circuit.HALF_OPEN)
+
+    def test_half_open_lets_only_the_probes_through(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.breaker.before_call()
+        with self.assertRaises(circuit.CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_successful_probe_closes(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.stats(), {'state': circuit.CLOSED, 'consecutive_failures': 0, 'trips': 1})
+        for _ in range(5):
+            self.breaker.before_call()
+
+    def test_failed_probe_reopens(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.fail()
+        self.assertEqual(self.breaker.stats()['state'], circuit.OPEN)
+        self.assertEqual(self.breaker.stats()['trips'], 2)
+        # The reset period starts again from the failed probe.
+        self.clock.now += 29
+        with self.assertRaises(circuit.CircuitOpenError):
+            self.breaker.before_call()
+
+
+class StripeCallFailureTests(SimpleTestCase):
+    """What the HTTP client reports to the breaker for one Stripe call"""
+
+    url = 'https://api.stripe.com/v1/payment_intents'
+
+    def setUp(self):
+        patcher = mock.patch.object(circuit, 'get_breaker')
+        self.get_breaker = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.new_breaker()
+        self.client = TimedRequestsClient(timeout=(5, 80))
+
+    def new_breaker(self):
+        self.breaker = self.get_breaker.return_value = circuit.CircuitBreaker(
+            'POST /v1/payment_intents', failure_threshold=1, reset_seconds=30, half_open_probes=1,
+        )
+
+    def call(self, status, duration):
+        timeouts = []
+
+        def send(client, *args, **kwargs):
+            timeouts.append(client._timeout)
+            return '{}', status, {}
+
+        with mock.patch.object(stripe.RequestsClient, 'request_with_retries', autospec=True, side_effect=send), \
+                mock.patch('ChicShot_Payment_App.stripe_client.time.perf_counter', side_effect=[0.0, duration]):
+            self.client.request_with_retries('post', self.url, {}, None)
+        return timeouts[0]
+
+    def test_budget_is_the_read_timeout(self):
+        budget = circuit.budget('POST /v1/payment_intents')
+        self.assertEqual(self.call(200, 0.1), (5, budget))
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+
+    def test_call_slower_than_its_budget_is_a_failure(self):
+        self.call(200, circuit.budget('POST /v1/payment_intents') + 1)
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+
+    def test_server_errors_and_429_are_failures(self):
+        for status in (429, 503):
+            with self.subTest(status=status):
+                self.new_breaker()
+                self.call(status, 0.1)
+                self.assertEqual(self.breaker.state, circuit.OPEN)
+
+    def test_client_errors_are_not_failures(self):
+        self.call(402, 0.1)
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
@@ -0,0 +1,54 @@
+import csv
+import gzip
+import io
+import os
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from ChicShot_Payment_App.archive import archive_payments
+from ChicShot_Payment_App.exports import export_chunks, export_querysets
+from ChicShot_Payment_App.models import PaymentModel
+
+from .test_payments import make_payment
+
+
+class ArchivedPaymentExportTests(TestCase):
+    def setUp(self):
+        old = timezone.now() - timedelta(days=400)
+        for index in range(5):
+            payment = make_payment(f'pi_{index}', payment_status='completed' if index % 2 else 'pending')
+            if index % 2:
+                PaymentModel.objects.filter(pk=payment.pk).update(payment_date=old, updated_at=old)
+        archive_payments(older_than_days=180)
+        self.assertEqual(PaymentModel.objects.count(), 3)
+
+    def exported_intents(self, chunk_size=2, **filters):
+        text = ''.join(export_chunks(export_querysets(**filters), 'csv', chunk_size=chunk_size))
+        return [row['stripe_payment_intent_id'] for row in csv.DictReader(io.StringIO(text))]
+
+    def test_default_export_covers_live_payments_only(self):
+        self.assertEqual(self.exported_intents(), ['pi_0', 'pi_2', 'pi_4'])
+
+    def test_include_archived_merges_both_tables_in_id_order(self):
+        self.assertEqual(self.exported_intents(include_archived=True), [f'pi_{i}' for i in range(5)])
+
+    def test_filters_apply_to_the_archive(self):
+        self.assertEqual(self.exported_intents(include_archived=True, status='completed'), ['pi_1', 'pi_3'])
+
+    def test_view_flag(self):
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        response = self.client.get('/internal/payments/export/', {'include_archived': '1', 'format': 'jsonl'})
+        self.assertEqual(b''.join(response.streaming_content).count(b'\n'), 5)
+
+    def test_command_flag(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'payments.csv.gz')
+            call_command('export_payments', '--include-archived', '--gzip', '--output', path)
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(len(list(csv.DictReader(f))), 5)
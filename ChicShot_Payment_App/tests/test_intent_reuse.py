@@ -0,0 +1,133 @@
+from datetime import timedelta
+from unittest import mock
+
+import stripe
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from ChicShot_Payment_App import intent_reuse
+from ChicShot_Payment_App.models import PaymentModel
+from ChicShot_Payment_App.status_cache import LocMemLRUBackend
+
+from .test_payments import make_payment
+
+
+def stripe_intent(intent_id, status='requires_payment_method'):
+    return stripe.PaymentIntent.construct_from(
+        {'id': intent_id, 'status': status, 'client_secret': f'{intent_id}_secret'}, 'sk_test',
+    )
+
+
+class IntentReuseTestCase(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(intent_reuse, '_secrets', LocMemLRUBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(intent_reuse, 'get_stripe_client')
+        self.stripe_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+
+class ReusableSecretTests(IntentReuseTestCase):
+    def latest(self, package='Gold', amount_minor=999, currency='eur'):
+        return intent_reuse.latest_payment('1001', package, amount_minor, currency)
+
+    def test_matching_pending_intent_is_reused(self):
+        make_payment('pi_a')
+        intent_reuse.remember('pi_a', 'pi_a_secret')
+        self.assertEqual(intent_reuse.reusable_secret(self.latest()), 'pi_a_secret')
+        self.stripe_client.v1.payment_intents.retrieve.assert_not_called()
+
+    def test_uncached_secret_is_checked_with_stripe_once(self):
+        make_payment('pi_a')
+        self.stripe_client.v1.payment_intents.retrieve.return_value = stripe_intent('pi_a')
+        self.assertEqual(intent_reuse.reusable_secret(self.latest()), 'pi_a_secret')
+        self.assertEqual(intent_reuse.reusable_secret(self.latest()), 'pi_a_secret')
+        self.stripe_client.v1.payment_intents.retrieve.assert_called_once_with('pi_a')
+
+    def test_different_checkout_is_not_reused(self):
+        make_payment('pi_a')
+        for changed in ({'package': 'Basic'}, {'amount_minor': 1000}, {'currency': 'usd'}):
+            with self.subTest(**changed):
+                self.assertIsNone(self.latest(**changed))
+                self.assertIsNone(intent_reuse.reusable_secret(self.latest(**changed)))
+
+    def test_settled_old_or_unpayable_intents_are_not_reused(self):
+        payment = make_payment('pi_a', payment_status='completed')
+        intent_reuse.remember('pi_a', 'pi_a_secret')
+        self.assertIsNone(intent_reuse.reusable_secret(self.latest()))
+
+        PaymentModel.objects.filter(pk=payment.pk).update(
+            payment_status='pending', payment_date=timezone.now() - timedelta(hours=1),
+        )
+        with override_settings(PAYMENT_INTENT_REUSE_SECONDS=1800):
+            self.assertIsNone(intent_reuse.reusable_secret(self.latest()))
+
+        PaymentModel.objects.filter(pk=payment.pk).update(payment_date=timezone.now())
+        intent_reuse._secrets.delete('pi_a')
+        self.stripe_client.v1.payment_intents.retrieve.return_value = stripe_intent('pi_a', status='canceled')
+        self.assertIsNone(intent_reuse.reusable_secret(self.latest()))
+
+    def test_stripe_error_means_no_reuse(self):
+        make_payment('pi_a')
+        self.stripe_client.v1.payment_intents.retrieve.side_effect = stripe.error.APIConnectionError("down")
+        self.assertIsNone(intent_reuse.reusable_secret(self.latest()))
+
+
+class IdempotencyKeyTests(IntentReuseTestCase):
+    def key(self, latest=None, headers=None, **fields):
+        checkout = {'fb_id': '1001', 'package': 'Gold', 'amount_minor': 999, 'currency': 'eur', 'description': '',
+                    **fields}
+        request = RequestFactory().post('/', headers=headers or {})
+        return intent_reuse.create_idempotency_key(request, latest, **checkout)
+
+    def test_retry_of_the_same_checkout_gets_the_same_key(self):
+        self.assertEqual(self.key(), self.key())
+        self.assertEqual(self.key(latest={'id': 7}), self.key(latest={'id': 7}))
+
+    def test_other_checkouts_get_other_keys(self):
+        keys = {
+            self.key(),
+            self.key(amount_minor=1000),
+            self.key(currency='usd'),
+            self.key(package='Basic'),
+            self.key(fb_id='2002'),
+            # A new payment since: the next checkout is a new intent.
+            self.key(latest={'id': 7}),
+        }
+        self.assertEqual(len(keys), 6)
+
+    def test_client_key_wins(self):
+        key = self.key(headers={'Idempotency-Key': 'abc'})
+        self.assertEqual(key, 'create-payment-intent:abc')
+
+    @override_settings(PAYMENT_INTENT_REUSE_SECONDS=0)
+    def test_random_key_when_reuse_is_off(self):
+        self.assertNotEqual(self.key(), self.key())
+
+
+class SavePaymentTests(TestCase):
+    def test_duplicate_intent_returns_the_saved_payment(self):
+        fields = {'fb_id': '1001', 'package': 'Gold', 'amount_minor': 999, 'currency': 'eur'}
+        first, created = intent_reuse.save_payment(stripe_intent('pi_a'), **fields)
+        self.assertTrue(created)
+        second, created = intent_reuse.save_payment(stripe_intent('pi_a'), **fields)
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(PaymentModel.objects.filter(stripe_payment_intent_id='pi_a').count(), 1)
+
+
+class CreateViewReuseTests(IntentReuseTestCase):
+    def test_repeated_checkout_gets_its_open_intent_back(self):
+        body = {'fb_id': 'reuse-1', 'amount': '9.99', 'package': 'Gold'}
+        with mock.patch('ChicShot_Payment_App.views.get_stripe_client') as get_client:
+            create = get_client.return_value.v1.payment_intents.create
+            create.return_value = stripe_intent('pi_a')
+            first = self.client.post('/api/create-payment-intent/', body, content_type='application/json')
+            second = self.client.post('/api/create-payment-intent/', body, content_type='application/json')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['payment_intent_id'], 'pi_a')
+        self.assertTrue(second.json()['reused'])
+        create.assert_called_once()
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+
+class StripeClientStatsViewTests(TestCase):
+    url = '/internal/stripe-client-stats/'
+
+    def test_anonymous_is_refused(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_non_staff_is_refused(self):
+        User.objects.create_user('user', password='pw')
+        self.client.login(username='user', password='pw')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_staff_gets_stats(self):
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pool_size', response.json())
+        self.assertIn('circuits', response.json())
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class MetricsViewTests(TestCase):
+    url = '/metrics'
+
+    def test_anonymous_is_refused(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_wrong_token_is_refused(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer nope')
+        self.assertEqual(response.status_code, 403)
+
+    def test_bearer_token_is_accepted(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE http_requests counter', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_empty_token_setting_accepts_no_token(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_session_is_accepted(self):
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
@@ -0,0 +1,60 @@
+from unittest import mock
+
+import requests
+from django.test import TestCase, override_settings
+
+from ChicShot_Payment_App.manychat import Dispatcher, claim_notifications
+from ChicShot_Payment_App.models import ManyChatNotificationModel, PaymentModel, PaymentQuerySet
+
+from .test_payments import make_payment
+
+
+@override_settings(MANYCHAT_NOTIFY_URL='http://manychat.test/notify')
+class PushOrPollTests(TestCase):
+    """ManyChat hears about a payment through the push or the poll, never both"""
+
+    def setUp(self):
+        self.payment = make_payment('pi_a')
+        PaymentModel.objects.filter(pk=self.payment.pk).transition('completed')
+        self.assertTrue(ManyChatNotificationModel.objects.filter(payment_id=self.payment.pk).exists())
+        self.dispatcher = Dispatcher(rate='100/s')
+        self.dispatcher.session = mock.Mock()
+
+    def lease(self):
+        return claim_notifications('worker', batch_size=10, lease_seconds=60)
+
+    def claim_both_ways(self):
+        with mock.patch.object(PaymentQuerySet, '_supports_update_returning', return_value=False):
+            fallback = PaymentModel.objects.claim_for_manychat('1001')
+        return fallback, PaymentModel.objects.claim_for_manychat('1001')
+
+    def test_poll_drops_the_queued_push(self):
+        self.assertEqual(PaymentModel.objects.claim_for_manychat('1001').pk, self.payment.pk)
+        self.assertFalse(ManyChatNotificationModel.objects.exists())
+        self.assertEqual(self.lease(), [])
+
+    def test_poll_skips_a_payment_being_pushed(self):
+        notifications = self.lease()
+        self.assertEqual(self.claim_both_ways(), (None, None))
+
+        self.assertEqual(self.dispatcher.deliver(notifications), 1)
+        self.dispatcher.session.post.assert_called_once()
+        self.assertTrue(PaymentModel.objects.get(pk=self.payment.pk).manychat_payment)
+        self.assertEqual(self.claim_both_ways(), (None, None))
+
+    def test_failed_push_lets_the_poll_claim(self):
+        self.dispatcher.session.post.return_value.raise_for_status.side_effect = requests.ConnectionError("unreachable")
+        self.assertEqual(self.dispatcher.deliver(self.lease()), 0)
+
+        self.assertEqual(PaymentModel.objects.claim_for_manychat('1001').pk, self.payment.pk)
+        self.assertFalse(ManyChatNotificationModel.objects.exists())
+
+    def test_dispatcher_skips_a_polled_payment(self):
+        notifications = self.lease()
+        # Polled before the lease, e.g. by a claim that had not committed yet.
+        PaymentModel.objects.filter(pk=self.payment.pk).update(manychat_payment=True)
+
+        self.assertEqual(self.dispatcher.deliver(notifications), 0)
+        self.dispatcher.session.post.assert_not_called()
+        self.assertFalse(ManyChatNotificationModel.objects.exists())
+
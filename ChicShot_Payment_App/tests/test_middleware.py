@@ -0,0 +1,121 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from ChicShot_Payment_App import metrics, tracing
+from ChicShot_Payment_App.metrics import MetricsMiddleware
+from ChicShot_Payment_App.tracing import REQUEST_ID_HEADER, RequestIdMiddleware
+
+
+def counter_value(counter, *labelvalues):
+    return sum(shard.get(labelvalues, 0) for shard in counter._snapshot())
+
+
+def histogram_count(histogram, *labelvalues):
+    return sum(sum(shard[labelvalues][:-1]) for shard in histogram._snapshot() if labelvalues in shard)
+
+
+class RequestIdMiddlewareTests(SimpleTestCase):
+    def run_middleware(self, headers=None, asynchronous=False):
+        """Response and the request id seen by the view"""
+        seen = []
+
+        def view(request):
+            seen.append(tracing.request_id_var.get())
+            return HttpResponse()
+
+        async def async_view(request):
+            return view(request)
+
+        request = RequestFactory().get('/', headers=headers or {})
+        if asynchronous:
+            response = async_to_sync(RequestIdMiddleware(async_view))(request)
+        else:
+            response = RequestIdMiddleware(view)(request)
+        return response, seen[0]
+
+    def test_new_id_is_bound_and_returned(self):
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                response, request_id = self.run_middleware(asynchronous=asynchronous)
+                self.assertRegex(request_id, r'^[0-9a-f]{32}$')
+                self.assertEqual(response[REQUEST_ID_HEADER], request_id)
+                # Unbound again once the request is done.
+                self.assertEqual(tracing.request_id_var.get(), '-')
+
+    def test_incoming_id_is_kept(self):
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                response, request_id = self.run_middleware({REQUEST_ID_HEADER: 'upstream-1'}, asynchronous)
+                self.assertEqual(request_id, 'upstream-1')
+                self.assertEqual(response[REQUEST_ID_HEADER], 'upstream-1')
+
+    def test_log_records_carry_the_id(self):
+        record = logging.LogRecord('test', logging.INFO, '', 0, 'hello', (), None)
+        with tracing.bind_request_id('req-1'):
+            tracing.RequestIdFilter().filter(record)
+        self.assertEqual(record.request_id, 'req-1')
+
+
+class MetricsMiddlewareTests(SimpleTestCase):
+    def run_middleware(self, view, asynchronous=False):
+        request = RequestFactory().get('/')
+        if asynchronous:
+            async def async_view(request):
+                return view(request)
+            return async_to_sync(MetricsMiddleware(async_view))(request)
+        return MetricsMiddleware(view)(request)
+
+    def test_status_latency_and_phases_are_recorded(self):
+        def view(request):
+            metrics.add_phase_time('stripe', 0.25)
+            metrics.add_phase_time('stripe', 0.25)
+            return HttpResponse(status=418)
+
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                requests_before = counter_value(metrics.http_requests, 'unmatched', 'GET', 418)
+                durations_before = histogram_count(metrics.http_request_duration, 'unmatched')
+                stripe_before = histogram_count(metrics.http_request_phase_duration, 'unmatched', 'stripe')
+                render_before = histogram_count(metrics.http_request_phase_duration, 'unmatched', 'render')
+
+                self.run_middleware(view, asynchronous)
+                self.assertEqual(counter_value(metrics.http_requests, 'unmatched', 'GET', 418), requests_before + 1)
+                self.assertEqual(histogram_count(metrics.http_request_duration, 'unmatched'), durations_before + 1)
+                self.assertEqual(
+                    histogram_count(metrics.http_request_phase_duration, 'unmatched', 'stripe'), stripe_before + 1,
+                )
+                # Phases the request never entered are not observed.
+                self.assertEqual(
+                    histogram_count(metrics.http_request_phase_duration, 'unmatched', 'render'), render_before,
+                )
+                self.assertIsNone(metrics.request_phases_var.get())
+
+    def test_phase_time_outside_a_request_is_dropped(self):
+        metrics.add_phase_time('stripe', 1.0)
+        self.assertIsNone(metrics.request_phases_var.get())
+
+    def test_view_error_leaves_no_phases_behind(self):
+        def view(request):
+            metrics.add_phase_time('db', 0.1)
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            self.run_middleware(view)
+        self.assertIsNone(metrics.request_phases_var.get())
+
+
+class MiddlewareStackTests(TestCase):
+    url = '/api/payment-status/stream/'
+
+    def test_requests_are_tagged_and_counted_by_url_name(self):
+        before = counter_value(metrics.http_requests, 'payment_status_stream', 'GET', 400)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 400)
+        self.assertRegex(response[REQUEST_ID_HEADER], r'^[0-9a-f]{32}$')
+        self.assertEqual(counter_value(metrics.http_requests, 'payment_status_stream', 'GET', 400), before + 1)
+
+        response = self.client.get(self.url, headers={REQUEST_ID_HEADER: 'upstream-1'})
+        self.assertEqual(response[REQUEST_ID_HEADER], 'upstream-1')
@@ -0,0 +1,62 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+APP = 'ChicShot_Payment_App'
+
+
+class AmountsToMinorUnitsMigrationTests(TransactionTestCase):
+    """0007 converts the old float amounts into exact integer minor units"""
+
+    before = [(APP, '0006_paymentmodel_amount_minor')]
+    after = [(APP, '0007_convert_amounts_to_minor_units')]
+
+    # (amount as stored, currency as stored) -> (amount_minor, currency)
+    CASES = [
+        ((9.99, 'eur'), (999, 'eur')),
+        ((19.99, 'usd'), (1999, 'usd')),
+        ((0.29, 'eur'), (29, 'eur')),
+        ((1234567.89, 'gbp'), (123456789, 'gbp')),
+        ((10.0, 'EUR '), (1000, 'eur')),
+        ((0.1 + 0.2, 'eur'), (30, 'eur')),
+        ((4999.0, 'jpy'), (4999, 'jpy')),
+        ((None, 'usd'), (0, 'usd')),
+    ]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes(APP))
+
+    def test_float_amounts_convert_exactly(self):
+        old_apps = self.migrate(self.before)
+        OldPayment = old_apps.get_model(APP, 'PaymentModel')
+        ids = [
+            OldPayment.objects.create(
+                fb_id='1001', package='Gold', amount=amount, currency=currency,
+                stripe_payment_intent_id=f'pi_{index}',
+            ).id
+            for index, ((amount, currency), _) in enumerate(self.CASES)
+        ]
+
+        new_apps = self.migrate(self.after)
+        NewPayment = new_apps.get_model(APP, 'PaymentModel')
+        for payment_id, (stored, expected) in zip(ids, self.CASES):
+            payment = NewPayment.objects.get(pk=payment_id)
+            with self.subTest(stored=stored):
+                self.assertEqual((payment.amount_minor, payment.currency), expected)
+
+    def test_reverse_restores_the_float_amounts(self):
+        old_apps = self.migrate(self.before)
+        OldPayment = old_apps.get_model(APP, 'PaymentModel')
+        payment_id = OldPayment.objects.create(
+            fb_id='1001', package='Gold', amount=9.99, currency='eur', stripe_payment_intent_id='pi_1',
+        ).id
+        self.migrate(self.after)
+        old_apps = self.migrate(self.before)
+        self.assertEqual(old_apps.get_model(APP, 'PaymentModel').objects.get(pk=payment_id).amount, 9.99)
@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+
+from ChicShot_Payment_App.money import from_minor_units, normalize_currency, to_minor_units
+
+
+class ToMinorUnitsTests(SimpleTestCase):
+    def test_two_decimal_currencies(self):
+        self.assertEqual(to_minor_units('9.99', 'eur'), 999)
+        self.assertEqual(to_minor_units('10', 'usd'), 1000)
+        self.assertEqual(to_minor_units('0.01', 'gbp'), 1)
+        self.assertEqual(to_minor_units('1234567.89', 'chf'), 123456789)
+        self.assertEqual(to_minor_units(Decimal('19.90'), 'eur'), 1990)
+        self.assertEqual(to_minor_units(25, 'eur'), 2500)
+
+    def test_zero_decimal_currency(self):
+        self.assertEqual(to_minor_units('500', 'jpy'), 500)
+        self.assertEqual(to_minor_units('500.00', 'jpy'), 500)
+        with self.assertRaises(ValueError):
+            to_minor_units('500.5', 'jpy')
+
+    def test_floats_convert_by_their_shortest_repr(self):
+        self.assertEqual(to_minor_units(9.99, 'eur'), 999)
+        self.assertEqual(to_minor_units(0.29, 'eur'), 29)
+
+    def test_extra_precision_is_refused_not_rounded(self):
+        for amount in ('9.999', '0.001', 0.1 + 0.2):
+            with self.subTest(amount=amount), self.assertRaises(ValueError):
+                to_minor_units(amount, 'eur')
+
+    def test_trailing_zeros_and_whitespace_are_fine(self):
+        self.assertEqual(to_minor_units(' 9.9900 ', 'eur'), 999)
+        self.assertEqual(to_minor_units('1e2', 'eur'), 10000)
+
+    def test_non_positive_amounts_are_refused(self):
+        for amount in ('0', '0.00', '-1', '-0.01', -5):
+            with self.subTest(amount=amount), self.assertRaises(ValueError):
+                to_minor_units(amount, 'eur')
+
+    def test_garbage_is_refused(self):
+        for amount in ('', 'abc', '9,99', '1.2.3', None, 'NaN', 'Infinity', '-inf', [], {}):
+            with self.subTest(amount=amount), self.assertRaises(ValueError):
+                to_minor_units(amount, 'eur')
+
+    def test_currency_code_is_normalized(self):
+        self.assertEqual(to_minor_units('9.99', ' EUR '), 999)
+        self.assertEqual(to_minor_units('500', 'JPY'), 500)
+
+    def test_unknown_currency_is_refused(self):
+        for currency in ('xyz', '', None, 'euro'):
+            with self.subTest(currency=currency), self.assertRaises(ValueError):
+                to_minor_units('9.99', currency)
+
+
+class CurrencyTests(SimpleTestCase):
+    def test_normalize_currency(self):
+        self.assertEqual(normalize_currency('EUR'), 'eur')
+        self.assertEqual(normalize_currency(' jpy '), 'jpy')
+        with self.assertRaises(ValueError):
+            normalize_currency('btc')
+
+    def test_from_minor_units(self):
+        self.assertEqual(from_minor_units(999, 'eur'), Decimal('9.99'))
+        self.assertEqual(from_minor_units(1000, 'eur'), Decimal('10.00'))
+        self.assertEqual(from_minor_units(500, 'jpy'), Decimal('500'))
+
+    def test_round_trip(self):
+        for amount, currency in (('9.99', 'eur'), ('0.01', 'usd'), ('123', 'jpy')):
+            self.assertEqual(from_minor_units(to_minor_units(amount, currency), currency), Decimal(amount))
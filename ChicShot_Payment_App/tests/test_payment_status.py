@@ -0,0 +1,72 @@
+import json
+from unittest import mock
+
+import stripe
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, TestCase
+
+from ChicShot_Payment_App import status_cache
+from ChicShot_Payment_App.async_views import AsyncPaymentSuccessView
+from ChicShot_Payment_App.models import PaymentModel
+from ChicShot_Payment_App.webhooks import process_event
+
+from .test_payments import make_payment
+from .test_webhooks import stripe_event
+
+
+def retrieved_intent(intent_id, wallet_type):
+    """A PaymentIntent as retrieved with latest_charge expanded"""
+    return stripe.PaymentIntent.construct_from({
+        'id': intent_id,
+        'status': 'succeeded',
+        'latest_charge': {
+            'id': 'ch_1',
+            'payment_method_details': {'type': 'card', 'card': {'wallet': {'type': wallet_type}}},
+        },
+    }, 'sk_test')
+
+
+class WebhookThenStatusTests(TestCase):
+    """A webhook completes the payment without its method; the status view fills it in once"""
+
+    def setUp(self):
+        self.payment = make_payment('pi_a')
+        status_cache.invalidate('pi_a')
+        self.addCleanup(status_cache.invalidate, 'pi_a')
+        process_event(stripe_event('evt_1', 'payment_intent.succeeded', 'pi_a'))
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.payment_method), ('completed', None))
+
+    def stripe_client(self):
+        client = mock.Mock()
+        client.v1.payment_intents.retrieve.return_value = retrieved_intent('pi_a', 'google_pay')
+        client.v1.payment_intents.retrieve_async = mock.AsyncMock(return_value=retrieved_intent('pi_a', 'google_pay'))
+        return client
+
+    def check_status(self):
+        response = self.client.post('/api/payment-success/', {'payment_intent_id': 'pi_a'}, content_type='application/json')
+        return response.json()
+
+    def check_status_async(self):
+        request = RequestFactory().post(
+            '/api/payment-success/', json.dumps({'payment_intent_id': 'pi_a'}), content_type='application/json',
+        )
+        return json.loads(async_to_sync(AsyncPaymentSuccessView.as_view())(request).content)
+
+    def assert_method_fetched_once(self, check_status, views_module, retrieve):
+        client = self.stripe_client()
+        with mock.patch(f'ChicShot_Payment_App.{views_module}.get_stripe_client', return_value=client):
+            first = check_status()
+            status_cache.invalidate('pi_a')
+            second = check_status()
+
+        for data in (first, second):
+            self.assertEqual((data['payment_status'], data['payment_method']), ('completed', 'google_pay'))
+        getattr(client.v1.payment_intents, retrieve).assert_called_once_with('pi_a', params={'expand': ['latest_charge']})
+        self.assertEqual(PaymentModel.objects.get(pk=self.payment.pk).payment_method, 'google_pay')
+
+    def test_sync_view(self):
+        self.assert_method_fetched_once(self.check_status, 'views', 'retrieve')
+
+    def test_async_view(self):
+        self.assert_method_fetched_once(self.check_status_async, 'async_views', 'retrieve_async')
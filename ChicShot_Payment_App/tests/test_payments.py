@@ -0,0 +1,94 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from ChicShot_Payment_App.models import PaymentModel, PaymentQuerySet
+
+
+def make_payment(payment_intent_id='pi_test', payment_status='pending', **fields):
+    fields = {'fb_id': '1001', 'package': 'Gold', 'amount_minor': 999, 'currency': 'eur', **fields}
+    return PaymentModel.objects.create(
+        stripe_payment_intent_id=payment_intent_id, payment_status=payment_status, **fields,
+    )
+
+
+class StatusTransitionTests(TestCase):
+    def transition(self, payment, new_status):
+        updated = PaymentModel.objects.filter(pk=payment.pk).transition(new_status)
+        payment.refresh_from_db()
+        return updated
+
+    def test_pending_moves_to_completed_or_failed(self):
+        for new_status in ('completed', 'failed'):
+            payment = make_payment(f'pi_{new_status}')
+            self.assertEqual(self.transition(payment, new_status), 1)
+            self.assertEqual(payment.payment_status, new_status)
+
+    def test_completed_never_becomes_failed_or_pending(self):
+        payment = make_payment(payment_status='completed')
+        for new_status in ('failed', 'pending'):
+            self.assertEqual(self.transition(payment, new_status), 0)
+            self.assertEqual(payment.payment_status, 'completed')
+
+    def test_failed_can_still_complete(self):
+        payment = make_payment(payment_status='failed')
+        self.assertEqual(self.transition(payment, 'completed'), 1)
+        self.assertEqual(payment.payment_status, 'completed')
+
+    def test_failed_cannot_be_refunded(self):
+        payment = make_payment(payment_status='failed')
+        self.assertEqual(self.transition(payment, 'refunded'), 0)
+        self.assertEqual(payment.payment_status, 'failed')
+
+    def test_refunded_is_final(self):
+        payment = make_payment(payment_status='refunded')
+        for new_status in ('pending', 'completed', 'failed'):
+            self.assertEqual(self.transition(payment, new_status), 0)
+            self.assertEqual(payment.payment_status, 'refunded')
+
+    def test_transitions_follow_the_table(self):
+        for old_status, allowed in PaymentModel.STATUS_TRANSITIONS.items():
+            for new_status in PaymentModel.STATUS_TRANSITIONS:
+                payment = make_payment(f'pi_{old_status}_{new_status}', payment_status=old_status)
+                self.assertEqual(
+                    self.transition(payment, new_status), int(new_status in allowed),
+                    f"{old_status} -> {new_status}",
+                )
+
+
+class ClaimForManyChatTests(TestCase):
+    def claim_twice(self):
+        make_payment('pi_a', payment_status='completed')
+        first = PaymentModel.objects.claim_for_manychat('1001')
+        second = PaymentModel.objects.claim_for_manychat('1001')
+        return first, second
+
+    def test_update_returning_claims_once(self):
+        first, second = self.claim_twice()
+        self.assertEqual((first is not None, second is not None), (True, False))
+        self.assertTrue(PaymentModel.objects.get(pk=first.pk).manychat_payment)
+
+    def test_select_for_update_fallback_claims_once(self):
+        with mock.patch.object(PaymentQuerySet, '_supports_update_returning', return_value=False):
+            first, second = self.claim_twice()
+        self.assertEqual((first is not None, second is not None), (True, False))
+        self.assertTrue(PaymentModel.objects.get(pk=first.pk).manychat_payment)
+
+    def test_claims_latest_payment_first(self):
+        older = make_payment('pi_old', payment_status='completed')
+        newer = make_payment('pi_new', payment_status='completed')
+        self.assertEqual(PaymentModel.objects.claim_for_manychat('1001').pk, newer.pk)
+        self.assertEqual(PaymentModel.objects.claim_for_manychat('1001').pk, older.pk)
+        self.assertIsNone(PaymentModel.objects.claim_for_manychat('1001'))
+
+    def test_other_fb_id_is_untouched(self):
+        make_payment('pi_a', fb_id='2002')
+        self.assertIsNone(PaymentModel.objects.claim_for_manychat('1001'))
+        self.assertFalse(PaymentModel.objects.get(stripe_payment_intent_id='pi_a').manychat_payment)
+
+    def test_backend_detection(self):
+        self.assertTrue(PaymentQuerySet._supports_update_returning(mock.Mock(vendor='postgresql')))
+        old_sqlite = mock.Mock(vendor='sqlite')
+        old_sqlite.Database.sqlite_version_info = (3, 31, 1)
+        self.assertFalse(PaymentQuerySet._supports_update_returning(old_sqlite))
+        self.assertFalse(PaymentQuerySet._supports_update_returning(mock.Mock(vendor='mysql')))
@@ -0,0 +1,135 @@
+import abc
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from ChicShot_Payment_App import ratelimit
+
+RATES = {
+    'test_view': {'fb_id': '1/min', 'ip': '2/min', 'global': '100/min'},
+    'ip_view': {'fb_id': '2/min', 'ip': '1/min'},
+    'cost_view': {'fb_id': '2/min', 'ip': '2/min'},
+}
+
+
+class CheckTestsMixin(abc.ABC):
+    """check() tests, run once per backend by the concrete classes below"""
+
+    @abc.abstractmethod
+    def make_backend(self):
+        """A fresh, empty backend"""
+
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit, '_backend', self.make_backend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings_override = override_settings(PAYMENT_RATE_LIMITS={'RATES': RATES})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def check(self, fb_id, view='test_view', ip='127.0.0.1', cost=1):
+        return ratelimit.check(view, fb_id, RequestFactory().post('/', REMOTE_ADDR=ip), cost)
+
+    def test_limits_the_fb_id(self):
+        self.assertEqual(self.check('fb-1'), 0)
+        self.assertGreater(self.check('fb-1'), 0)
+
+    def test_rejected_request_does_not_drain_other_scopes(self):
+        self.assertEqual(self.check('fb-1'), 0)
+        self.assertGreater(self.check('fb-1'), 0)
+        # The rejected request took no ip token, so one more fits.
+        self.assertEqual(self.check('fb-2'), 0)
+        self.assertGreater(self.check('fb-3'), 0)
+
+    def test_rejected_request_gives_back_tokens_already_taken(self):
+        self.assertEqual(self.check('fb-1', 'ip_view'), 0)
+        # Passes the fb_id limit, then the ip limit rejects it.
+        self.assertGreater(self.check('fb-1', 'ip_view'), 0)
+        self.assertEqual(self.check('fb-1', 'ip_view', ip='10.0.0.2'), 0)
+        self.assertGreater(self.check('fb-1', 'ip_view', ip='10.0.0.3'), 0)
+
+    def test_cost_takes_several_tokens(self):
+        self.assertEqual(self.check(None, cost=2), 0)
+        self.assertGreater(self.check(None), 0)
+
+    def test_rejected_cost_is_given_back(self):
+        self.assertEqual(self.check('fb-1', 'cost_view'), 0)
+        # Takes both fb-2 tokens, then the ip limit, with one left, rejects it.
+        self.assertGreater(self.check('fb-2', 'cost_view', cost=2), 0)
+        self.assertEqual(self.check('fb-2', 'cost_view', ip='10.0.0.2', cost=2), 0)
+    def test_forwarded_for_does_not_bypass_the_ip_limit(self):
+        def check(fb_id, forwarded_for):
+            request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.9', HTTP_X_FORWARDED_FOR=forwarded_for)
+            return ratelimit.check('ip_view', fb_id, request)
+
+        self.assertEqual(check('fb-1', '1.1.1.1'), 0)
+        self.assertGreater(check('fb-2', '2.2.2.2'), 0)
+
+class ClientIpTests(SimpleTestCase):
+    def client_ip(self, forwarded_for):
+        return ratelimit.client_ip(RequestFactory().get(
+            '/', REMOTE_ADDR='10.0.0.9', HTTP_X_FORWARDED_FOR=forwarded_for,
+        ))
+
+    def test_remote_addr_without_proxies(self):
+        self.assertEqual(self.client_ip('1.1.1.1'), '10.0.0.9')
+
+    @override_settings(REST_FRAMEWORK={'NUM_PROXIES': 1})
+    def test_address_the_trusted_proxy_saw(self):
+        self.assertEqual(self.client_ip('1.1.1.1, 203.0.113.7'), '203.0.113.7')
+
+
+class ShardedMemoryBackendCheckTests(CheckTestsMixin, SimpleTestCase):
+    def make_backend(self):
+        return ratelimit.ShardedMemoryBackend()
+
+
+@override_settings(CACHES={'ratelimit-test': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DjangoCacheBackendCheckTests(CheckTestsMixin, SimpleTestCase):
+    def make_backend(self):
+        caches['ratelimit-test'].clear()
+        return ratelimit.DjangoCacheBackend(alias='ratelimit-test')
+
+
+class PaymentRateThrottleTests(TestCase):
+    def test_list_body_is_a_bad_request(self):
+        response = self.client.post('/api/create-payment-intent/', [{'fb_id': 'fb-1'}], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchCreateThrottleTests(TestCase):
+    url = '/api/create-payment-intents/batch/'
+
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit, '_backend', ratelimit.ShardedMemoryBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Items fail without reaching Stripe; the view answers 207.
+        patcher = mock.patch(
+            'ChicShot_Payment_App.views.BatchCreatePaymentIntentView.create_intent', side_effect=RuntimeError("no Stripe"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, count):
+        payments = [{'fb_id': f'fb-{i}', 'amount': '9.99'} for i in range(count)]
+        return self.client.post(self.url, {'payments': payments}, content_type='application/json')
+
+    @override_settings(PAYMENT_RATE_LIMITS={'RATES': {'batch_create_payment_intents': {'ip': '3/min'}}})
+    def test_each_payment_takes_a_token(self):
+        self.assertEqual(self.post(2).status_code, 207)
+        response = self.post(2)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.post(1).status_code, 207)
+        self.assertEqual(self.post(1).status_code, 429)
+
+    @override_settings(
+        PAYMENT_RATE_LIMITS={'RATES': {'batch_create_payment_intents': {'ip': '3/min'}}}, PAYMENT_BATCH_MAX_ITEMS=5,
+    )
+    def test_rejected_batches_take_one_token(self):
+        self.assertEqual(self.post(6).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'payments': 'x'}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.post(1).status_code, 207)
+        self.assertEqual(self.post(1).status_code, 429)
@@ -0,0 +1,140 @@
+from datetime import timedelta
+from unittest import mock
+
+import stripe
+from django.test import TestCase
+
+from ChicShot_Payment_App import reconcile
+from ChicShot_Payment_App.models import PaymentModel
+
+from .test_payments import make_payment
+
+
+def intent(intent_id, status='succeeded', **fields):
+    return {'id': intent_id, 'status': status, 'customer': None, 'latest_charge': None, **fields}
+
+
+def card_charge(wallet=None):
+    return {
+        'id': 'ch_a', 'object': 'charge',
+        'payment_method_details': {'type': 'card', 'card': {'wallet': {'type': wallet} if wallet else None}},
+    }
+
+
+class FakeStripe:
+    """payment_intents.list over `listed`, counting the intents it hands out"""
+
+    def __init__(self, listed, retrievable=()):
+        self.listed = listed
+        self.listed_count = 0
+        self.client = mock.Mock()
+        self.client.v1.payment_intents.list.return_value.auto_paging_iter.side_effect = self.auto_paging_iter
+        self.retrievable = {payment_intent['id']: payment_intent for payment_intent in retrievable}
+        self.client.v1.payment_intents.retrieve.side_effect = self.retrieve
+
+    def auto_paging_iter(self):
+        for payment_intent in self.listed:
+            self.listed_count += 1
+            yield payment_intent
+
+    def retrieve(self, payment_intent_id, params):
+        if payment_intent_id not in self.retrievable:
+            raise stripe.error.InvalidRequestError(f"No such payment_intent: '{payment_intent_id}'", 'intent')
+        return self.retrievable[payment_intent_id]
+
+
+class FetchIntentsTests(TestCase):
+    def test_listed_intents_need_no_retrieve(self):
+        payments = [make_payment('pi_a'), make_payment('pi_b')]
+        fake = FakeStripe([intent('pi_other'), intent('pi_b'), intent('pi_a'), intent('pi_later')])
+        self.assertEqual(set(reconcile.fetch_intents(fake.client, payments)), {'pi_a', 'pi_b'})
+        # Stops as soon as every wanted intent is found.
+        self.assertEqual(fake.listed_count, 3)
+        fake.client.v1.payment_intents.retrieve.assert_not_called()
+
+    def test_window_is_the_payments_dates_with_slack(self):
+        first, last = make_payment('pi_a'), make_payment('pi_b')
+        PaymentModel.objects.filter(pk=first.pk).update(payment_date=last.payment_date - timedelta(hours=2))
+        first.refresh_from_db()
+        fake = FakeStripe([intent('pi_a'), intent('pi_b')])
+        reconcile.fetch_intents(fake.client, [first, last])
+        params = fake.client.v1.payment_intents.list.call_args.kwargs['params']
+        self.assertEqual(params['created'], {
+            'gte': int((first.payment_date - reconcile.CREATED_SLACK).timestamp()),
+            'lte': int((last.payment_date + reconcile.CREATED_SLACK).timestamp()),
+        })
+
+    def test_busy_window_falls_back_to_retrieve(self):
+        payments = [make_payment('pi_a'), make_payment('pi_b'), make_payment('pi_c')]
+        busy = [intent(f'pi_noise_{i}') for i in range(10 * reconcile.LIST_PAGE_SIZE)]
+        fake = FakeStripe(busy[:50] + [intent('pi_a')] + busy[50:] + [intent('pi_b')],
+                          retrievable=[intent('pi_b'), intent('pi_c')])
+        self.assertEqual(set(reconcile.fetch_intents(fake.client, payments)), {'pi_a', 'pi_b', 'pi_c'})
+        # Two pages for the two ids still missing after the first one.
+        self.assertEqual(fake.listed_count, 2 * reconcile.LIST_PAGE_SIZE)
+        self.assertEqual(
+            [call.args[0] for call in fake.client.v1.payment_intents.retrieve.call_args_list], ['pi_b', 'pi_c'],
+        )
+
+    def test_intent_unknown_to_stripe_is_left_out(self):
+        payments = [make_payment('pi_a'), make_payment('pi_gone')]
+        fake = FakeStripe([intent('pi_a')])
+        self.assertEqual(set(reconcile.fetch_intents(fake.client, payments)), {'pi_a'})
+
+
+class ReconcilePaymentsTests(TestCase):
+    def reconcile(self, listed, statuses=('pending',)):
+        payments = list(PaymentModel.objects.filter(payment_status__in=statuses).order_by('id'))
+        return reconcile.reconcile_payments(FakeStripe(listed).client, payments, timedelta(hours=24))
+
+    def payment(self, payment_intent_id):
+        return PaymentModel.objects.get(stripe_payment_intent_id=payment_intent_id)
+
+    def test_mismatched_rows_take_stripes_status(self):
+        make_payment('pi_paid')
+        make_payment('pi_wallet')
+        make_payment('pi_canceled')
+        make_payment('pi_declined')
+        make_payment('pi_open')
+        make_payment('pi_missing')
+        totals = self.reconcile([
+            intent('pi_paid', latest_charge=card_charge(), customer='cus_1'),
+            intent('pi_wallet', latest_charge=card_charge('apple_pay')),
+            intent('pi_canceled', status='canceled'),
+            intent('pi_declined', status='requires_payment_method', last_payment_error={'code': 'card_declined'}),
+            intent('pi_open', status='requires_payment_method'),
+        ])
+        self.assertEqual(totals, {'checked': 6, 'missing': 1, 'updated': 4})
+
+        paid = self.payment('pi_paid')
+        self.assertEqual((paid.payment_status, paid.payment_method, paid.stripe_customer_id),
+                         ('completed', 'card', 'cus_1'))
+        self.assertEqual(self.payment('pi_wallet').payment_method, 'apple_pay')
+        self.assertEqual(self.payment('pi_canceled').payment_status, 'failed')
+        self.assertEqual(self.payment('pi_declined').payment_status, 'failed')
+        self.assertEqual(self.payment('pi_open').payment_status, 'pending')
+        self.assertEqual(self.payment('pi_missing').payment_status, 'pending')
+
+    def test_failed_payment_that_succeeded_is_completed(self):
+        make_payment('pi_a', payment_status='failed')
+        totals = self.reconcile([intent('pi_a', latest_charge=card_charge())], statuses=('failed',))
+        self.assertEqual(totals['updated'], 1)
+        self.assertEqual(self.payment('pi_a').payment_status, 'completed')
+
+    def test_disallowed_transitions_are_skipped(self):
+        make_payment('pi_a', payment_status='completed', payment_method='card')
+        totals = self.reconcile([intent('pi_a', status='canceled')], statuses=('completed',))
+        self.assertEqual(totals['updated'], 0)
+        self.assertEqual(self.payment('pi_a').payment_status, 'completed')
+
+    def test_row_moved_by_a_webhook_meanwhile_is_left_alone(self):
+        make_payment('pi_a')
+        payments = list(PaymentModel.objects.all())
+        # A webhook fails the payment after the sweep read it.
+        PaymentModel.objects.filter(stripe_payment_intent_id='pi_a').transition('failed')
+
+        fake = FakeStripe([intent('pi_a', latest_charge=card_charge())])
+        totals = reconcile.reconcile_payments(fake.client, payments, timedelta(hours=24))
+        self.assertEqual(totals['updated'], 0)
+        payment = self.payment('pi_a')
+        self.assertEqual((payment.payment_status, payment.payment_method), ('failed', None))
@@ -0,0 +1,110 @@
+from datetime import date, datetime, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ChicShot_Payment_App import archive, rollups
+from ChicShot_Payment_App.models import PaymentModel, RevenueRollupModel
+
+from .test_payments import make_payment
+
+DAY = date(2026, 3, 14)
+
+
+def make_dated_payment(payment_intent_id, day=DAY, **fields):
+    payment = make_payment(payment_intent_id, **fields)
+    # payment_date is auto_now_add; backdate it into the day's bucket.
+    payment_date = timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=12)
+    PaymentModel.objects.filter(pk=payment.pk).update(payment_date=payment_date)
+    return payment
+
+
+def transition(payment, new_status):
+    return PaymentModel.objects.filter(pk=payment.pk).transition(new_status)
+
+
+def rollup_rows():
+    return {
+        (row.day, row.package, row.currency): tuple(getattr(row, field) for field in rollups.TOTAL_FIELDS)
+        for row in RevenueRollupModel.objects.all()
+    }
+
+
+class IncrementalRollupTests(TestCase):
+    def test_completions_add_to_their_bucket(self):
+        transition(make_dated_payment('pi_a', amount_minor=999), 'completed')
+        transition(make_dated_payment('pi_b', amount_minor=1500), 'completed')
+        transition(make_dated_payment('pi_c', package='Basic', amount_minor=500), 'completed')
+        transition(make_dated_payment('pi_d', day=DAY + timedelta(days=1), amount_minor=700), 'completed')
+        self.assertEqual(rollup_rows(), {
+            (DAY, 'Gold', 'eur'): (2, 2499, 0, 0),
+            (DAY, 'Basic', 'eur'): (1, 500, 0, 0),
+            (DAY + timedelta(days=1), 'Gold', 'eur'): (1, 700, 0, 0),
+        })
+
+    def test_failures_and_refused_transitions_change_nothing(self):
+        transition(make_dated_payment('pi_a'), 'failed')
+        self.assertEqual(rollup_rows(), {})
+
+        payment = make_dated_payment('pi_b')
+        transition(payment, 'completed')
+        # completed -> failed is not allowed, and a repeat completion moves nothing.
+        self.assertEqual(transition(payment, 'failed'), 0)
+        self.assertEqual(transition(payment, 'completed'), 0)
+        self.assertEqual(rollup_rows(), {(DAY, 'Gold', 'eur'): (1, 999, 0, 0)})
+
+    def test_refund_moves_the_payment_from_completed_to_refunded(self):
+        kept = make_dated_payment('pi_a', amount_minor=999)
+        refunded = make_dated_payment('pi_b', amount_minor=1500)
+        transition(kept, 'completed')
+        transition(refunded, 'completed')
+        transition(refunded, 'refunded')
+        self.assertEqual(rollup_rows(), {(DAY, 'Gold', 'eur'): (1, 999, 1, 1500)})
+
+    def test_failure_then_completion_counts_once(self):
+        payment = make_dated_payment('pi_a')
+        transition(payment, 'failed')
+        transition(payment, 'completed')
+        self.assertEqual(rollup_rows(), {(DAY, 'Gold', 'eur'): (1, 999, 0, 0)})
+
+
+class RebuildDaysTests(TestCase):
+    def setUp(self):
+        for index, (status, day, package, currency) in enumerate([
+            ('completed', DAY, 'Gold', 'eur'),
+            ('completed', DAY, 'Gold', 'eur'),
+            ('refunded', DAY, 'Gold', 'eur'),
+            ('failed', DAY, 'Gold', 'eur'),
+            ('completed', DAY, 'Basic', 'usd'),
+            ('completed', DAY + timedelta(days=1), 'Gold', 'eur'),
+            ('pending', DAY + timedelta(days=1), 'Gold', 'eur'),
+        ]):
+            payment = make_dated_payment(f'pi_{index}', day=day, package=package, currency=currency,
+                                         amount_minor=100 * (index + 1))
+            if status in ('completed', 'refunded'):
+                transition(payment, 'completed')
+            if status != 'completed':
+                transition(payment, status)
+
+    def test_rebuild_matches_the_incremental_rollup(self):
+        incremental = rollup_rows()
+        rollups.rebuild_days(DAY, DAY + timedelta(days=1))
+        self.assertEqual(rollup_rows(), incremental)
+        self.assertEqual(incremental[(DAY, 'Gold', 'eur')], (2, 300, 1, 300))
+
+    def test_rebuild_repairs_a_drifted_day_only(self):
+        expected = rollup_rows()
+        RevenueRollupModel.objects.update(completed_count=99)
+        self.assertEqual(rollups.rebuild_days(DAY, DAY), 2)
+
+        rows = rollup_rows()
+        self.assertEqual(rows[(DAY, 'Gold', 'eur')], expected[(DAY, 'Gold', 'eur')])
+        self.assertEqual(rows[(DAY, 'Basic', 'usd')], expected[(DAY, 'Basic', 'usd')])
+        # Outside the rebuilt range, untouched.
+        self.assertEqual(rows[(DAY + timedelta(days=1), 'Gold', 'eur')][0], 99)
+
+    def test_rebuild_counts_archived_payments(self):
+        expected = rollup_rows()
+        self.assertEqual(archive.archive_payments(older_than_days=0), 6)
+        rollups.rebuild_days(DAY, DAY + timedelta(days=1))
+        self.assertEqual(rollup_rows(), expected)
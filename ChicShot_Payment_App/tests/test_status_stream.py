@@ -0,0 +1,114 @@
+import asyncio
+import json
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+
+from ChicShot_Payment_App import events
+from ChicShot_Payment_App.models import PaymentModel
+
+from .test_payments import make_payment
+
+amake_payment = sync_to_async(make_payment)
+
+
+def parse_event(chunk):
+    """The payment_status message of one server-sent event chunk"""
+    event, data = chunk.decode().rstrip('\n').split('\n')
+    assert event == 'event: payment_status', chunk
+    return json.loads(data.removeprefix('data: '))
+
+
+@override_settings(PAYMENT_EVENTS_HEARTBEAT_SECONDS=0.05, PAYMENT_EVENTS_MAX_STREAM_SECONDS=5)
+class PaymentStatusStreamTests(TestCase):
+    url = '/api/payment-status/stream/'
+
+    def setUp(self):
+        patcher = mock.patch.object(events, '_broker', events.InProcessBroker())
+        self.broker = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @sync_to_async
+    def publish(self, *statuses):
+        # publish_status waits for the commit, which needs the database.
+        with self.captureOnCommitCallbacks(execute=True):
+            for status in statuses:
+                events.publish_status(*status)
+
+    async def next_chunk(self, stream):
+        return await asyncio.wait_for(anext(stream), timeout=2)
+
+    async def test_needs_exactly_one_of_the_parameters(self):
+        for query in ({}, {'payment_intent_id': 'pi_a', 'fb_id': '1001'}):
+            with self.subTest(query=query):
+                response = await self.async_client.get(self.url, query)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.broker._subscriptions, {})
+
+    async def test_unknown_intent_is_a_404(self):
+        response = await self.async_client.get(self.url, {'payment_intent_id': 'pi_missing'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.broker._subscriptions, {})
+
+    async def test_current_status_then_published_changes_until_settled(self):
+        await amake_payment('pi_a')
+        response = await self.async_client.get(self.url, {'payment_intent_id': 'pi_a'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+
+        self.assertEqual(parse_event(await self.next_chunk(stream))['payment_status'], 'pending')
+
+        await self.publish(('pi_a', '1001', 'failed'))
+        self.assertEqual(parse_event(await self.next_chunk(stream))['payment_status'], 'failed')
+
+        await self.publish(('pi_a', '1001', 'completed', 'card'))
+        message = parse_event(await self.next_chunk(stream))
+        self.assertEqual((message['payment_status'], message['payment_method']), ('completed', 'card'))
+
+        # Settled: the stream ends and lets go of its subscription.
+        with self.assertRaises(StopAsyncIteration):
+            await self.next_chunk(stream)
+        self.assertEqual(self.broker._subscriptions, {})
+
+    async def test_heartbeat_rechecks_the_database(self):
+        await amake_payment('pi_a')
+        response = await self.async_client.get(self.url, {'payment_intent_id': 'pi_a'})
+        stream = aiter(response.streaming_content)
+        self.assertEqual(parse_event(await self.next_chunk(stream))['payment_status'], 'pending')
+
+        # Nothing changed: a keepalive comment.
+        self.assertEqual(await self.next_chunk(stream), b': keepalive\n\n')
+
+        # Changed by another process, so never published here.
+        await PaymentModel.objects.filter(stripe_payment_intent_id='pi_a').aupdate(
+            payment_status='completed', payment_method='card',
+        )
+        chunk = await self.next_chunk(stream)
+        while chunk == b': keepalive\n\n':
+            chunk = await self.next_chunk(stream)
+        self.assertEqual(parse_event(chunk)['payment_status'], 'completed')
+        with self.assertRaises(StopAsyncIteration):
+            await self.next_chunk(stream)
+
+    @override_settings(PAYMENT_EVENTS_MAX_STREAM_SECONDS=0.5)
+    async def test_fb_id_stream_waits_for_a_first_payment(self):
+        response = await self.async_client.get(self.url, {'fb_id': '1001'})
+        self.assertEqual(response.status_code, 200)
+        stream = aiter(response.streaming_content)
+
+        await self.publish(('pi_a', '1001', 'pending'), ('pi_other', '2002', 'pending'))
+        self.assertEqual(parse_event(await self.next_chunk(stream))['payment_intent_id'], 'pi_a')
+
+        # An fb_id stream outlives settled payments.
+        await self.publish(('pi_a', '1001', 'completed', 'card'))
+        self.assertEqual(parse_event(await self.next_chunk(stream))['payment_status'], 'completed')
+        await amake_payment('pi_a', payment_status='completed', payment_method='card')
+        self.assertEqual(await self.next_chunk(stream), b': keepalive\n\n')
+
+        # Until PAYMENT_EVENTS_MAX_STREAM_SECONDS is up.
+        with self.assertRaises(StopAsyncIteration):
+            while True:
+                self.assertEqual(await self.next_chunk(stream), b': keepalive\n\n')
+        self.assertEqual(self.broker._subscriptions, {})
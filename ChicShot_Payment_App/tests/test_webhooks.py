@@ -0,0 +1,313 @@
+import hmac
+import json
+import time
+from datetime import timedelta
+from hashlib import sha256
+from unittest import mock
+
+import stripe
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from ChicShot_Payment_App import webhooks
+from ChicShot_Payment_App.management.commands.process_webhooks import Command as ProcessWebhooksCommand
+from ChicShot_Payment_App.models import PaymentModel, ProcessedEventModel, WebhookEventModel
+from ChicShot_Payment_App.webhooks import (
+    UnmatchedEventError, claim_events, group_by_intent, payment_method_from_intent, peek_event_type, process_event,
+    run_queued_event, verify_signature,
+)
+
+from .test_payments import make_payment
+
+
+def stripe_event(event_id, event_type, intent_id):
+    return {'id': event_id, 'type': event_type, 'data': {'object': {'id': intent_id, 'customer': None}}}
+
+
+def queued(pk, event_type, intent_id):
+    payload = {'id': f'evt_{pk}', 'type': event_type, 'data': {'object': {'id': intent_id}}}
+    return WebhookEventModel(pk=pk, event_id=f'evt_{pk}', event_type=event_type, payload=json.dumps(payload))
+
+
+def sign(payload, secret, timestamp):
+    return hmac.new(secret.encode(), f'{timestamp}.'.encode() + payload, sha256).hexdigest()
+
+
+class VerifySignatureTests(SimpleTestCase):
+    payload = b'{"id": "evt_1", "type": "payment_intent.succeeded"}'
+
+    def header(self, *secrets, timestamp=None):
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        return ','.join([f't={timestamp}'] + [f'v1={sign(self.payload, secret, timestamp)}' for secret in secrets])
+
+    def assertRejected(self, header, secrets=('whsec_a',), tolerance=300):
+        with self.assertRaises(stripe.error.SignatureVerificationError):
+            verify_signature(self.payload, header, secrets, tolerance)
+
+    def test_valid_signature(self):
+        verify_signature(self.payload, self.header('whsec_a'), ['whsec_a'], 300)
+
+    def test_bad_signature(self):
+        self.assertRejected(self.header('whsec_other'))
+
+    def test_tampered_payload(self):
+        with self.assertRaises(stripe.error.SignatureVerificationError):
+            verify_signature(self.payload + b' ', self.header('whsec_a'), ['whsec_a'], 300)
+
+    def test_stale_timestamp(self):
+        self.assertRejected(self.header('whsec_a', timestamp=int(time.time()) - 301))
+
+    def test_stale_timestamp_without_tolerance(self):
+        verify_signature(self.payload, self.header('whsec_a', timestamp=1), ['whsec_a'], 0)
+
+    def test_any_of_several_v1_entries(self):
+        verify_signature(self.payload, self.header('whsec_other', 'whsec_a'), ['whsec_a'], 300)
+
+    def test_rotated_second_secret(self):
+        verify_signature(self.payload, self.header('whsec_old'), ['whsec_new', 'whsec_old'], 300)
+
+    def test_malformed_headers(self):
+        timestamp = int(time.time())
+        signature = sign(self.payload, 'whsec_a', timestamp)
+        for header in [
+            None,
+            '',
+            'garbage',
+            f'v1={signature}',
+            f't={timestamp}',
+            f't=soon,v1={signature}',
+            f't={timestamp},v0={signature}',
+        ]:
+            with self.subTest(header=header):
+                self.assertRejected(header)
+
+
+class PeekEventTypeTests(SimpleTestCase):
+    def test_type_as_last_key(self):
+        self.assertEqual(peek_event_type(b'{"id": "evt_1", "data": {}, "type": "charge.refunded"}'), 'charge.refunded')
+
+    def test_type_elsewhere_is_unknown(self):
+        self.assertEqual(peek_event_type(b'{"type": "charge.refunded", "data": {"type": "card"}}'), 'unknown')
+
+
+class GroupByIntentTests(SimpleTestCase):
+    def test_events_for_one_intent_stay_together_in_queue_order(self):
+        batch = [
+            queued(1, 'payment_intent.payment_failed', 'pi_a'),
+            queued(2, 'payment_intent.succeeded', 'pi_b'),
+            queued(3, 'payment_intent.succeeded', 'pi_a'),
+        ]
+        groups = group_by_intent(batch)
+        self.assertEqual([[event.pk for event in group] for group in groups], [[1, 3], [2]])
+
+    def test_unparsable_payload_is_its_own_group(self):
+        broken = WebhookEventModel(pk=9, event_id='evt_9', event_type='x', payload='not json')
+        groups = group_by_intent([broken, queued(1, 'payment_intent.succeeded', 'pi_a')])
+        self.assertEqual(len(groups), 2)
+
+    def test_split_never_spreads_a_group_over_threads(self):
+        batch = [queued(i, 'payment_intent.succeeded', f'pi_{i % 3}') for i in range(12)]
+        slices = ProcessWebhooksCommand.split(group_by_intent(batch), concurrency=2)
+        self.assertEqual(len(slices), 2)
+        for intent in range(3):
+            holders = [events for events in slices if any(event.pk % 3 == intent for event in events)]
+            self.assertEqual(len(holders), 1)
+            pks = [event.pk for event in holders[0] if event.pk % 3 == intent]
+            self.assertEqual(pks, sorted(pks))
+
+
+class ProcessEventTests(TestCase):
+    def status_of(self, payment_intent_id):
+        return PaymentModel.objects.get(stripe_payment_intent_id=payment_intent_id).payment_status
+
+    def test_duplicate_event_id_is_a_no_op(self):
+        make_payment('pi_a')
+        event = stripe_event('evt_1', 'payment_intent.succeeded', 'pi_a')
+        self.assertTrue(process_event(event))
+        # Even if the payment were moved back, the redelivery is ignored.
+        PaymentModel.objects.filter(stripe_payment_intent_id='pi_a').update(payment_status='pending')
+        self.assertFalse(process_event(event))
+        self.assertEqual(self.status_of('pi_a'), 'pending')
+        self.assertEqual(ProcessedEventModel.objects.filter(event_id='evt_1').count(), 1)
+
+    def test_late_failure_does_not_undo_completion(self):
+        make_payment('pi_a')
+        self.assertTrue(process_event(stripe_event('evt_1', 'payment_intent.succeeded', 'pi_a')))
+        self.assertFalse(process_event(stripe_event('evt_2', 'payment_intent.payment_failed', 'pi_a')))
+        self.assertEqual(self.status_of('pi_a'), 'completed')
+
+    def test_success_after_failure_completes(self):
+        make_payment('pi_a')
+        self.assertTrue(process_event(stripe_event('evt_1', 'payment_intent.payment_failed', 'pi_a')))
+        self.assertTrue(process_event(stripe_event('evt_2', 'payment_intent.succeeded', 'pi_a')))
+        self.assertEqual(self.status_of('pi_a'), 'completed')
+
+    def test_unknown_intent_raises_and_is_not_recorded(self):
+        make_payment('pi_a')
+        event = stripe_event('evt_1', 'payment_intent.succeeded', 'pi_unknown')
+        with self.assertRaises(UnmatchedEventError):
+            process_event(event)
+        self.assertEqual(self.status_of('pi_a'), 'pending')
+        self.assertFalse(ProcessedEventModel.objects.filter(event_id='evt_1').exists())
+
+        # Redelivered once the payment row exists, the event applies.
+        make_payment('pi_unknown')
+        self.assertTrue(process_event(event))
+        self.assertEqual(self.status_of('pi_unknown'), 'completed')
+
+    def test_refused_event_is_recorded(self):
+        make_payment('pi_a', payment_status='completed')
+        event = stripe_event('evt_1', 'payment_intent.payment_failed', 'pi_a')
+        self.assertFalse(process_event(event))
+        self.assertTrue(ProcessedEventModel.objects.filter(event_id='evt_1').exists())
+
+    def test_unhandled_event_type_is_ignored(self):
+        make_payment('pi_a')
+        self.assertFalse(process_event(stripe_event('evt_1', 'charge.refunded', 'pi_a')))
+        self.assertEqual(self.status_of('pi_a'), 'pending')
+
+
+@override_settings(STRIPE_WEBHOOK_SECRETS=['whsec_a'], STRIPE_WEBHOOK_QUEUE=False)
+class UnmatchedEventDeliveryTests(TestCase):
+    """An event that beats its payment row is delivered again, not dropped"""
+
+    event = stripe_event('evt_1', 'payment_intent.succeeded', 'pi_late')
+
+    def post_event(self):
+        payload = json.dumps(self.event).encode()
+        timestamp = int(time.time())
+        return self.client.post(
+            '/api/stripe-webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={sign(payload, "whsec_a", timestamp)}',
+        )
+
+    def test_webhook_view_asks_stripe_to_redeliver(self):
+        self.assertEqual(self.post_event().status_code, 404)
+        make_payment('pi_late')
+        self.assertEqual(self.post_event().status_code, 200)
+        self.assertEqual(PaymentModel.objects.get(stripe_payment_intent_id='pi_late').payment_status, 'completed')
+
+    def test_queue_keeps_the_event_for_a_retry(self):
+        WebhookEventModel.objects.create(event_id='evt_1', event_type=self.event['type'], payload=json.dumps(self.event))
+        [queued_event] = claim_events('worker', batch_size=10, lease_seconds=60)
+        self.assertFalse(run_queued_event(queued_event, max_attempts=5))
+
+        retry = WebhookEventModel.objects.get(event_id='evt_1')
+        self.assertEqual((retry.status, retry.locked_by), ('pending', None))
+        self.assertGreater(retry.locked_until, timezone.now())
+        self.assertIn('pi_late', retry.last_error)
+
+        make_payment('pi_late')
+        WebhookEventModel.objects.filter(pk=retry.pk).update(locked_until=timezone.now())
+        [queued_event] = claim_events('worker', batch_size=10, lease_seconds=60)
+        self.assertTrue(run_queued_event(queued_event, max_attempts=5))
+        self.assertFalse(WebhookEventModel.objects.exists())
+        self.assertEqual(PaymentModel.objects.get(stripe_payment_intent_id='pi_late').payment_status, 'completed')
+
+
+class WebhookQueueLeaseTests(TestCase):
+    def enqueue(self, pk, intent_id):
+        event = stripe_event(f'evt_{pk}', 'payment_intent.succeeded', intent_id)
+        return WebhookEventModel.objects.create(
+            pk=pk, event_id=event['id'], event_type=event['type'], payload=json.dumps(event),
+        )
+
+    def expire_leases(self):
+        WebhookEventModel.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+
+    def test_lease_keeps_other_workers_out_until_it_expires(self):
+        for pk in (1, 2, 3):
+            self.enqueue(pk, f'pi_{pk}')
+        self.assertEqual([event.pk for event in claim_events('a', batch_size=2, lease_seconds=60)], [1, 2])
+        self.assertEqual([event.pk for event in claim_events('b', batch_size=10, lease_seconds=60)], [3])
+        self.assertEqual(claim_events('c', batch_size=10, lease_seconds=60), [])
+
+        self.expire_leases()
+        reclaimed = claim_events('c', batch_size=10, lease_seconds=60)
+        self.assertEqual([(event.pk, event.locked_by, event.attempts) for event in reclaimed],
+                         [(1, 'c', 2), (2, 'c', 2), (3, 'c', 2)])
+
+    def test_reclaimed_event_is_left_to_its_new_worker(self):
+        make_payment('pi_a')
+        self.enqueue(1, 'pi_a')
+        [stale] = claim_events('a', batch_size=10, lease_seconds=60)
+        self.expire_leases()
+        [fresh] = claim_events('b', batch_size=10, lease_seconds=60)
+
+        # Worker a gets to the event after its lease ran out.
+        self.assertFalse(run_queued_event(stale, max_attempts=5))
+        self.assertEqual(PaymentModel.objects.get().payment_status, 'pending')
+        self.assertEqual(WebhookEventModel.objects.get().locked_by, 'b')
+
+        self.assertTrue(run_queued_event(fresh, max_attempts=5))
+        self.assertEqual(PaymentModel.objects.get().payment_status, 'completed')
+        self.assertFalse(WebhookEventModel.objects.exists())
+        self.assertEqual(ProcessedEventModel.objects.count(), 1)
+
+    def test_expired_lease_nobody_took_over_still_applies(self):
+        make_payment('pi_a')
+        self.enqueue(1, 'pi_a')
+        [queued_event] = claim_events('a', batch_size=10, lease_seconds=60)
+        self.expire_leases()
+        self.assertTrue(run_queued_event(queued_event, max_attempts=5))
+        self.assertEqual(PaymentModel.objects.get().payment_status, 'completed')
+        self.assertEqual(claim_events('b', batch_size=10, lease_seconds=60), [])
+
+    def test_event_being_applied_cannot_be_reclaimed(self):
+        make_payment('pi_a')
+        self.enqueue(1, 'pi_a')
+        [queued_event] = claim_events('a', batch_size=10, lease_seconds=60)
+        claimed_meanwhile = []
+
+        def slow_process_event(event):
+            # The handler outlives its lease and another worker polls.
+            self.expire_leases()
+            claimed_meanwhile.extend(claim_events('b', batch_size=10, lease_seconds=60))
+            return process_event(event)
+
+        with mock.patch.object(webhooks, 'process_event', slow_process_event):
+            self.assertTrue(run_queued_event(queued_event, max_attempts=5))
+        self.assertEqual(claimed_meanwhile, [])
+        self.assertEqual(ProcessedEventModel.objects.count(), 1)
+
+    def test_failed_event_goes_back_to_the_queue(self):
+        make_payment('pi_a')
+        self.enqueue(1, 'pi_a')
+        [queued_event] = claim_events('a', batch_size=10, lease_seconds=60)
+        with mock.patch.object(webhooks, 'process_event', side_effect=RuntimeError("boom")):
+            self.assertFalse(run_queued_event(queued_event, max_attempts=5))
+        retry = WebhookEventModel.objects.get()
+        self.assertEqual((retry.status, retry.locked_by, retry.last_error), ('pending', None, 'boom'))
+
+        WebhookEventModel.objects.update(locked_until=timezone.now(), attempts=4)
+        [queued_event] = claim_events('a', batch_size=10, lease_seconds=60)
+        with mock.patch.object(webhooks, 'process_event', side_effect=RuntimeError("boom")):
+            self.assertFalse(run_queued_event(queued_event, max_attempts=5))
+        self.assertEqual(WebhookEventModel.objects.get().status, 'failed')
+        self.assertEqual(claim_events('a', batch_size=10, lease_seconds=60), [])
+
+
+class PaymentMethodFromIntentTests(SimpleTestCase):
+    def intent(self, latest_charge):
+        return {'id': 'pi_a', 'latest_charge': latest_charge}
+
+    def charge(self, details):
+        return {'id': 'ch_a', 'object': 'charge', 'payment_method_details': details}
+
+    def test_card(self):
+        charge = self.charge({'type': 'card', 'card': {'wallet': None}})
+        self.assertEqual(payment_method_from_intent(self.intent(charge)), 'card')
+
+    def test_wallets(self):
+        for wallet in ('google_pay', 'apple_pay'):
+            charge = self.charge({'type': 'card', 'card': {'wallet': {'type': wallet}}})
+            self.assertEqual(payment_method_from_intent(self.intent(charge)), wallet)
+
+    def test_unexpanded_or_missing_charge(self):
+        self.assertIsNone(payment_method_from_intent(self.intent('ch_a')))
+        self.assertIsNone(payment_method_from_intent(self.intent(None)))
+        self.assertIsNone(payment_method_from_intent({'id': 'pi_a'}))
+
+    def test_non_card_payment(self):
+        charge = self.charge({'type': 'sepa_debit'})
+        self.assertIsNone(payment_method_from_intent(self.intent(charge)))
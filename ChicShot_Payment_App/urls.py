@@ -1,5 +1,15 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# PAYMENT_API_ASYNC serves the Stripe-backed API views as async views; use it
+# when running under ASGI (ChicShotProject.asgi).
+if settings.PAYMENT_API_ASYNC:
+    create_payment_intent_view = async_views.AsyncCreatePaymentIntentView.as_view()
+    payment_success_view = async_views.AsyncPaymentSuccessView.as_view()
+else:
+    create_payment_intent_view = views.CreatePaymentIntentView.as_view()
+    payment_success_view = views.PaymentSuccessView.as_view()
 
 urlpatterns = [
     # Payment pages
@@ -8,14 +18,23 @@ urlpatterns = [
     
     # API endpoints
     path('api/create-payment-intent/', 
-        views.CreatePaymentIntentView.as_view(), 
+        create_payment_intent_view, 
         name='create_payment_intent'),
     
+    path('api/create-payment-intents/batch/',
+        views.BatchCreatePaymentIntentView.as_view(),
+        name='create_payment_intents_batch'),
+    
     # ✅ Add this - Payment success endpoint
     path('api/payment-success/', 
-        views.PaymentSuccessView.as_view(), 
+        payment_success_view, 
         name='payment_success_api'),
     
+    # Payment status push channel (server-sent events, ASGI only)
+    path('api/payment-status/stream/',
+        async_views.PaymentStatusStreamView.as_view(),
+        name='payment_status_stream'),
+    
     # Webhook
     path('api/stripe-webhook/', 
         views.StripeWebhookView.as_view(), 
@@ -25,4 +44,24 @@ urlpatterns = [
     path('manychat-payment-check/<str:fb_id>/',
         views.ManyChatPaymentCheck.as_view(),
         name='manychat_payment_check'),
-]
\ No newline at end of file
+    
+    # Finance export
+    path('internal/payments/export/',
+        views.PaymentExportView.as_view(),
+        name='payment_export'),
+    
+    path('internal/payments/<str:payment_intent_id>/',
+        views.PaymentLookupView.as_view(),
+        name='payment_lookup'),
+    path('internal/revenue/',
+        views.RevenueReportView.as_view(),
+        name='revenue_report'),
+    
+    # Monitoring
+    path('internal/stripe-client-stats/',
+        views.StripeClientStatsView.as_view(),
+        name='stripe_client_stats'),
+    path('metrics',
+        views.metrics_view,
+        name='metrics'),
+]
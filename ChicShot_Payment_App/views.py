@@ -1,18 +1,37 @@
+import contextvars
+import hmac
+import logging
+
 import stripe
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from decouple import config
-from .models import PaymentModel
-
-# Stripe configuration
-stripe.api_key = config('STRIPE_SECRET_KEY', default='')
+from . import archive, circuit, events, exports, intent_reuse, rollups, status_cache
+from .ratelimit import PaymentRateThrottle
+from .metrics import REGISTRY, webhook_events, webhook_signature_failures
+from .models import ArchivedPaymentModel, PaymentModel, WebhookEventModel
+from .money import normalize_currency, to_minor_units
+from .routers import mark_written, use_replica
+from .stripe_client import (
+    get_stripe_client, get_stripe_executor, idempotency_key, payment_intent_params, pool_stats,
+)
+from .webhooks import (
+    HANDLED_EVENT_TYPES, UnmatchedEventError, loads, may_be_handled, payment_method_from_intent, peek_event_type,
+    process_event, verify_signature,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def payment_page(request):
@@ -27,9 +46,12 @@ def payment_success_page(request):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class CreatePaymentIntentView(APIView):
-    
+    throttle_classes = [PaymentRateThrottle]
+    rate_limit_view = 'create_payment_intent'
     
     def post(self, request):
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Request body must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
         try:
             fb_id = request.data.get('fb_id', '')
             amount = request.data.get('amount')
@@ -37,59 +59,223 @@ class CreatePaymentIntentView(APIView):
             currency = request.data.get('currency', 'eur')
             description = request.data.get('description', '')
             
-            print(fb_id)
-            
             if not amount:
                 return Response(
                     {'error': 'Amount is required'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            amount_in_cents = int(float(amount) * 100)
-            
-            payment_intent = stripe.PaymentIntent.create(
-                amount=amount_in_cents,
-                currency=currency,
-                payment_method_types=['card'],
-                description=f"{package} - {description}",
-                metadata={
-                    'fb_id': fb_id,
-                    'package': package,
-                    'description': description
-                }
+            try:
+                currency = normalize_currency(currency)
+                amount_minor = to_minor_units(amount, currency)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # A reload or retry of the same checkout gets its open intent back.
+            latest = None
+            if intent_reuse.enabled(fb_id):
+                latest = intent_reuse.latest_payment(fb_id, package, amount_minor, currency)
+                client_secret = intent_reuse.reusable_secret(latest)
+                if client_secret:
+                    return Response({
+                        'success': True,
+                        'client_secret': client_secret,
+                        'payment_intent_id': latest['stripe_payment_intent_id'],
+                        'payment_id': latest['id'],
+                        'publishable_key': settings.STRIPE_PUBLIC_KEY,
+                        'reused': True,
+                    }, status=status.HTTP_200_OK)
+            
+            payment_intent = get_stripe_client().v1.payment_intents.create(
+                params=payment_intent_params(amount_minor, currency, fb_id, package, description),
+                options={'idempotency_key': intent_reuse.create_idempotency_key(
+                    request, latest, fb_id, package, amount_minor, currency, description,
+                )}
             )
             
-            payment = PaymentModel.objects.create(
+            payment, _ = intent_reuse.save_payment(
+                payment_intent,
                 fb_id=fb_id,
                 package=package,
-                amount=float(amount),
+                amount_minor=amount_minor,
                 currency=currency,
                 description=description,
-                stripe_payment_intent_id=payment_intent.id,
                 payment_status='pending'
             )
-            print(payment)
-            
+            intent_reuse.remember(payment_intent.id, payment_intent.client_secret)
+            mark_written(fb_id, payment_intent.id)
+            logger.info("Payment intent created", extra={
+                'fb_id': fb_id,
+                'payment_id': payment.id,
+                'payment_intent_id': payment_intent.id,
+            })
             
             return Response({
                 'success': True,
                 'client_secret': payment_intent.client_secret,
                 'payment_intent_id': payment_intent.id,
                 'payment_id': payment.id,
-                'publishable_key': config('STRIPE_PUBLIC_KEY', default='')
+                'publishable_key': settings.STRIPE_PUBLIC_KEY
             }, status=status.HTTP_201_CREATED)
             
+        except stripe.error.APIConnectionError as e:
+            logger.warning("Stripe unavailable while creating payment intent", extra={'error': str(e)})
+            return circuit.service_unavailable(e)
         except Exception as e:
-            
+            logger.exception("Failed to create payment intent")
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchCreatePaymentIntentView(APIView):
+    """Create payment intents for a list of payloads in one request
+
+    Takes {"payments": [...]} where each item has the fields of
+    CreatePaymentIntentView. Stripe calls run concurrently on the shared
+    Stripe executor and all created payments are inserted with one
+    bulk_create. Responds 201 when every item succeeded, otherwise 207 with
+    a result (or error) per item, in request order.
+    """
+
+    throttle_classes = [PaymentRateThrottle]
+    rate_limit_view = 'batch_create_payment_intents'
+
+    @staticmethod
+    def items_of(data):
+        return data.get('payments') if isinstance(data, dict) else data
+
+    def rate_limit_cost(self, request):
+        """One token per payment, like as many single creates"""
+        items = self.items_of(request.data)
+        if isinstance(items, list) and 0 < len(items) <= settings.PAYMENT_BATCH_MAX_ITEMS:
+            return len(items)
+        # Answered 400 without calling Stripe.
+        return 1
+
+    def post(self, request):
+        items = self.items_of(request.data)
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'payments must be a non-empty list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.PAYMENT_BATCH_MAX_ITEMS:
+            return Response(
+                {'error': f'At most {settings.PAYMENT_BATCH_MAX_ITEMS} payments per batch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(items)
+        pending = {}
+        for index, item in enumerate(items):
+            try:
+                pending[index] = self.parse_item(item)
+            except ValueError as e:
+                results[index] = {'index': index, 'success': False, 'error': str(e)}
+
+        # Each call runs in a copy of this request's context so its logs
+        # and Stripe timings are attributed to the request.
+        executor = get_stripe_executor()
+        futures = {
+            index: executor.submit(
+                contextvars.copy_context().run, self.create_intent, request, index, payment,
+            )
+            for index, payment in pending.items()
+        }
+
+        created = []
+        for index, future in futures.items():
+            try:
+                payment_intent = future.result()
+            except Exception as e:
+                logger.warning("Batch payment intent creation failed", extra={'index': index, 'error': str(e)})
+                results[index] = {'index': index, 'success': False, 'error': str(e)}
+                continue
+            created.append((index, payment_intent, PaymentModel(
+                **pending[index],
+                stripe_payment_intent_id=payment_intent.id,
+                payment_status='pending',
+            )))
+
+        try:
+            PaymentModel.objects.bulk_create([payment for _, _, payment in created])
+        except Exception as e:
+            # The intents exist on Stripe but were never recorded; the
+            # client can retry the batch with the same Idempotency-Key.
+            logger.exception("Failed to save batch payments", extra={'count': len(created)})
+            for index, payment_intent, _ in created:
+                results[index] = {
+                    'index': index,
+                    'success': False,
+                    'payment_intent_id': payment_intent.id,
+                    'error': str(e),
+                }
+            created = []
+
+        mark_written(*(key for _, _, payment in created for key in (payment.fb_id, payment.stripe_payment_intent_id)))
+        for index, payment_intent, payment in created:
+            results[index] = {
+                'index': index,
+                'success': True,
+                'client_secret': payment_intent.client_secret,
+                'payment_intent_id': payment_intent.id,
+                'payment_id': payment.id,
+            }
+        logger.info("Batch payment intents created", extra={'requested': len(items), 'created_count': len(created)})
+
+        return Response({
+            'success': len(created) == len(items),
+            'created': len(created),
+            'failed': len(items) - len(created),
+            'publishable_key': settings.STRIPE_PUBLIC_KEY,
+            'results': results,
+        }, status=status.HTTP_201_CREATED if len(created) == len(items) else status.HTTP_207_MULTI_STATUS)
+
+    @staticmethod
+    def parse_item(item):
+        """PaymentModel fields for one batch item; raises ValueError when invalid"""
+        if not isinstance(item, dict):
+            raise ValueError('Each payment must be an object')
+        if not item.get('amount'):
+            raise ValueError('Amount is required')
+        currency = normalize_currency(item.get('currency', 'eur'))
+        return {
+            'fb_id': item.get('fb_id', ''),
+            'package': item.get('package', 'Payment'),
+            'amount_minor': to_minor_units(item['amount'], currency),
+            'currency': currency,
+            'description': item.get('description', ''),
+        }
+
+    @staticmethod
+    def create_intent(request, index, payment):
+        return get_stripe_client().v1.payment_intents.create(
+            params=payment_intent_params(
+                payment['amount_minor'], payment['currency'],
+                payment['fb_id'], payment['package'], payment['description'],
+            ),
+            options={'idempotency_key': idempotency_key(request, f'create-payment-intent-batch:{index}')}
+        )
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class PaymentSuccessView(APIView):
     
+    @staticmethod
+    def status_response(payment_status, payment_method, degraded=False):
+        data = {
+            'success': True,
+            'payment_status': payment_status,
+            'payment_method': payment_method,
+            'message': 'Payment confirmed successfully'
+        }
+        if degraded:
+            # Stripe could not be asked; the status is the last one we recorded.
+            data.update(degraded=True, message='Payment status from our records; it may not be final yet')
+        return Response(data, status=status.HTTP_200_OK)
     
     def post(self, request):
         try:
@@ -104,84 +290,85 @@ class PaymentSuccessView(APIView):
                 )
             
             
-            payment_intent = stripe.PaymentIntent.retrieve(
-                payment_intent_id,
-                expand=['charges']  
-            )
+            cached = status_cache.get_status(payment_intent_id)
+            if cached:
+                return self.status_response(cached['payment_status'], cached['payment_method'])
             
-            payment = PaymentModel.objects.filter(
-                stripe_payment_intent_id=payment_intent_id
-            ).first()
+            lookup = PaymentModel.objects.filter(stripe_payment_intent_id=payment_intent_id)
+            with use_replica(payment_intent_id) as on_replica:
+                payment = lookup.first()
+            if payment is None and on_replica:
+                # Possibly not replicated yet; the primary has the final word.
+                payment = lookup.first()
             
             if not payment:
+                # Old payments are archived in their final status.
+                archived = ArchivedPaymentModel.objects.filter(stripe_payment_intent_id=payment_intent_id).first()
+                if archived:
+                    return self.status_response(archived.payment_status, archived.payment_method)
                 
                 return Response(
                     {'error': 'Payment not found'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
+            # Settled payments (usually already updated by the webhook) are
+            # answered without a Stripe round trip once their method is known.
+            if payment.is_final:
+                status_cache.set_status(payment_intent_id, payment.payment_status, payment.payment_method)
+                return self.status_response(payment.payment_status, payment.payment_method)
             
             try:
-                if hasattr(payment_intent, 'charges') and payment_intent.charges and len(payment_intent.charges.data) > 0:
-                    charge = payment_intent.charges.data[0]
-                    payment_method_details = getattr(charge, 'payment_method_details', None)
-                    
-                    if payment_method_details and payment_method_details.type == 'card':
-                        card_details = getattr(payment_method_details, 'card', None)
-                        if card_details:
-                            wallet = getattr(card_details, 'wallet', None)
-                            if wallet:
-                                wallet_type = getattr(wallet, 'type', None)
-                                if wallet_type == 'google_pay':
-                                    payment.payment_method = 'google_pay'
-                                elif wallet_type == 'apple_pay':
-                                    payment.payment_method = 'apple_pay'
-                                else:
-                                    payment.payment_method = 'card'
-                            else:
-                                payment.payment_method = 'card'
-                        else:
-                            payment.payment_method = 'card'
-                    else:
-                        payment.payment_method = 'card'
-                else:
-                    payment.payment_method = 'card'
-            except Exception as e:
-                
-                payment.payment_method = 'card'  
+                payment_intent = get_stripe_client().v1.payment_intents.retrieve(
+                    payment_intent_id,
+                    params={'expand': ['latest_charge']}
+                )
+            except stripe.error.APIConnectionError as e:
+                # Degraded mode: answer from the database and leave the
+                # status uncached so the next poll asks Stripe again.
+                logger.warning("Stripe unavailable, answering payment status from the database", extra={
+                    'payment_intent_id': payment_intent_id, 'error': str(e),
+                })
+                return self.status_response(payment.payment_status, payment.payment_method, degraded=True)
             
+            payment_method = payment_method_from_intent(payment_intent) or 'card'
             
             if payment_intent.status == 'succeeded':
-                payment.payment_status = 'completed'
+                new_status = 'completed'
                 
             elif payment_intent.status == 'processing':
-                payment.payment_status = 'pending'
+                new_status = 'pending'
                 
             else:
-                payment.payment_status = 'failed'
-                
-            
-            payment.save()
-            
+                new_status = 'failed'
+            
+            # Conditional update: a concurrent webhook may already have moved
+            # the payment further along the state machine.
+            if payment.can_transition_to(new_status) and PaymentModel.objects.filter(
+                pk=payment.pk
+            ).transition(new_status, payment_method=payment_method):
+                payment.payment_status = new_status
+                payment.payment_method = payment_method
+                mark_written(payment_intent_id, payment.fb_id)
+                events.publish_status(payment_intent_id, payment.fb_id, new_status, payment_method)
+            elif payment.payment_status in PaymentModel.SETTLED_STATUSES and payment.payment_method is None:
+                # Completed by a webhook, which cannot see the charge.
+                PaymentModel.objects.filter(pk=payment.pk, payment_method__isnull=True).update(
+                    payment_method=payment_method
+                )
+                payment.payment_method = payment_method
             
-            
-            return Response({
-                'success': True,
-                'payment_status': payment.payment_status,
-                'payment_method': payment.payment_method,
-                'message': 'Payment confirmed successfully'
-            }, status=status.HTTP_200_OK)
+            status_cache.set_status(payment_intent_id, payment.payment_status, payment.payment_method)
+            return self.status_response(payment.payment_status, payment.payment_method)
             
         except stripe.error.StripeError as e:
-            
+            logger.warning("Stripe error while confirming payment", extra={'error': str(e)})
             return Response(
                 {'error': f'Stripe error: {str(e)}'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         except Exception as e:
-            
-            import traceback
-            traceback.print_exc()  
+            logger.exception("Failed to confirm payment")
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -189,49 +376,125 @@ class PaymentSuccessView(APIView):
 
 
 
-class ManyChatPaymentCheck(APIView):
+class StripeClientStatsView(APIView):
+    """Connection pool counters of the shared Stripe client and its circuit breaker states (staff only)"""
+    # No authentication is configured project-wide; read the admin session.
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAdminUser]
     
-    
-    def get(self, request, fb_id):
+    def get(self, request):
+        return Response({**pool_stats(), 'circuits': circuit.breaker_stats()}, status=status.HTTP_200_OK)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class PaymentExportView(View):
+    """Stream payments as CSV or JSON lines for finance
+
+    GET parameters: format (csv or jsonl), gzip=1, date_from and date_to
+    (YYYY-MM-DD, inclusive), status, package, currency, and
+    include_archived=1 to add payments moved to payments_archive. Staff only
+    (admin login).
+    """
+
+    CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request):
+        export_format = request.GET.get('format', 'csv')
+        compress = request.GET.get('gzip') in ('1', 'true')
         try:
-            payment = PaymentModel.objects.filter(
-                fb_id=fb_id,
-                manychat_payment=False
-            ).latest('updated_at')
-            
-            print(f"📋 Checking payment for fb_id={fb_id}: {payment}")
-            
-            # ✅ FIXED: Check if manychat_payment is FALSE (not TRUE)
-            if not payment.manychat_payment:
-                payment.manychat_payment = True
-                payment.save()
-                
-                print(f"✅ ManyChat payment marked for fb_id={fb_id}, package={payment.package}")
-                
-                return Response({
-                    'success': payment.package,
-                    'payment_status': payment.payment_status,
-                    'amount': payment.amount,
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response(
-                    {'success': False, 'message': 'Payment already checked'}, 
-                    status=status.HTTP_200_OK
-                )
-                
-        except PaymentModel.DoesNotExist:
-            print(f"❌ No payments found for fb_id={fb_id}")
-            return Response(
-                {'success': False, 'message': 'No payments found'}, 
-                status=status.HTTP_404_NOT_FOUND
+            querysets = exports.export_querysets(
+                include_archived=request.GET.get('include_archived') in ('1', 'true'),
+                date_from=request.GET.get('date_from'),
+                date_to=request.GET.get('date_to'),
+                status=request.GET.get('status'),
+                package=request.GET.get('package'),
+                currency=request.GET.get('currency'),
             )
-        except Exception as e:
-            print(f"❌ Error in ManyChat check: {str(e)}")
-            return Response(
-                {'error': str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        
+            chunks = exports.export_chunks(querysets, export_format, compress)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        filename = f"payments-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"
+        if compress:
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            chunks,
+            content_type='application/gzip' if compress else self.CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class PaymentLookupView(View):
+    """A payment by Stripe PaymentIntent id, whether live or archived (staff only)"""
+
+    def get(self, request, payment_intent_id):
+        payment = archive.find_payment(payment_intent_id)
+        if payment is None:
+            return JsonResponse({'error': 'Payment not found'}, status=404)
+        data = {field: getattr(payment, field) for field in archive.ARCHIVE_FIELDS}
+        data['amount'] = payment.amount
+        data['archived'] = isinstance(payment, ArchivedPaymentModel)
+        return JsonResponse(data)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class RevenueReportView(View):
+    """Revenue totals from the rollup for dashboards
+
+    GET parameters: date_from and date_to (YYYY-MM-DD, inclusive), package,
+    currency, and group_by, a comma-separated subset of day,package,currency
+    (default: all three). Staff only (admin login).
+    """
+
+    def get(self, request):
+        try:
+            filters = {
+                'date_from': self.parse_day(request.GET.get('date_from')),
+                'date_to': self.parse_day(request.GET.get('date_to')),
+                'package': request.GET.get('package'),
+            }
+            if request.GET.get('currency'):
+                filters['currency'] = normalize_currency(request.GET['currency'])
+            group_by = request.GET.get('group_by', ','.join(rollups.GROUP_BY)).split(',')
+            unknown = set(group_by) - set(rollups.GROUP_BY)
+            if unknown:
+                raise ValueError(f"Cannot group by: {', '.join(sorted(unknown))}")
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        with use_replica():
+            rows = rollups.report(group_by=group_by, **filters)
+        return JsonResponse({'results': rows})
+
+    @staticmethod
+    def parse_day(value):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        return day
+
+
+def has_metrics_token(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.strip().encode(), settings.METRICS_TOKEN.encode(),
+    )
+
+
+def metrics_view(request):
+    """Request, Stripe and webhook metrics of this process in Prometheus text format
+
+    For staff users and for requests bearing METRICS_TOKEN.
+    """
+    if not (request.user.is_active and request.user.is_staff) and not has_metrics_token(request):
+        return HttpResponse(status=403)
+    return HttpResponse(REGISTRY.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class EncryptDataView(APIView):
     """Encrypt data using Stripe's encryption"""
     
@@ -307,133 +570,113 @@ class EncryptDataView(APIView):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class StripeWebhookView(APIView):
-    """Handle Stripe webhook events"""
+    """Handle Stripe webhook events
+
+    The signature is checked over the raw body, and events of types we do
+    not handle are acknowledged without being parsed. Handled events are
+    decoded once into plain dicts.
+    """
     
     def post(self, request):
-        print("=" * 80)
-        print("🔔 WEBHOOK ENDPOINT HIT!")
-        print("=" * 80)
-        
         payload = request.body
         sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
-        webhook_secret = config('STRIPE_WEBHOOK_SECRET', default='')
         
-        print(f"Webhook Secret Configured: {bool(webhook_secret)}")
-        print(f"Signature Header Present: {bool(sig_header)}")
-        
-        if not webhook_secret:
-            print("⚠️ No webhook secret configured!")
+        if not settings.STRIPE_WEBHOOK_SECRETS:
+            logger.warning("Stripe webhook received but STRIPE_WEBHOOK_SECRETS is not configured")
             return HttpResponse(status=200)
         
         try:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, webhook_secret
+            verify_signature(
+                payload, sig_header, settings.STRIPE_WEBHOOK_SECRETS, settings.STRIPE_WEBHOOK_TOLERANCE_SECONDS,
             )
-            print(f"✅ Event Type: {event['type']}")
-        except ValueError as e:
-            print(f"❌ ValueError: {e}")
-            return HttpResponse(status=400)
         except stripe.error.SignatureVerificationError as e:
-            print(f"❌ Signature Verification Failed: {e}")
+            logger.warning("Stripe webhook signature verification failed", extra={
+                'error': str(e),
+                'signature_present': bool(sig_header),
+            })
+            webhook_signature_failures.inc('bad_signature' if sig_header else 'missing_signature')
             return HttpResponse(status=400)
         
-        # Handle the event
-        if event['type'] == 'payment_intent.succeeded':
-            print("💰 Processing payment_intent.succeeded")
-            payment_intent = event['data']['object']
-            self.handle_payment_success(payment_intent)
-            
-        elif event['type'] == 'payment_intent.payment_failed':
-            print("❌ Processing payment_intent.payment_failed")
-            payment_intent = event['data']['object']
-            self.handle_payment_failed(payment_intent)
+        if not may_be_handled(payload):
+            webhook_events.inc(peek_event_type(payload), 'ignored')
+            return HttpResponse(status=200)
         
-        print("=" * 80)
-        return HttpResponse(status=200)
-    
-    def handle_payment_success(self, payment_intent):
-        """Update payment status to completed"""
-        payment = PaymentModel.objects.filter(
-            stripe_payment_intent_id=payment_intent['id']
-        ).first()
+        try:
+            event = loads(payload)
+            if not isinstance(event, dict) or 'id' not in event or 'type' not in event:
+                raise ValueError("Not a Stripe event")
+        except ValueError as e:
+            logger.warning("Invalid Stripe webhook payload", extra={'error': str(e)})
+            webhook_signature_failures.inc('invalid_payload')
+            return HttpResponse(status=400)
         
-        if payment:
-            payment.payment_status = 'completed'
-            
-            if payment_intent.get('customer'):
-                payment.stripe_customer_id = payment_intent['customer']
-            
-            if payment_intent.get('charges', {}).get('data'):
-                charge = payment_intent['charges']['data'][0]
-                payment_method_details = charge.get('payment_method_details', {})
-                
-                if payment_method_details.get('type') == 'card':
-                    wallet = payment_method_details.get('card', {}).get('wallet', {})
-                    wallet_type = wallet.get('type')
-                    
-                    if wallet_type == 'google_pay':
-                        payment.payment_method = 'google_pay'
-                    elif wallet_type == 'apple_pay':
-                        payment.payment_method = 'apple_pay'
-                    else:
-                        payment.payment_method = 'card'
-            
-            payment.save()
-            print(f"✅ Payment {payment.id} marked as completed via webhook")
-        else:
-            print(f"⚠️ Payment not found for intent: {payment_intent['id']}")
-    
-    def handle_payment_failed(self, payment_intent):
-        """Update payment status to failed"""
-        payment = PaymentModel.objects.filter(
-            stripe_payment_intent_id=payment_intent['id']
-        ).first()
+        logger.info("Stripe webhook received", extra={
+            'event_id': event['id'],
+            'event_type': event['type'],
+            'sampled': True,
+        })
         
-        if payment:
-            payment.payment_status = 'failed'
-            payment.save()
-            print(f"❌ Payment {payment.id} marked as failed")
+        if settings.STRIPE_WEBHOOK_QUEUE:
+            if event['type'] in HANDLED_EVENT_TYPES:
+                WebhookEventModel.objects.create(
+                    event_id=event['id'],
+                    event_type=event['type'],
+                    payload=payload.decode('utf-8'),
+                )
+                logger.info("Stripe webhook queued", extra={'event_id': event['id'], 'sampled': True})
+                webhook_events.inc(event['type'], 'queued')
+            else:
+                webhook_events.inc(event['type'], 'ignored')
+            return HttpResponse(status=200)
+        
+        # Handle the event
+        try:
+            process_event(event)
+        except UnmatchedEventError as e:
+            # Not acknowledged, so Stripe delivers it again later.
+            logger.warning("Stripe event for an unknown payment", extra={'event_id': event['id'], 'error': str(e)})
+            return HttpResponse(status=404)
+        
+        return HttpResponse(status=200)
 
 
 class ManyChatPaymentCheck(APIView):
     """Check payment status for ManyChat integration"""
+    throttle_classes = [PaymentRateThrottle]
+    rate_limit_view = 'manychat_payment_check'
     
     def get(self, request, fb_id):
         try:
-            payment = PaymentModel.objects.filter(
-                fb_id=fb_id,
-                manychat_payment=False
-            ).latest('updated_at')
-            
-            print(f"📋 Checking payment for fb_id={fb_id}: {payment}")
-            
-            # ✅ FIXED: Check if manychat_payment is FALSE (not TRUE)
-            if not payment.manychat_payment:
-                payment.manychat_payment = True
-                payment.save()
-                
-                print(f"✅ ManyChat payment marked for fb_id={fb_id}, package={payment.package}")
-                
-                return Response({
-                    'success': payment.package,
-                    'payment_status': payment.payment_status,
-                    'amount': payment.amount,
-                }, status=status.HTTP_200_OK)
-            else:
+            # Most polls find nothing to claim; answer those from a replica
+            # and only take the primary's write path when there is work.
+            with use_replica(fb_id) as on_replica:
+                unclaimed = not on_replica or PaymentModel.objects.filter(
+                    fb_id=fb_id, manychat_payment=False
+                ).exists()
+            payment = PaymentModel.objects.claim_for_manychat(fb_id) if unclaimed else None
+            
+            if payment is None:
+                logger.info("No unclaimed payment for ManyChat", extra={'fb_id': fb_id, 'sampled': True})
                 return Response(
-                    {'success': False, 'message': 'Payment already checked'}, 
-                    status=status.HTTP_200_OK
+                    {'success': False, 'message': 'No payments found'}, 
+                    status=status.HTTP_404_NOT_FOUND
                 )
+            
+            logger.info("ManyChat payment claimed", extra={
+                'fb_id': fb_id,
+                'payment_id': payment.id,
+                'package': payment.package,
+            })
+            
+            return Response({
+                'success': payment.package,
+                'payment_status': payment.payment_status,
+                'amount': payment.amount,
+            }, status=status.HTTP_200_OK)
                 
-        except PaymentModel.DoesNotExist:
-            print(f"❌ No payments found for fb_id={fb_id}")
-            return Response(
-                {'success': False, 'message': 'No payments found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
         except Exception as e:
-            print(f"❌ Error in ManyChat check: {str(e)}")
+            logger.exception("ManyChat payment check failed", extra={'fb_id': fb_id})
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
@@ -0,0 +1,320 @@
+import hmac
+import json
+import logging
+import re
+import time
+from datetime import timedelta
+from hashlib import sha256
+
+import stripe
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import events, status_cache
+from .metrics import webhook_events
+from .models import ArchivedPaymentModel, PaymentModel, ProcessedEventModel, WebhookEventModel
+from .routers import mark_written
+from .tracing import bind_request_id
+
+try:
+    import orjson
+except ImportError:  # json gives the same dicts, only slower
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+HANDLED_EVENT_TYPES = (
+    'payment_intent.succeeded',
+    'payment_intent.payment_failed',
+)
+
+# A handled event's payload necessarily contains its type as a JSON string.
+_HANDLED_TYPE_MARKERS = tuple(f'"{event_type}"'.encode() for event_type in HANDLED_EVENT_TYPES)
+
+# Stripe currently serializes the event's own type as its last key, after
+# data. Nothing guarantees that key order, hence peek_event_type's caveat.
+_LAST_TYPE_RE = re.compile(rb'"type"\s*:\s*"([\w.]{1,100})"\s*}\s*$')
+
+
+class UnmatchedEventError(Exception):
+    """A handled event is about a PaymentIntent with no payment row (yet)
+
+    Raised so the event is delivered again: the webhook view answers
+    non-2xx and the queue worker retries it with backoff.
+    """
+
+
+def loads(payload):
+    """Decode a webhook payload (bytes or str) into plain dicts and lists"""
+    return orjson.loads(payload) if orjson else json.loads(payload)
+
+
+def verify_signature(payload, sig_header, secrets, tolerance):
+    """Check a Stripe-Signature header against the raw payload bytes
+
+    Accepts a v1 signature made with any of secrets, so an old and a new
+    endpoint secret can both be active while rotating. Raises
+    stripe.error.SignatureVerificationError like stripe.Webhook.
+    """
+    timestamp = None
+    signatures = []
+    for item in (sig_header or '').split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            timestamp = value
+        elif key == 'v1':
+            signatures.append(value.encode())
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise stripe.error.SignatureVerificationError("Unable to extract timestamp and signatures from header", sig_header, payload)
+    if tolerance and int(timestamp) < time.time() - tolerance:
+        raise stripe.error.SignatureVerificationError("Timestamp outside the tolerance zone", sig_header, payload)
+
+    signed = timestamp.encode() + b'.' + payload
+    for secret in secrets:
+        expected = hmac.new(secret.encode(), signed, sha256).hexdigest().encode()
+        if any(hmac.compare_digest(expected, signature) for signature in signatures):
+            return
+    raise stripe.error.SignatureVerificationError("No signatures found matching the expected signature for payload", sig_header, payload)
+
+
+def may_be_handled(payload):
+    """False when payload cannot be an event of a HANDLED_EVENT_TYPES type, without parsing it"""
+    return any(marker in payload for marker in _HANDLED_TYPE_MARKERS)
+
+
+def peek_event_type(payload):
+    """Best-effort event type of an unparsed payload, for metrics and logs only
+
+    Assumes "type" is the payload's last key, which Stripe does not promise;
+    gives 'unknown' otherwise. Never use it to decide how to handle an event.
+    """
+    match = _LAST_TYPE_RE.search(payload[-200:])
+    return match.group(1).decode() if match else 'unknown'
+
+
+def process_event(event):
+    """Apply a verified Stripe event to the payments table, at most once per event id
+
+    Returns True if the event moved a payment and False if it was ignored,
+    already processed, or refused by the payment's state machine (e.g. a
+    failure after completion); those are recorded as processed. Raises
+    UnmatchedEventError, without recording the event id, when no payment
+    has the event's intent, e.g. because it arrived before the payment row
+    was committed.
+    """
+    if event['type'] not in HANDLED_EVENT_TYPES:
+        webhook_events.inc(event['type'], 'ignored')
+        return False
+
+    # Cheap read first so redelivered events never take the write lock.
+    if ProcessedEventModel.objects.filter(event_id=event['id']).exists():
+        logger.info("Skipping already processed Stripe event", extra={'event_id': event['id'], 'sampled': True})
+        webhook_events.inc(event['type'], 'duplicate')
+        return False
+
+    try:
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    ProcessedEventModel.objects.create(event_id=event['id'], event_type=event['type'])
+            except IntegrityError:
+                logger.info("Skipping already processed Stripe event", extra={'event_id': event['id'], 'sampled': True})
+                webhook_events.inc(event['type'], 'duplicate')
+                return False
+
+            if event['type'] == 'payment_intent.succeeded':
+                updated = handle_payment_success(event['data']['object'])
+
+            elif event['type'] == 'payment_intent.payment_failed':
+                updated = handle_payment_failed(event['data']['object'])
+
+            if not updated:
+                payment_intent_id = event['data']['object']['id']
+                if not payment_exists(payment_intent_id):
+                    # Rolls the event id back with the transaction.
+                    raise UnmatchedEventError(f"No payment for PaymentIntent {payment_intent_id}")
+                webhook_events.inc(event['type'], 'refused')
+                return False
+    except UnmatchedEventError:
+        webhook_events.inc(event['type'], 'unmatched')
+        raise
+    except Exception:
+        webhook_events.inc(event['type'], 'error')
+        raise
+
+    webhook_events.inc(event['type'], 'processed')
+    return True
+
+
+def payment_exists(payment_intent_id):
+    """Whether a live or archived payment has this PaymentIntent"""
+    return (
+        PaymentModel.objects.filter(stripe_payment_intent_id=payment_intent_id).exists()
+        or ArchivedPaymentModel.objects.filter(stripe_payment_intent_id=payment_intent_id).exists()
+    )
+
+
+def payment_method_from_intent(payment_intent):
+    """Return our payment_method choice for a PaymentIntent's latest charge
+
+    Needs latest_charge expanded; webhook payloads only carry its id, which
+    gives None.
+    """
+    charge = payment_intent.get('latest_charge')
+    if not charge or isinstance(charge, str):
+        return None
+
+    payment_method_details = charge.get('payment_method_details') or {}
+    if payment_method_details.get('type') != 'card':
+        return None
+
+    wallet = (payment_method_details.get('card') or {}).get('wallet') or {}
+    wallet_type = wallet.get('type')
+    if wallet_type in ('google_pay', 'apple_pay'):
+        return wallet_type
+    return 'card'
+
+
+def invalidate_status_on_commit(payment_intent_id):
+    transaction.on_commit(lambda: status_cache.invalidate(payment_intent_id))
+
+
+def fb_id_of(payment_intent):
+    return (payment_intent.get('metadata') or {}).get('fb_id')
+
+
+def handle_payment_success(payment_intent):
+    """Update payment status to completed; returns the number of payments moved"""
+    fields = {}
+    if payment_intent.get('customer'):
+        fields['stripe_customer_id'] = payment_intent['customer']
+
+    payment_method = payment_method_from_intent(payment_intent)
+    if payment_method:
+        fields['payment_method'] = payment_method
+
+    updated = PaymentModel.objects.filter(
+        stripe_payment_intent_id=payment_intent['id']
+    ).transition('completed', **fields)
+
+    if updated:
+        invalidate_status_on_commit(payment_intent['id'])
+        mark_written(payment_intent['id'], fb_id_of(payment_intent))
+        events.publish_status(payment_intent['id'], fb_id_of(payment_intent), 'completed', payment_method)
+        logger.info("Payment completed via webhook", extra={'payment_intent_id': payment_intent['id']})
+    else:
+        logger.warning("No completable payment for intent", extra={'payment_intent_id': payment_intent['id']})
+    return updated
+
+
+def handle_payment_failed(payment_intent):
+    """Update payment status to failed; returns the number of payments moved"""
+    updated = PaymentModel.objects.filter(
+        stripe_payment_intent_id=payment_intent['id']
+    ).transition('failed')
+
+    if updated:
+        invalidate_status_on_commit(payment_intent['id'])
+        mark_written(payment_intent['id'], fb_id_of(payment_intent))
+        events.publish_status(payment_intent['id'], fb_id_of(payment_intent), 'failed')
+        logger.info("Payment failed via webhook", extra={'payment_intent_id': payment_intent['id']})
+    return updated
+
+
+def purge_processed_events(ttl_days):
+    """Forget processed event ids older than ttl_days"""
+    cutoff = timezone.now() - timedelta(days=ttl_days)
+    deleted, _ = ProcessedEventModel.objects.filter(processed_at__lt=cutoff).delete()
+    return deleted
+
+
+def claim_events(worker_id, batch_size, lease_seconds):
+    """Lease a batch of queued events to one worker"""
+    now = timezone.now()
+    claimable = Q(status__in=['pending', 'processing']) & (
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    )
+    ids = list(
+        WebhookEventModel.objects.filter(claimable)
+        .order_by('id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+
+    # The claimable condition is repeated in the UPDATE so that two workers
+    # racing for the same rows cannot both take them.
+    WebhookEventModel.objects.filter(claimable, id__in=ids).update(
+        status='processing',
+        locked_by=worker_id,
+        locked_until=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1,
+    )
+    return list(WebhookEventModel.objects.filter(id__in=ids, locked_by=worker_id))
+
+
+def intent_id_of(queued_event):
+    """PaymentIntent id a queued event is about, or None if its payload has none"""
+    try:
+        obj = loads(queued_event.payload)['data']['object']
+    except (ValueError, KeyError, TypeError):
+        return None
+    return obj.get('id') if isinstance(obj, dict) else None
+
+
+def group_by_intent(queued_events):
+    """Split a claimed batch into lists of events about the same PaymentIntent
+
+    Each list keeps queue order and must be processed serially, so that
+    e.g. payment_failed and then succeeded for one intent apply in order.
+    Events without an intent id form groups of their own.
+    """
+    groups = {}
+    for queued_event in queued_events:
+        key = intent_id_of(queued_event) or ('event', queued_event.pk)
+        groups.setdefault(key, []).append(queued_event)
+    return list(groups.values())
+
+
+def run_queued_event(queued_event, max_attempts):
+    """Process one leased event; it is only removed from the queue on success
+
+    The event leaves the queue in the transaction that applies it, and only
+    while this worker still holds it. Once its lease has run out and
+    another worker has claimed it, the event is left to that worker, so it
+    is never applied twice or out of order with its group.
+    """
+    try:
+        with bind_request_id(queued_event.event_id), transaction.atomic():
+            deleted, _ = WebhookEventModel.objects.filter(
+                pk=queued_event.pk, locked_by=queued_event.locked_by
+            ).delete()
+            if not deleted:
+                logger.warning("Lease on queued Stripe event lost to another worker", extra={
+                    'event_id': queued_event.event_id,
+                })
+                return False
+            process_event(loads(queued_event.payload))
+    except Exception as e:
+        # An event that beat its payment row is expected; no traceback.
+        log = logger.warning if isinstance(e, UnmatchedEventError) else logger.exception
+        log("Queued Stripe event failed", extra={
+            'event_id': queued_event.event_id,
+            'attempts': queued_event.attempts,
+        })
+        # Failed events go back to the queue with an exponential delay until
+        # they run out of attempts.
+        retry_in = min(2 ** queued_event.attempts, 300)
+        WebhookEventModel.objects.filter(
+            pk=queued_event.pk, locked_by=queued_event.locked_by
+        ).update(
+            status='failed' if queued_event.attempts >= max_attempts else 'pending',
+            last_error=str(e),
+            locked_by=None,
+            locked_until=timezone.now() + timedelta(seconds=retry_in),
+        )
+        return False
+
+    return True
@@ -0,0 +1,86 @@
+"""Compare the sync and async payment API views against a mock Stripe
+
+    python benchmarks/bench_async_views.py --requests 200 --concurrency 1 16 64 --latency-ms 50
+
+Each view is called in-process (no HTTP server in front of Django), so the
+numbers isolate the cost of waiting on Stripe: the sync views hold a thread
+per in-flight Stripe call while the async views share one event loop.
+"""
+import argparse
+import json
+
+from harness import run_async, run_threaded, setup_django
+from mock_stripe import MockStripeServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--latency-ms', type=float, default=50,
+                        help="Simulated Stripe round trip")
+    args = parser.parse_args()
+
+    stripe_server = MockStripeServer(latency_ms=args.latency_ms).start()
+    teardown = setup_django(stripe_server.url)
+
+    from django.test import AsyncRequestFactory, RequestFactory
+    from ChicShot_Payment_App.async_views import AsyncCreatePaymentIntentView, AsyncPaymentSuccessView
+    from ChicShot_Payment_App.stripe_client import pool_stats, reset_stripe_client
+    from ChicShot_Payment_App.views import CreatePaymentIntentView, PaymentSuccessView
+
+    factory = RequestFactory()
+    async_factory = AsyncRequestFactory()
+    create_body = json.dumps({'fb_id': 'bench', 'amount': '9.99', 'package': 'Basic'})
+    intent_ids = []
+
+    def sync_create(i):
+        response = CreatePaymentIntentView.as_view()(factory.post(
+            '/api/create-payment-intent/', create_body, content_type='application/json'))
+        intent_ids.append(response.data.get('payment_intent_id'))
+        return response.status_code == 201
+
+    async def async_create(i):
+        response = await AsyncCreatePaymentIntentView.as_view()(async_factory.post(
+            '/api/create-payment-intent/', create_body, content_type='application/json'))
+        return response.status_code == 201
+
+    def success_body(i):
+        return json.dumps({'payment_intent_id': intent_ids[i % len(intent_ids)]})
+
+    def sync_success(i):
+        response = PaymentSuccessView.as_view()(factory.post(
+            '/api/payment-success/', success_body(i), content_type='application/json'))
+        return response.status_code == 200
+
+    async def async_success(i):
+        response = await AsyncPaymentSuccessView.as_view()(async_factory.post(
+            '/api/payment-success/', success_body(i), content_type='application/json'))
+        return response.status_code == 200
+
+    cases = [
+        ('create-payment-intent', sync_create, async_create),
+        ('payment-success', sync_success, async_success),
+    ]
+    try:
+        print(f"{'view':<24}{'mode':<7}{'conc':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}")
+        for name, sync_call, async_call in cases:
+            for concurrency in args.concurrency:
+                for mode, result in (
+                    ('sync', run_threaded(sync_call, args.requests, concurrency)),
+                    ('async', run_async(async_call, args.requests, concurrency)),
+                ):
+                    print(f"{name:<24}{mode:<7}{concurrency:>6}{result['rps']:>9}"
+                          f"{result['p50_ms']:>9}{result['p95_ms']:>9}{result['errors']:>8}")
+                stats = pool_stats()
+                # Each run_async() call has its own event loop, and the
+                # client's httpx pool cannot be shared across loops.
+                reset_stripe_client()
+        print(f"Stripe connection pool after the last sync run: {stats}")
+    finally:
+        teardown()
+        stripe_server.stop()
+
+
+if __name__ == '__main__':
+    main()
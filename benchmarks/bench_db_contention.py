@@ -0,0 +1,104 @@
+"""Write throughput under contention for each database configuration
+
+    python benchmarks/bench_db_contention.py --requests 1000 --concurrency 1 8 32
+    DB_HOST=... DB_PASSWORD=... python benchmarks/bench_db_contention.py --modes postgresql
+
+Each mode runs in its own process against a fresh test database and
+measures the three writes that contend in production: inserting payments,
+applying payment_intent.succeeded webhooks and ManyChat claims. Lock
+timeouts ("database is locked") are reported as errors.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from harness import run_threaded, setup_django
+
+MODES = {
+    'sqlite-default': {'DATABASE_ENGINE': 'sqlite3', 'SQLITE_OPTIMIZED': 'False'},
+    'sqlite-optimized': {'DATABASE_ENGINE': 'sqlite3', 'SQLITE_OPTIMIZED': 'True'},
+    'postgresql': {'DATABASE_ENGINE': 'postgresql'},
+}
+
+
+def run_mode(requests, concurrency_levels):
+    """Benchmark the configured database; called in the child process"""
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    teardown = setup_django('http://127.0.0.1:9')
+
+    from ChicShot_Payment_App.models import PaymentModel
+    from ChicShot_Payment_App.webhooks import process_event
+
+    results = []
+    try:
+        for concurrency in concurrency_levels:
+            prefix = f"c{concurrency}"
+
+            def insert(i):
+                PaymentModel.objects.create(
+                    fb_id=f"{prefix}-{i % 50}",
+                    amount_minor=999,
+                    stripe_payment_intent_id=f"pi_{prefix}_{i}",
+                )
+                return True
+
+            def webhook(i):
+                process_event({
+                    'id': f"evt_{prefix}_{i}",
+                    'type': 'payment_intent.succeeded',
+                    'data': {'object': {'id': f"pi_{prefix}_{i}", 'customer': None}},
+                })
+                return True
+
+            def claim(i):
+                PaymentModel.objects.claim_for_manychat(f"{prefix}-{i % 50}")
+                return True
+
+            for operation, call in (('insert', insert), ('webhook', webhook), ('claim', claim)):
+                result = run_threaded(call, requests, concurrency)
+                results.append({'operation': operation, 'concurrency': concurrency, **result})
+    finally:
+        teardown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000,
+                        help="Operations per kind and concurrency level")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['sqlite-default', 'sqlite-optimized'])
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.requests, args.concurrency)))
+        return
+
+    all_results = {}
+    print(f"{'mode':<18}{'operation':<10}{'conc':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for mode in args.modes:
+        child = subprocess.run(
+            [sys.executable, __file__, '--child', '--requests', str(args.requests),
+             '--concurrency', *map(str, args.concurrency)],
+            env={**os.environ, **MODES[mode]}, capture_output=True, text=True,
+        )
+        if child.returncode:
+            print(f"{mode}: failed\n{child.stderr.strip().splitlines()[-1] if child.stderr else ''}")
+            continue
+        all_results[mode] = json.loads(child.stdout.strip().splitlines()[-1])
+        for result in all_results[mode]:
+            print(f"{mode:<18}{result['operation']:<10}{result['concurrency']:>6}{result['rps']:>9}"
+                  f"{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}{result['errors']:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'requests': args.requests, 'results': all_results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
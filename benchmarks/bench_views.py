@@ -0,0 +1,164 @@
+"""Load test the payment API views against a mock Stripe
+
+    python benchmarks/bench_views.py --requests 500 --concurrency 1 8 32 --output bench.json
+    python benchmarks/bench_views.py --compare bench.json
+
+Requests go through the full Django stack (URL routing and middleware) in
+process, with a thread pool standing in for the server's worker threads.
+Webhooks are signed with STRIPE_WEBHOOK_SECRET. Results are written as JSON,
+tagged with the current commit, so two runs can be compared with --compare.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from harness import ROOT, run_threaded, setup_django
+from mock_stripe import MockStripeServer, sign_payload
+
+VIEWS = ('create-payment-intent', 'payment-success', 'stripe-webhook', 'manychat-payment-check')
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'view':<26}{'conc':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'q/req':>7}{'errors':>8}"
+    if baseline:
+        header += f"{'rps Δ':>9}{'p95 Δ':>9}"
+    print(header)
+    previous = {(r['view'], r['concurrency']): r for r in (baseline or {}).get('results', [])}
+    for result in results:
+        line = (f"{result['view']:<26}{result['concurrency']:>6}{result['rps']:>9}{result['p50_ms']:>9}"
+                f"{result['p95_ms']:>9}{result['p99_ms']:>9}{result['queries_per_request']:>7}{result['errors']:>8}")
+        before = previous.get((result['view'], result['concurrency']))
+        if before:
+            line += f"{_change(before['rps'], result['rps']):>9}{_change(before['p95_ms'], result['p95_ms']):>9}"
+        print(line)
+
+
+def _change(before, after):
+    return f"{(after - before) / before * 100:+.0f}%" if before else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500,
+                        help="Requests per view and concurrency level")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--latency-ms', type=float, default=50,
+                        help="Simulated Stripe round trip")
+    parser.add_argument('--views', nargs='+', choices=VIEWS, default=list(VIEWS))
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Show changes against an earlier --output file")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    os.environ.setdefault('STRIPE_WEBHOOK_SECRET', 'whsec_bench')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # The payment-success view should reach Stripe, not settle from the
+    # database, so intents stay open.
+    stripe_server = MockStripeServer(latency_ms=args.latency_ms, intent_status='processing').start()
+    teardown = setup_django(stripe_server.url)
+
+    from django.conf import settings
+    from django.test import Client
+
+    webhook_secret = settings.STRIPE_WEBHOOK_SECRETS[0]
+    # ManyChat checks 404 by design once payments are claimed.
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    local = threading.local()
+    created = []
+    # One sequence for the whole run: i restarts at 0 for each concurrency
+    # level and view, and a repeated fb_id would get its open intent reused.
+    fb_ids = itertools.count()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        return local.client
+
+    def create(i):
+        fb_id = f"bench-{next(fb_ids)}"
+        response = client().post('/api/create-payment-intent/', json.dumps({
+            'fb_id': fb_id, 'amount': '9.99', 'package': 'Basic',
+        }), content_type='application/json')
+        if response.status_code != 201:
+            return False
+        created.append((fb_id, response.json()['payment_intent_id']))
+        return True
+
+    def payment_success(i):
+        intent_id = created[i % len(created)][1]
+        response = client().post('/api/payment-success/', json.dumps({
+            'payment_intent_id': intent_id,
+        }), content_type='application/json')
+        return response.status_code == 200
+
+    def webhook(i):
+        intent_id = created[i % len(created)][1]
+        payload = json.dumps(stripe_server.webhook_event(intent_id)).encode()
+        response = client().post(
+            '/api/stripe-webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_payload(payload, webhook_secret),
+        )
+        return response.status_code == 200
+
+    def manychat(i):
+        # A 404 is the normal answer once fb_id's payments are all claimed.
+        response = client().get(f'/manychat-payment-check/{created[i % len(created)][0]}/')
+        return response.status_code in (200, 404)
+
+    calls = {
+        'create-payment-intent': create,
+        'payment-success': payment_success,
+        'stripe-webhook': webhook,
+        'manychat-payment-check': manychat,
+    }
+
+    results = []
+    try:
+        if 'create-payment-intent' not in args.views:
+            # The other views need payments to act on.
+            run_threaded(create, args.requests, max(args.concurrency))
+        for view in VIEWS:
+            if view not in args.views:
+                continue
+            for concurrency in args.concurrency:
+                result = run_threaded(calls[view], args.requests, concurrency)
+                results.append({'view': view, 'concurrency': concurrency, **result})
+    finally:
+        teardown()
+        stripe_server.stop()
+
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'timestamp': int(time.time()),
+                'settings': {
+                    'requests': args.requests,
+                    'latency_ms': args.latency_ms,
+                },
+                'results': results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Shared setup and timing helpers for the benchmark scripts"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def setup_django(stripe_url):
+    """Configure Django against a throwaway migrated SQLite database
+
+    Returns a teardown callable.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ChicShotProject.settings')
+    os.environ['STRIPE_API_BASE'] = stripe_url
+    os.environ.setdefault('STRIPE_SECRET_KEY', 'sk_test_mock')
+
+    import django
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from django.test.runner import DiscoverRunner
+
+    django.setup()
+    from django.conf import settings
+    # Load from one client would only measure the rate limiter's 429s.
+    settings.PAYMENT_RATE_LIMITS['RATES'] = {}
+    if connection.vendor == 'sqlite':
+        # A file database: threads writing to a shared in-memory database
+        # fail with "table is locked" instead of waiting for the lock.
+        tmpdir = tempfile.mkdtemp(prefix='chicshot-bench-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        connection.settings_dict['OPTIONS'].setdefault('timeout', 30)
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+
+    def teardown():
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    return teardown
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, errors, queries=None):
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+    if queries is not None:
+        summary['queries_per_request'] = round(queries / len(latencies), 2) if latencies else 0.0
+    return summary
+
+
+def run_threaded(call, count, concurrency):
+    """Run call(i) count times on a thread pool; call returns True on success"""
+    from django.db import connection
+
+    def timed(i):
+        queries = 0
+
+        def count_query(execute, *args):
+            nonlocal queries
+            queries += 1
+            return execute(*args)
+
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_query):
+                ok = call(i)
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok, queries
+
+    def close_connection(_):
+        connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(count)))
+        list(executor.map(close_connection, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return summarize(
+        [r[0] for r in results], elapsed, sum(not r[1] for r in results), sum(r[2] for r in results),
+    )
+
+
+def run_async(call, count, concurrency):
+    """Run await call(i) count times with at most concurrency in flight"""
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(i):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    ok = await call(i)
+                except Exception:
+                    ok = False
+                return time.perf_counter() - start, ok
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed(i) for i in range(count)))
+        return results, time.perf_counter() - start
+
+    results, elapsed = asyncio.run(main())
+    return summarize([r[0] for r in results], elapsed, sum(not r[1] for r in results))
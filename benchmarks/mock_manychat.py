@@ -0,0 +1,99 @@
+"""Local stand-in for the ManyChat endpoint that receives payment notifications
+
+    python benchmarks/mock_manychat.py --port 12112 --fail-rate 0.2
+    MANYCHAT_NOTIFY_URL=http://127.0.0.1:12112/ python manage.py dispatch_manychat_notifications
+
+Accepts {"payments": [...]} POSTs and prints each payment it receives. With
+--fail-rate a share of requests gets 503, to exercise the dispatcher's
+retries.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockManyChatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.token and self.headers.get('Authorization') != f"Bearer {self.server.token}":
+            return self._send(401, {'status': 'error', 'message': 'Unauthorized'})
+        if random.random() < self.server.fail_rate:
+            return self._send(503, {'status': 'error', 'message': 'Try again later'})
+        payments = json.loads(body)['payments']
+        self.server.record(payments)
+        self._send(200, {'status': 'success', 'received': len(payments)})
+
+    def _send(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MockManyChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, fail_rate=0.0, token='', verbose=False):
+        super().__init__((host, port), MockManyChatHandler)
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.token = token
+        self.verbose = verbose
+        self.requests = 0
+        self.payments = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def record(self, payments):
+        with self._lock:
+            self.requests += 1
+            self.payments.extend(payments)
+        if self.verbose:
+            for payment in payments:
+                print(f"{payment['fb_id']}: {payment['package']} {payment['amount']} {payment['currency'].upper()}")
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12112)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--token', default='', help="Require this Bearer token")
+    args = parser.parse_args()
+
+    server = MockManyChatServer(args.host, args.port, args.latency_ms, args.fail_rate, args.token, verbose=True)
+    print(f"Mock ManyChat listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
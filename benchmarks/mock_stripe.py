@@ -0,0 +1,204 @@
+"""Local stand-in for the parts of the Stripe API this project calls
+
+Run it standalone and point the app at it with STRIPE_API_BASE:
+
+    python benchmarks/mock_stripe.py --port 12111 --latency-ms 50
+    STRIPE_API_BASE=http://127.0.0.1:12111 python manage.py runserver
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+class MockStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self._delay()
+        length = int(self.headers.get('Content-Length') or 0)
+        params = dict(parse_qsl(self.rfile.read(length).decode()))
+        if self.path.rstrip('/') == '/v1/payment_intents':
+            return self._send(200, self.server.create_intent(params, self.headers.get('Idempotency-Key')))
+        self._send(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path'}})
+
+    def do_GET(self):
+        self._delay()
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        expand = [value for key, value in params.items() if key.startswith('expand[')]
+        if url.path.rstrip('/') == '/v1/payment_intents':
+            unknown = [path for path in expand if path != 'data.latest_charge']
+            if unknown:
+                return self._send_unexpandable(unknown[0])
+            return self._send(200, self.server.list_intents(params, expand_charge=bool(expand)))
+        unknown = [path for path in expand if path != 'latest_charge']
+        if unknown:
+            return self._send_unexpandable(unknown[0])
+        match = re.fullmatch(r'/v1/payment_intents/([^/?]+)', url.path)
+        if match:
+            intent = self.server.intents.get(match.group(1))
+            if intent is None:
+                return self._send(404, {'error': {
+                    'type': 'invalid_request_error',
+                    'code': 'resource_missing',
+                    'message': f"No such payment_intent: '{match.group(1)}'",
+                }})
+            return self._send(200, self.server.with_status(intent, expand_charge=bool(expand)))
+        self._send(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path'}})
+
+    def _send_unexpandable(self, path):
+        # Like Stripe, e.g. for 'charges', which API version 2022-11-15 removed.
+        self._send(400, {'error': {
+            'type': 'invalid_request_error',
+            'message': f"This property cannot be expanded ({path}).",
+        }})
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def _send(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Request-Id', f"req_{uuid.uuid4().hex[:14]}")
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MockStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, intent_status='succeeded'):
+        super().__init__((host, port), MockStripeHandler)
+        self.latency = latency_ms / 1000
+        self.intent_status = intent_status
+        self.intents = {}
+        self.idempotent_results = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def create_intent(self, params, idempotency_key=None):
+        # Like Stripe, a repeated Idempotency-Key returns the first result.
+        with self._lock:
+            if idempotency_key in self.idempotent_results:
+                return self.idempotent_results[idempotency_key]
+        intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+        intent = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(params.get('amount', 0)),
+            'currency': params.get('currency', 'usd'),
+            'description': params.get('description'),
+            'client_secret': f"{intent_id}_secret_{uuid.uuid4().hex[:24]}",
+            'created': int(time.time()),
+            'customer': None,
+            'metadata': {
+                key[len('metadata['):-1]: value
+                for key, value in params.items() if key.startswith('metadata[')
+            },
+            'status': 'requires_payment_method',
+        }
+        with self._lock:
+            if idempotency_key:
+                intent = self.idempotent_results.setdefault(idempotency_key, intent)
+            self.intents[intent['id']] = intent
+        return intent
+
+    def list_intents(self, params, expand_charge=False):
+        """Newest first, filtered on created[gte]/created[lte], with starting_after paging"""
+        gte = int(params.get('created[gte]', 0))
+        lte = int(params.get('created[lte]', 2 ** 62))
+        with self._lock:
+            intents = [i for i in self.intents.values() if gte <= i['created'] <= lte]
+        intents.sort(key=lambda i: (i['created'], i['id']), reverse=True)
+        if 'starting_after' in params:
+            ids = [i['id'] for i in intents]
+            intents = intents[ids.index(params['starting_after']) + 1:]
+        limit = int(params.get('limit', 10))
+        return {
+            'object': 'list',
+            'url': '/v1/payment_intents',
+            'has_more': len(intents) > limit,
+            'data': [self.with_status(i, expand_charge) for i in intents[:limit]],
+        }
+
+    def with_status(self, intent, expand_charge=False):
+        """The intent as it looks once the customer has paid
+
+        latest_charge is the charge id, or the charge itself when expanded.
+        """
+        intent = dict(intent, status=self.intent_status, latest_charge=None)
+        if self.intent_status == 'succeeded':
+            charge_id = f"ch_{intent['id'][3:]}"
+            intent['latest_charge'] = {
+                'id': charge_id,
+                'object': 'charge',
+                'payment_method_details': {'type': 'card', 'card': {'wallet': None}},
+            } if expand_charge else charge_id
+        return intent
+
+    def webhook_event(self, intent_id, event_type='payment_intent.succeeded'):
+        """A Stripe event for one of our intents, as delivered to the webhook"""
+        with self._lock:
+            intent = self.intents[intent_id]
+        return {
+            'id': f"evt_{uuid.uuid4().hex[:24]}",
+            'object': 'event',
+            'type': event_type,
+            'created': int(time.time()),
+            'data': {'object': self.with_status(intent)},
+        }
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Stripe-Signature header value for a webhook payload (bytes)"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--intent-status', default='succeeded')
+    args = parser.parse_args()
+
+    server = MockStripeServer(args.host, args.port, args.latency_ms, args.intent_status)
+    print(f"Mock Stripe listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()